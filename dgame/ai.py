@@ -8,8 +8,18 @@ http://arainyday.se/projects/python/AStar/AStar_v1.1.tar.gz
 
 Thanks for sharing!
 '''
+from heapq import heappush, heappop, heapify
+from itertools import count
+from collections import deque
+from array import array
+from dgame.stats import stats
+
+PASSABLE = 1
+
+
+class Path(object):
+    __slots__ = ('nodes', 'totalCost')
 
-class Path:
     def __init__(self, nodes, totalCost):
         self.nodes = nodes;
         self.totalCost = totalCost;
@@ -20,7 +30,32 @@ class Path:
     def get_total_move_cost(self):
         return self.totalCost
 
-class Node:
+class Range:
+    def __init__(self, origin, positions):
+        self.origin = origin
+        self.positions = positions  # position -> (move cost, predecessor position)
+
+    def __contains__(self, position):
+        return position in self.positions
+
+    def get_positions(self):
+        return self.positions.keys()
+
+    def get_cost(self, position):
+        return self.positions[position][0]
+
+    def get_path(self, position):
+        '''Positions to walk from the origin to position, without the origin itself.'''
+        path = []
+        while position != self.origin:
+            path.append(position)
+            position = self.positions[position][1]
+        path.reverse()
+        return path
+
+class Node(object):
+    __slots__ = ('location', 'm_cost', 'parent', 'score', 'lid')
+
     def __init__(self, location, m_cost, lid, parent = None):
         self.location = location  # where is this node located
         self.m_cost = m_cost  # total move cost to reach this node
@@ -34,82 +69,599 @@ class Node:
         else:
             return 0
 
+class SearchCache:
+    '''
+    Remember search results until the map changes.
+
+    Results are stored with the revision of the map they were computed on, a new
+    revision drops all of them. Hits and misses are counted for profiling.
+    '''
+
+    def __init__(self, max_size = 4096):
+        self.max_size = max_size
+        self.revision = None
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, revision, compute):
+        '''Return the cached result for key or compute and remember it.'''
+        if revision != self.revision or len(self.results) >= self.max_size:
+            self.results.clear()
+            self.revision = revision
+        if key in self.results:
+            self.hits += 1
+            return self.results[key]
+        self.misses += 1
+        result = self.results[key] = compute()
+        return result
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.results)}
+
 class AStar:
+    '''
+    A* search on a map handler that knows how to create nodes.
+
+    The open list is a binary heap. Nodes that were superseded by a cheaper node
+    for the same location are not removed from the heap, they are skipped when
+    they get popped (lazy deletion). Closed locations and the best known move costs
+    are kept in tables keyed by Node.lid.
+
+    Found paths are cached until the revision of the map handler changes.
+    '''
 
     def __init__(self, maphandler):
         self.mh = maphandler
-
-    def _get_best_open_node(self):
-        best_node = None
-        for n in self.on:
-            if not best_node:
-                best_node = n
-            else:
-                if n.score <= best_node.score:
-                    best_node = n
-        return best_node
+        self.cache = SearchCache()
+        self.expanded = 0  # number of nodes expanded by the last search
 
     def _trace_path(self, n):
-        nodes = [];
-        total_cost = n.m_cost;
-        p = n.parent;
-        nodes.insert(0, n);
-
-        while 1:
-            if p.parent is None:
-                break
+        nodes = []
+        total_cost = n.m_cost
+        p = n.parent
+        nodes.append(n)
 
-            nodes.insert(0, p)
+        while p.parent is not None:
+            nodes.append(p)
             p = p.parent
 
+        nodes.reverse()
         return Path(nodes, total_cost)
 
-    def _handle_node(self, node, end):
-        i = self.o.index(node.lid)
-        self.on.pop(i)
-        self.o.pop(i)
-        self.c.append(node.lid)
+    @stats.timed('AStar.find_path')
+    def find_path(self, from_location, to_location):
+        key = (from_location.x, from_location.y, to_location.x, to_location.y)
+        return self.cache.get(key, self.mh.revision, lambda: self._search(from_location, to_location))
 
-        nodes = self.mh.get_adjacent_nodes(node, end)
+    def invalidate(self, *positions):
+        '''Called by the map handler when the passability of positions changed.'''
+        pass
 
-        for n in nodes:
-            if n.location == end:
-                # reached the destination
-                return n
-            elif n.lid in self.c:
-                # already in close, skip this
+    def _search(self, from_location, to_location):
+        self.expanded = 0
+        end = to_location
+        fnode = self.mh.get_node(from_location, True)
+        closed = set()
+        best = {fnode.lid: fnode.m_cost}
+        tie = count()
+        heap = [(fnode.score, 0, fnode)]
+
+        while heap:
+            node = heappop(heap)[2]
+            if node.lid in closed or node.m_cost > best[node.lid]:
+                # superseded by a cheaper node for the same location
                 continue
-            elif n.lid in self.o:
-                # already in open, check if better score
-                i = self.o.index(n.lid)
-                on = self.on[i];
-                if n.m_cost < on.m_cost:
-                    self.on.pop(i);
-                    self.o.pop(i);
-                    self.on.append(n);
-                    self.o.append(n.lid);
-            else:
-                # new node, append to open list
-                self.on.append(n);
-                self.o.append(n.lid);
+            closed.add(node.lid)
+            self.expanded += 1
+
+            for n in self.mh.get_adjacent_nodes(node, end):
+                if n.location == end:
+                    # reached the destination
+                    return self._trace_path(n)
+                elif n.lid in closed:
+                    continue
+                elif n.lid in best and best[n.lid] <= n.m_cost:
+                    # already in open with a better or equal cost
+                    continue
+                best[n.lid] = n.m_cost
+                # prefer the most recently added node on equal scores
+                heappush(heap, (n.score, -next(tie), n))
 
         return None
 
+
+class HierarchicalAStar(AStar):
+    '''
+    A* on an abstract graph of clusters for long distance searches.
+
+    Every room is a cluster, the tiles outside of rooms are split into clusters of
+    block_size x block_size tiles. Passable tiles with a passable neighbour in another
+    cluster are entrances. Entrances of the same cluster are connected by the length of
+    the shortest path between them inside the cluster, neighbouring entrances of
+    different clusters by one.
+
+    A search from from_location to to_location connects both to the entrances of their
+    clusters, searches the abstract graph and refines the result cluster by cluster. As
+    every tile on a cluster border is an entrance, the path found has the same cost as
+    the one of a plain A* search. Searches shorter than min_distance are plain A*.
+
+    The edges of a cluster are computed when it is used first, invalidate drops the
+    clusters around a position whose passability changed.
+    '''
+
+    def __init__(self, maphandler, rooms, block_size = 16, min_distance = 32):
+        AStar.__init__(self, maphandler)
+        self.rooms = rooms
+        self.block_size = block_size
+        self.min_distance = min_distance
+        self.clusters = {}  # cluster id -> {entrance: [(entrance, cost), ...]}
+        width, height = maphandler.width, maphandler.height
+        self.blocks_per_row = (width + block_size - 1) // block_size
+        self.cluster_map = array('i')
+        for by in range(0, height, block_size):
+            first = len(rooms) + (by // block_size) * self.blocks_per_row
+            row = array('i', [first + x // block_size for x in range(width)])
+            for _ in range(min(block_size, height - by)):
+                self.cluster_map.extend(row)
+        for cid, (x, y, w, h) in enumerate(rooms):
+            for row in range(y, y + h):
+                i = row * width + x
+                self.cluster_map[i:i + w] = array('i', [cid]) * w
+
+    @stats.timed('AStar.find_path')
     def find_path(self, from_location, to_location):
-        self.o = []
-        self.on = []
-        self.c = []
+        key = (from_location.x, from_location.y, to_location.x, to_location.y)
+        if abs(key[0] - key[2]) + abs(key[1] - key[3]) < self.min_distance:
+            return self.cache.get(key, self.mh.revision, lambda: self._search(from_location, to_location))
+        return self.cache.get(key, self.mh.revision, lambda: self._hierarchical_search(key[:2], key[2:]))
 
-        end = to_location
-        fnode = self.mh.get_node(from_location, True)
-        self.on.append(fnode)
-        self.o.append(fnode.lid)
-        next_node = fnode
+    def invalidate(self, *positions):
+        width, height = self.mh.width, self.mh.height
+        cluster_map = self.cluster_map
+        clusters = set()
+        for x, y in positions:
+            i = y * width + x
+            clusters.add(cluster_map[i])
+            if x + 1 < width:
+                clusters.add(cluster_map[i + 1])
+            if x > 0:
+                clusters.add(cluster_map[i - 1])
+            if y + 1 < height:
+                clusters.add(cluster_map[i + width])
+            if y > 0:
+                clusters.add(cluster_map[i - width])
+        for cid in clusters:
+            self.clusters.pop(cid, None)
+
+    def cluster(self, x, y):
+        return self.cluster_map[y * self.mh.width + x]
+
+    def entrances(self, cid):
+        '''The entrances of cluster cid with their edges to the other entrances of the cluster.'''
+        edges = self.clusters.get(cid)
+        if edges is None:
+            edges = self.clusters[cid] = self._build(cid)
+        return edges
+
+    def _bounds(self, cid):
+        if cid < len(self.rooms):
+            return self.rooms[cid]
+        bx, by = (cid - len(self.rooms)) % self.blocks_per_row, (cid - len(self.rooms)) // self.blocks_per_row
+        x, y = bx * self.block_size, by * self.block_size
+        return x, y, min(self.block_size, self.mh.width - x), min(self.block_size, self.mh.height - y)
 
-        while next_node is not None:
-            finish = self._handle_node(next_node, end)
-            if finish:
-                return self._trace_path(finish)
-            next_node = self._get_best_open_node()
+    def _build(self, cid):
+        x, y, w, h = self._bounds(cid)
+        crossings = {}
+        for ey in range(y, y + h):
+            for ex in range(x, x + w):
+                if self.cluster(ex, ey) == cid and self.mh.passable((ex, ey)):
+                    outside = [(n, 1) for n in self.mh.get_adjacent_positions((ex, ey)) if self.cluster(*n) != cid]
+                    if outside:
+                        crossings[(ex, ey)] = outside
+        edges = {}
+        for entrance, outside in crossings.iteritems():
+            edges[entrance] = self._entrance_edges(entrance, cid, crossings) + outside
+        return edges
 
+    def _entrance_edges(self, origin, cid, entrances):
+        '''
+        Edges from origin to the entrances of cluster cid.
+
+        An entrance that is reached on a shortest path through another entrance gets no
+        edge, the path along the edges of that entrance costs the same.
+        '''
+        distances = {origin: 0}
+        through = {origin: False}
+        frontier = deque([origin])
+        while frontier:
+            position = frontier.popleft()
+            self.expanded += 1
+            passing = through[position] or (position != origin and position in entrances)
+            for n in self.mh.get_adjacent_positions(position):
+                if n not in distances:
+                    if self.cluster(*n) == cid:
+                        distances[n] = distances[position] + 1
+                        through[n] = passing
+                        frontier.append(n)
+                elif passing and distances[n] == distances[position] + 1:
+                    through[n] = True
+        return [(e, distances[e]) for e in entrances if e != origin and e in distances and not through[e]]
+
+    def _local_search(self, origin, cid):
+        '''Breadth first search from origin inside cluster cid, return the distances and predecessors.'''
+        distances = {origin: 0}
+        parents = {origin: None}
+        frontier = deque([origin])
+        while frontier:
+            position = frontier.popleft()
+            self.expanded += 1
+            for n in self.mh.get_adjacent_positions(position):
+                if n not in distances and self.cluster(*n) == cid:
+                    distances[n] = distances[position] + 1
+                    parents[n] = position
+                    frontier.append(n)
+        return distances, parents
+
+    def _hierarchical_search(self, start, end):
+        self.expanded = 0
+        if not self.mh.passable(end):
+            return None
+        end_cluster = self.cluster(*end)
+        from_start = self._local_search(start, self.cluster(*start))[0]
+        to_end = self._local_search(end, end_cluster)[0]
+        closed = set()
+        best = {start: 0}
+        parents = {start: None}
+        tie = count()
+        heap = [(self._distance(start, end), 0, start)]
+        while heap:
+            position = heappop(heap)[2]
+            if position in closed:
+                # superseded by a cheaper entry for the same position
+                continue
+            if position == end:
+                return self._refine(parents, end)
+            closed.add(position)
+            for n, cost in self._abstract_edges(position, start, from_start, end, end_cluster, to_end):
+                m_cost = best[position] + cost
+                if n not in closed and (n not in best or m_cost < best[n]):
+                    best[n] = m_cost
+                    parents[n] = position
+                    heappush(heap, (m_cost + self._distance(n, end), next(tie), n))
         return None
+
+    def _abstract_edges(self, position, start, from_start, end, end_cluster, to_end):
+        '''The neighbours of position in the abstract graph with their costs.'''
+        cid = self.cluster(*position)
+        entrances = self.entrances(cid)
+        if position == start:
+            distances = from_start
+        elif position in entrances:
+            distances = None
+        else:
+            # a tile next to the start that is no entrance on its own
+            distances = self._local_search(position, cid)[0]
+        if distances is None:
+            edges = list(entrances[position])
+        else:
+            edges = [(e, distances[e]) for e in entrances if e != position and e in distances]
+            edges.extend((n, 1) for n in self.mh.get_adjacent_positions(position) if self.cluster(*n) != cid)
+        if cid == end_cluster:
+            if position == start and end in from_start:
+                edges.append((end, from_start[end]))
+            elif position in to_end:
+                edges.append((end, to_end[position]))
+        return edges
+
+    def _refine(self, parents, end):
+        '''
+        Turn the abstract path to end into a path of nodes, searching the tiles between entrances of a cluster.
+
+        The move costs of the nodes add up the states of the tiles from the start
+        tile on, as they do in a plain A* search.
+        '''
+        abstract = []
+        position = end
+        while position is not None:
+            abstract.append(position)
+            position = parents[position]
+        abstract.reverse()
+        positions = []
+        for a, b in zip(abstract, abstract[1:]):
+            cid = self.cluster(*a)
+            if self.cluster(*b) != cid:
+                positions.append(b)
+                continue
+            local = self._local_search(a, cid)[1]
+            step = []
+            while b != a:
+                step.append(b)
+                b = local[b]
+            step.reverse()
+            positions.extend(step)
+        states, width = self.mh.grid.states, self.mh.width
+        nodes = []
+        parent = self.mh.get_node(self.mh.get_tile(abstract[0]), True)
+        for x, y in positions:
+            lid = y * width + x
+            parent = Node(self.mh.get_tile((x, y)), states[lid] + parent.m_cost, lid, parent)
+            nodes.append(parent)
+        return Path(nodes, parent.m_cost)
+
+    def _distance(self, a, b):
+        return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+class GridMap(object):
+    '''
+    A map handler on a flat grid of tile states, row by row, for searches without an environment.
+
+    The planning service runs the searches of this module in worker processes on it.
+    '''
+
+    def __init__(self, states, width, height):
+        self.states = states
+        self.width = width
+        self.height = height
+
+    def passable(self, position):
+        x, y = position
+        return 0 <= x < self.width and 0 <= y < self.height and self.states[y * self.width + x] == PASSABLE
+
+    def get_adjacent_positions(self, position):
+        x, y = position
+        return [n for n in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)) if self.passable(n)]
+
+
+class FloodFill:
+    '''
+    Bounded breadth first search from a single location.
+
+    Every move costs one, so the first visit of a position is the cheapest one and
+    a single pass finds everything reachable within the given distance.
+    '''
+
+    def __init__(self, maphandler):
+        self.mh = maphandler
+
+    def find_range(self, from_location, distance):
+        return self.find_range_from(from_location.position, distance)
+
+    def find_range_from(self, origin, distance):
+        '''The Range of the positions reachable from the position origin in distance.'''
+        positions = {origin: (0, None)}
+        frontier = deque([origin])
+
+        while frontier:
+            position = frontier.popleft()
+            cost = positions[position][0] + 1
+            if cost > distance:
+                continue
+            for n in self.mh.get_adjacent_positions(position):
+                if n not in positions:
+                    positions[n] = (cost, position)
+                    frontier.append(n)
+
+        return Range(origin, positions)
+
+
+class SearchTree(object):
+    '''
+    Shortest paths from an origin, grown by a breadth first search that is resumed for every new target.
+
+    The search stops as soon as the target is found, the positions found so far answer
+    later targets right away. Moving the target across the map, like the mouse does, mostly
+    asks for positions next to found ones, which need little or no further search. The
+    tree is valid for one revision of the map, the map handler creates a new one after changes.
+    '''
+
+    def __init__(self, maphandler, origin, revision = None):
+        self.mh = maphandler
+        self.origin = origin
+        self.revision = revision
+        self.parents = {origin: None}
+        self.frontier = deque([origin])
+
+    def path_to(self, target):
+        '''Positions from the origin to target without the origin, None if there is no path.'''
+        if not self.mh.passable(target):
+            return None
+        if target not in self.parents:
+            self._grow(target)
+            if target not in self.parents:
+                return None
+        path = []
+        while target != self.origin:
+            path.append(target)
+            target = self.parents[target]
+        path.reverse()
+        return path
+
+    @stats.timed('SearchTree.grow')
+    def _grow(self, target):
+        parents = self.parents
+        frontier = self.frontier
+        adjacent = self.mh.get_adjacent_positions
+        while frontier:
+            position = frontier.popleft()
+            for n in adjacent(position):
+                if n not in parents:
+                    parents[n] = position
+                    frontier.append(n)
+            if target in parents:
+                return
+
+
+class DistanceField(object):
+    '''
+    Distances from every reachable position to the nearest of several sources.
+
+    sources is called to get the current source positions, e.g. the positions of the
+    heros. A creature chasing them steps to its neighbour with the smallest distance,
+    which costs the same no matter how far away the sources are.
+
+    The map handler reports changed positions to invalidate, the next update only
+    recomputes the distances that depended on those positions. Sources that moved are
+    changed positions too, the old position loses its distance and the new one starts
+    at 0. Every position remembers the source it is nearest to, all positions that
+    depend on a removed source are in its region, so when the regions of the removed
+    sources cover half the field, or a repair would recompute more positions than the
+    field has, the update searches from all sources again instead. Call update once
+    per turn, before the creatures move. Positions further away than max_distance
+    are not part of the field.
+    '''
+
+    def __init__(self, maphandler, sources, max_distance = None):
+        self.mh = maphandler
+        self.sources = sources
+        self.max_distance = max_distance
+        self.distances = {}
+        self.changed = set()
+        self.repaired = 0  # number of positions recomputed by the last update
+        self._sources = None
+        self._owners = {}  # position -> the source it is nearest to
+        self._regions = {}  # source -> number of positions it owns
+
+    def invalidate(self, *positions):
+        '''Called by the map handler when the passability of positions changed.'''
+        if not self.distances:
+            return
+        self.changed.update(positions)
+        if len(self.changed) > len(self.distances):
+            # more changes than positions in the field, search again on the next update
+            self._sources = None
+            self.changed.clear()
+
+    def distance(self, position):
+        '''Steps from position to the nearest source, None if there is no way.'''
+        return self.distances.get(position)
+
+    def next_step(self, position):
+        '''The neighbour of position that is closest to a source, None if position is next to a source or no way exists.'''
+        best = None
+        best_distance = None
+        for n in self.mh.get_adjacent_positions(position):
+            d = self.distances.get(n)
+            if d is not None and (best is None or d < best_distance):
+                best, best_distance = n, d
+        x, y = position
+        if best is None or {(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)} & (self._sources or set()):
+            return None
+        return best
+
+    @stats.timed('DistanceField.update')
+    def update(self):
+        '''Bring the field up to date with the sources and the positions changed since the last update.'''
+        sources = set(self.sources())
+        changed = self.changed
+        self.changed = set()
+        if self._sources is None:
+            self._sources = sources
+            self._compute()
+            return
+        removed = self._sources - sources
+        changed.update(removed, sources - self._sources)
+        self._sources = sources
+        self.repaired = 0
+        if sum(self._regions.get(source, 0) for source in removed) > len(self.distances) // 2:
+            self._compute()
+        elif changed:
+            self._repair(changed, removed)
+
+    def _compute(self):
+        distances = self.distances = dict((source, 0) for source in self._sources)
+        owners = self._owners = dict((source, source) for source in self._sources)
+        regions = self._regions = dict((source, 1) for source in self._sources)
+        frontier = deque(self._sources)
+        while frontier:
+            position = frontier.popleft()
+            d = distances[position] + 1
+            if self.max_distance is not None and d > self.max_distance:
+                continue
+            owner = owners[position]
+            for n in self.mh.get_adjacent_positions(position):
+                if n not in distances:
+                    distances[n] = d
+                    owners[n] = owner
+                    regions[owner] += 1
+                    frontier.append(n)
+        self.repaired = len(distances)
+
+    def _repair(self, changed, removed = ()):
+        distances, owners, regions = self.distances, self._owners, self._regions
+        # find the positions whose shortest paths all lead through a changed position,
+        # and those nearest to a removed source, in order of their distance, so all
+        # possible predecessors are known when a position is checked
+        affected = set()
+        heap = [(distances[p], p) for p in changed if p in distances]
+        heapify(heap)
+        size = len(distances)
+        limit = size // 2
+        while heap:
+            d, position = heappop(heap)
+            if position in affected:
+                continue
+            if position not in changed and owners[position] not in removed and self._supported(position, d, affected):
+                continue
+            affected.add(position)
+            if len(affected) > limit:
+                # most of the field changed, a new search is faster
+                self._compute()
+                return
+            x, y = position
+            for n in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if distances.get(n) == d + 1:
+                    heappush(heap, (d + 1, n))
+        affected.update(changed)
+
+        # forget them and search again from their unaffected neighbours and the sources
+        for position in affected:
+            if distances.pop(position, None) is not None:
+                regions[owners.pop(position)] -= 1
+        for source in removed:
+            regions.pop(source, None)
+        heap = []
+        for position in affected:
+            if position in self._sources:
+                heap.append((0, position, position))
+            elif self.mh.passable(position):
+                for n in self._emitters(position):
+                    if n in distances:
+                        heap.append((distances[n] + 1, position, owners[n]))
+        heapify(heap)
+        self.repaired = 0
+        while heap:
+            d, position, owner = heappop(heap)
+            if position in distances and distances[position] <= d:
+                continue
+            if self.max_distance is not None and d > self.max_distance:
+                continue
+            if position in distances:
+                regions[owners[position]] -= 1
+            distances[position] = d
+            owners[position] = owner
+            regions[owner] = regions.get(owner, 0) + 1
+            self.repaired += 1
+            if self.repaired + len(affected) > size:
+                # the changes reach further than the field did, a new search is faster
+                self._compute()
+                return
+            for n in self.mh.get_adjacent_positions(position):
+                if d + 1 < distances.get(n, d + 2):
+                    heappush(heap, (d + 1, n, owner))
+
+    def _supported(self, position, d, affected):
+        '''Check if position has a neighbour at distance d - 1 that is not affected by the changes.'''
+        for n in self._emitters(position):
+            if n not in affected and self.distances.get(n) == d - 1:
+                return True
+        return False
+
+    def _emitters(self, position):
+        '''The neighbours of position a path to position can come from, passable positions and sources.'''
+        x, y = position
+        result = self.mh.get_adjacent_positions(position)
+        result.extend(n for n in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)) if n in self._sources)
+        return result
@@ -0,0 +1,841 @@
+# coding=utf-8
+'''
+Benchmarks for the hot paths of the game.
+
+The benchmarks need the data folder, so run them from within the dgame folder
+with the repository root on the PYTHONPATH:
+
+    python -m dgame.benchmark [name[:value,...] ...]
+
+Values after the name are passed to the benchmark as integer arguments.
+
+No window is opened, SDL uses its dummy video driver.
+'''
+from __future__ import print_function, division
+import os, sys, random, time
+import collections
+import pygame
+
+MAP_SIZES = ['small', 'medium', 'large']
+
+_cache = {}
+
+
+def setup():
+    '''Initialize pygame without a window and load the configuration and images once.'''
+    if 'cfg' not in _cache:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        pygame.init()
+        pygame.display.set_mode((1, 1))
+        from dgame.core import Configuration
+        from dgame.image import Biome, CreatureSheet
+        cfg = Configuration()
+        zoom_levels = cfg['ui']['camera']['zoom_levels']
+        _cache['cfg'] = cfg
+        _cache['biome'] = Biome('default', cfg['image']['biomes']['default'], zoom_levels)
+        _cache['creatures'] = dict((name, CreatureSheet(name, config, zoom_levels))
+                                   for name, config in cfg['image']['creatures'].iteritems())
+    return _cache['cfg']
+
+
+def create_environment(map_size_name, seed = 'testing'):
+    '''Generate an environment like the launcher does.'''
+    from dgame.core import Environment, Player, Creature
+    from dgame.generator import EnvironmentGenerator
+    cfg = setup()
+    sheep = _cache['creatures']['sheep']
+    player = Player(heros = [Creature(cfg['creatures']['sheep'], sheep) for _ in range(4)])
+    generator = EnvironmentGenerator(cfg['generator'], cfg['creatures'], seed = seed)
+    return generator.create(Environment(biome = _cache['biome'],
+                                        config = cfg['environment'],
+                                        map_size_name = map_size_name,
+                                        player = player),
+                            _cache['creatures'])
+
+
+def passable_positions(env):
+    '''All positions of the environment a creature can move to.'''
+    from dgame.core import Tile
+    return [(x, y) for x in range(env.width) for y in range(env.height)
+            if env.get_tile((x, y)).state == Tile.STATE_PASSABLE]
+
+
+def report(name, map_size_name, **values):
+    print('{:<12} {:<8} '.format(name, map_size_name) +
+          '  '.join('{}={}'.format(k, values[k]) for k in sorted(values)))
+
+
+def bench_astar(searches = 200):
+    '''Nodes expanded per second by AStar.find_path between random passable positions.'''
+    for map_size_name in MAP_SIZES:
+        env = create_environment(map_size_name)
+        rnd = random.Random(map_size_name)
+        positions = passable_positions(env)
+        pairs = [(env.get_tile(rnd.choice(positions)), env.get_tile(rnd.choice(positions)))
+                 for _ in range(searches)]
+        expanded = found = 0
+        start = time.time()
+        for from_tile, to_tile in pairs:
+            if env.path_finder.find_path(from_tile, to_tile):
+                found += 1
+            expanded += env.path_finder.expanded
+        elapsed = time.time() - start
+        report('astar', map_size_name,
+               searches = searches,
+               found = found,
+               nodes = expanded,
+               ms_per_search = '{:.3f}'.format(elapsed * 1000 / searches),
+               nodes_per_sec = int(expanded / elapsed))
+
+
+def bench_grid(repeat = 5):
+    '''Construction time and memory of the environment grid.'''
+    from dgame.core import Environment, Player, Creature
+    cfg = setup()
+    player = Player(heros = [Creature(cfg['creatures']['sheep'], _cache['creatures']['sheep'])])
+    for map_size_name in MAP_SIZES:
+        start = time.time()
+        for _ in range(repeat):
+            env = Environment(_cache['biome'], cfg['environment'], map_size_name, player)
+        elapsed = time.time() - start
+        report('grid', map_size_name,
+               tiles = env.width * env.height,
+               ms_to_create = '{:.3f}'.format(elapsed * 1000 / repeat),
+               kib = '{:.1f}'.format(env.grid.nbytes / 1024))
+
+
+def object_size(o):
+    '''Size of an object including its attribute dict, if it has one.'''
+    size = sys.getsizeof(o)
+    if hasattr(o, '__dict__'):
+        size += sys.getsizeof(o.__dict__)
+    return size
+
+
+def bench_expansion(searches = 200):
+    '''Time and memory allocated per node expanded by AStar.find_path.'''
+    env = create_environment('large')
+    rnd = random.Random('expansion')
+    positions = passable_positions(env)
+    pairs = [(env.get_tile(rnd.choice(positions)), env.get_tile(rnd.choice(positions)))
+             for _ in range(searches)]
+    node = env.path_finder.mh.get_adjacent_nodes(env.get_node(pairs[0][0], True), pairs[0][1])[0]
+    expanded = 0
+    start = time.time()
+    for from_tile, to_tile in pairs:
+        env.path_finder._search(from_tile, to_tile)
+        expanded += env.path_finder.expanded
+    elapsed = time.time() - start
+    report('expansion', 'large',
+           nodes = expanded,
+           us_per_node = '{:.2f}'.format(elapsed * 1000000 / expanded),
+           node_bytes = object_size(node),
+           tile_bytes = object_size(node.location),
+           path_bytes = object_size(env.path_finder._trace_path(node)),
+           creature_bytes = object_size(env.player.active_hero))
+
+
+def bench_images():
+    '''Startup time of the image sheets and the cost of loading images on first use.'''
+    from dgame.image import Biome, CreatureSheet, ImageCache
+    cfg = setup()
+    zoom_levels = cfg['ui']['camera']['zoom_levels']
+    cache = ImageCache(cfg['image']['cache_mb'] * 1024 * 1024)
+    start = time.time()
+    biome = Biome('default', cfg['image']['biomes']['default'], zoom_levels, cache)
+    sheets = [CreatureSheet(name, config, zoom_levels, cache) for name, config in cfg['image']['creatures'].iteritems()]
+    startup = time.time() - start
+    start = time.time()
+    for zl in zoom_levels:
+        for image in biome.images('_all'):
+            image[zl]
+        for sheet in sheets:
+            sheet.static[zl]
+    first_use = time.time() - start
+    report('images', 'all',
+           ms_startup = '{:.1f}'.format(startup * 1000),
+           ms_first_use_all_zoom_levels = '{:.1f}'.format(first_use * 1000),
+           kib_cached = cache.used // 1024)
+
+
+def bench_startup():
+    '''Loading all atlases of the sheets without, with a cold and with a warm atlas file.'''
+    import shutil, tempfile
+    from dgame.image import Biome, CreatureSheet, ImageCache
+    cfg = setup()
+    zoom_levels = cfg['ui']['camera']['zoom_levels']
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for name, atlas_dir in [('no_file', None), ('cold', cache_dir), ('warm', cache_dir)]:
+            cache = ImageCache(cfg['image']['cache_mb'] * 1024 * 1024)
+            start = time.time()
+            sheets = [Biome('default', cfg['image']['biomes']['default'], zoom_levels, cache, atlas_dir)._sheet]
+            sheets.extend(CreatureSheet(n, c, zoom_levels, cache, atlas_dir)._sheet
+                          for n, c in cfg['image']['creatures'].iteritems())
+            for sheet in sheets:
+                for zl in zoom_levels:
+                    sheet.atlas(zl)
+            report('startup', name, ms = '{:.1f}'.format((time.time() - start) * 1000))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+class PlayerScript(object):
+    '''Simulates a player: hovers random tiles, moves heros, scrolls and zooms.'''
+
+    KEYS = [pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d, pygame.K_TAB, pygame.K_BACKSPACE, pygame.K_RETURN,
+            pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_KP_PLUS, pygame.K_KP_MINUS]
+
+    def __init__(self, launcher, seed = 'script', key_every = 5):
+        self.launcher = launcher
+        self.random = random.Random(seed)
+        self.key_every = key_every
+
+    def __call__(self, frame):
+        rect = self.launcher.camera.rect
+        pygame.mouse.set_pos((self.random.randrange(rect.width), self.random.randrange(rect.height)))
+        if frame % self.key_every == 0:
+            key = self.random.choice(self.KEYS)
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key = key, mod = 0, unicode = u''))
+            pygame.event.post(pygame.event.Event(pygame.KEYUP, key = key, mod = 0))
+
+
+def bench_frames(frames = 300):
+    '''Frame time percentiles of the headless game loop driven by a PlayerScript.'''
+    from dgame.core import Launcher
+    from dgame.stats import stats
+    for map_size_name in MAP_SIZES:
+        launcher = Launcher(headless = True, map_size_name = map_size_name)
+        stats.reset()
+        stats.enabled = True
+        launcher.run(frames, PlayerScript(launcher))
+        stats.enabled = False
+        for section in ['dispatch', 'update', 'Map.update_overlay', 'draw']:
+            report('frames', map_size_name,
+                   section = section,
+                   p50 = '{:.3f}'.format(stats.percentile(section, 50)),
+                   p95 = '{:.3f}'.format(stats.percentile(section, 95)),
+                   p99 = '{:.3f}'.format(stats.percentile(section, 99)))
+
+
+def bench_zoom(frames = 50):
+    '''
+    Camera updates at every configured zoom level, and the rects of all visible tiles one by one and in a batch.
+
+    Full updates scroll the camera by one tile, so the floor is rendered from the floor cache.
+    '''
+    from dgame.ui import Map
+    cfg = setup()
+    env = create_environment('large')
+    for zoom_level in cfg['ui']['camera']['zoom_levels']:
+        camera = Map(pygame.Rect((0, 0), (1024, 512)), env,
+                     zoom_levels = cfg['ui']['camera']['zoom_levels'],
+                     zoom_level = zoom_level)
+        viewport = camera.viewport
+        x, y = env.width // 2, env.height // 2
+        viewport.x, viewport.y = x + 1, y
+        camera.update()
+        timings = collections.defaultdict(float)
+        for frame in range(frames):
+            viewport.x = x + frame % 2
+            start = time.time()
+            camera.update()
+            timings['full'] += time.time() - start
+            start = time.time()
+            camera.update()
+            timings['incremental'] += time.time() - start
+        positions = [(tx, ty) for tx in range(viewport.x_min, viewport.x_max) for ty in range(viewport.y_min, viewport.y_max)]
+        start = time.time()
+        for _ in range(frames):
+            [tuple(viewport.get_rect(tx, ty)) for tx, ty in positions]
+        timings['get_rect'] = time.time() - start
+        start = time.time()
+        for _ in range(frames):
+            viewport.rects(positions)
+        timings['rects'] = time.time() - start
+        report('zoom', 'large',
+               zoom_level = zoom_level,
+               tiles = len(positions),
+               ms_full = '{:.2f}'.format(timings['full'] * 1000 / frames),
+               ms_incremental = '{:.3f}'.format(timings['incremental'] * 1000 / frames),
+               us_get_rect = '{:.0f}'.format(timings['get_rect'] * 1000000 / frames),
+               us_rects = '{:.0f}'.format(timings['rects'] * 1000000 / frames))
+
+
+def bench_events(*repeats):
+    '''
+    Event processing per frame under key repeat, event by event and coalesced by the EventDispatcher.
+
+    Every frame holds a scroll key pressed repeats times, with mouse motions in between.
+    The repeats per frame can be given on the command line, e.g. events:3,10.
+    '''
+    from dgame.core import Launcher
+    from dgame.event import EventDispatcher
+    frames = 100
+    launcher = Launcher(headless = True, map_size_name = 'large')
+    cfg = launcher.cfg
+    actors = {'camera': launcher.camera, 'game': launcher, 'player': launcher.player}
+    viewport = launcher.camera.viewport
+    for repeat in repeats or (3, 10):
+        timings = {}
+        positions = {}
+        for name in ['event_by_event', 'coalesced']:
+            dispatcher = EventDispatcher(cfg['controls'], actors, cfg['events']['coalesce'] if name == 'coalesced' else ())
+            viewport.x, viewport.y = 0, 0
+            launcher.camera.update()
+            dispatch = update = 0.0
+            for frame in range(frames):
+                # scroll right and back again
+                key = pygame.K_RIGHT if frame < frames // 2 else pygame.K_LEFT
+                events = []
+                for _ in range(repeat):
+                    events.append(pygame.event.Event(pygame.KEYDOWN, key = key, mod = 0, unicode = u''))
+                    events.append(pygame.event.Event(pygame.MOUSEMOTION, pos = (0, 0), rel = (0, 0), buttons = (0, 0, 0)))
+                start = time.time()
+                if name == 'coalesced':
+                    dispatcher.dispatch_all(events)
+                else:
+                    for event in events:
+                        dispatcher.dispatch(event)
+                dispatch += time.time() - start
+                start = time.time()
+                launcher.camera.update()
+                update += time.time() - start
+                if frame == frames // 2 - 1:
+                    positions[name] = (viewport.x, viewport.y)
+            timings[name] = (dispatch, update)
+        report('events', 'large',
+               repeats = repeat,
+               same_scroll = positions['event_by_event'] == positions['coalesced'],
+               us_dispatch_event_by_event = '{:.1f}'.format(timings['event_by_event'][0] * 1000000 / frames),
+               us_dispatch_coalesced = '{:.1f}'.format(timings['coalesced'][0] * 1000000 / frames),
+               ms_update = '{:.2f}'.format(timings['coalesced'][1] * 1000 / frames))
+
+
+def xlarge_config():
+    '''Environment and generator configuration with an additional 1024x1024 map named xlarge.'''
+    import copy
+    cfg = setup()
+    env_config = copy.deepcopy(cfg['environment'])
+    env_config['map_size']['xlarge'] = [1024, 1024]
+    gen_config = copy.deepcopy(cfg['generator'])
+    gen_config['map_config']['xlarge'] = dict((room, num * 16) for room, num in gen_config['map_config']['large'].iteritems())
+    return env_config, gen_config
+
+
+def generate(env_config, gen_config, map_size_name, seed):
+    '''Generate an environment, return it with its generator and the seconds it took.'''
+    from dgame.core import Environment, Player, Creature
+    from dgame.generator import EnvironmentGenerator
+    cfg = setup()
+    player = Player(heros = [Creature(cfg['creatures']['sheep'], _cache['creatures']['sheep']) for _ in range(4)])
+    env = Environment(_cache['biome'], env_config, map_size_name, player)
+    generator = EnvironmentGenerator(gen_config, cfg['creatures'], seed = seed)
+    start = time.time()
+    generator.create(env, _cache['creatures'])
+    return env, generator, time.time() - start
+
+
+def bench_generator(repeat = 3):
+    '''Rooms placed per second by the EnvironmentGenerator, including a custom 1024x1024 map.'''
+    env_config, gen_config = xlarge_config()
+    for map_size_name in MAP_SIZES + ['xlarge']:
+        rooms = 0
+        elapsed = 0.0
+        for i in range(repeat):
+            env, generator, seconds = generate(env_config, gen_config, map_size_name, i + 1)
+            elapsed += seconds
+            rooms += len(generator.rooms)
+        report('generator', map_size_name,
+               rooms = rooms // repeat,
+               ms_per_map = '{:.1f}'.format(elapsed * 1000 / repeat),
+               rooms_per_sec = int(rooms / elapsed))
+
+
+def bench_world(steps = 200):
+    '''Frame time, chunk traffic and memory while the camera pans across a chunked 4096x4096 map and back.'''
+    from dgame.ui import Map
+    cfg = setup()
+    start = time.time()
+    env = create_environment('huge')
+    created = time.time() - start
+    camera = Map(pygame.Rect((0, 0), (1024, 512)), env,
+                 zoom_levels = cfg['ui']['camera']['zoom_levels'],
+                 zoom_level = cfg['ui']['camera']['zoom_level'])
+    viewport = camera.viewport
+    x_max, y_max = env.width - viewport.width, env.height - viewport.height
+    durations = []
+    for step in range(steps):
+        # there and back again, the way back reads the stored chunks
+        f = 1 - abs(1 - 2 * step / (steps - 1))
+        viewport.x, viewport.y = f * x_max, f * y_max
+        start = time.time()
+        camera.update()
+        durations.append((time.time() - start) * 1000)
+    durations.sort()
+    report('world', 'huge',
+           ms_to_create = '{:.1f}'.format(created * 1000),
+           ms_per_frame_p50 = '{:.1f}'.format(durations[len(durations) // 2]),
+           ms_per_frame_max = '{:.1f}'.format(durations[-1]),
+           chunks_created = env.grid.created,
+           chunks_evicted = env.grid.evicted,
+           chunks_loaded = env.grid.loaded,
+           kib_loaded = env.grid.nbytes // 1024,
+           kib_flat = env.width * env.height * 3 // 1024)
+
+
+def bench_snapshot(repeat = 5):
+    '''Save and load throughput of snapshots compared to generating the map again.'''
+    import shutil, tempfile
+    from dgame.snapshot import Snapshot
+    env_config, gen_config = xlarge_config()
+    path = tempfile.mkdtemp()
+    try:
+        for map_size_name in MAP_SIZES + ['xlarge']:
+            env, generator, generated = generate(env_config, gen_config, map_size_name, 'snapshot')
+            snapshot = Snapshot(os.path.join(path, map_size_name + '.snap'))
+            start = time.time()
+            for _ in range(repeat):
+                snapshot.save(env)
+            saved = (time.time() - start) / repeat
+            start = time.time()
+            for _ in range(repeat):
+                snapshot.load(_cache['biome'], env_config, _cache['creatures'])
+            loaded = (time.time() - start) / repeat
+            size = os.path.getsize(snapshot.path)
+            report('snapshot', map_size_name,
+                   kib = size // 1024,
+                   ms_save = '{:.2f}'.format(saved * 1000),
+                   ms_load = '{:.2f}'.format(loaded * 1000),
+                   ms_generate = '{:.1f}'.format(generated * 1000),
+                   mib_per_sec_save = int(size / saved / 1024 / 1024),
+                   mib_per_sec_load = int(size / loaded / 1024 / 1024))
+    finally:
+        shutil.rmtree(path)
+
+
+def connect_rooms(env, rooms, rnd):
+    '''Dig corridors from every room to the nearest room connected before it, so that routes between all rooms exist.'''
+    from dgame.core import Tile
+    occupied = set(c.position for c in env.creatures)
+    floor = env.biome.images('passable')[0]
+    centers = [(x + w // 2, y + h // 2) for x, y, w, h in (room['rect'] for room in rooms)]
+    for i in range(1, len(rooms)):
+        nearest = min(range(i), key = lambda j: abs(centers[i][0] - centers[j][0]) + abs(centers[i][1] - centers[j][1]))
+        a, b = rooms[i], rooms[nearest]
+        (ax, ay), (bx, by) = rnd.choice(sorted(a['free'])), rnd.choice(sorted(b['free']))
+        corridor = [(x, ay) for x in range(min(ax, bx), max(ax, bx) + 1)]
+        corridor.extend((bx, y) for y in range(min(ay, by), max(ay, by) + 1))
+        for position in corridor:
+            if position not in occupied:
+                tile = env.get_tile(position)
+                tile.state = Tile.STATE_PASSABLE
+                tile.ui.image = floor
+
+
+def bench_hpa(searches = 100, changes = 20):
+    '''
+    Long routes found by HierarchicalAStar compared to a plain A* search on maps with corridors.
+
+    The searches run again after some tiles were blocked, to check the clusters are updated.
+    '''
+    from dgame.core import Tile
+    from dgame.ai import AStar
+    env_config, gen_config = xlarge_config()
+    for map_size_name in ['large', 'xlarge']:
+        env, generator, _ = generate(env_config, gen_config, map_size_name, 'hpa')
+        rnd = random.Random(map_size_name)
+        connect_rooms(env, generator.rooms, rnd)
+        plain = AStar(env)
+        hpa = env.path_finder
+        positions = passable_positions(env)
+        pairs = []
+        while len(pairs) < searches:
+            a, b = rnd.choice(positions), rnd.choice(positions)
+            if abs(a[0] - b[0]) + abs(a[1] - b[1]) >= hpa.min_distance:
+                pairs.append((a, b))
+        for run in ['new', 'changed']:
+            if run == 'changed':
+                for position in rnd.sample(positions, changes):
+                    env.get_tile(position).state = Tile.STATE_UNPASSABLE
+                pairs = [(a, b) for a, b in pairs if env.passable(b)]
+            # the first searches build the clusters they use
+            start = time.time()
+            for a, b in pairs:
+                hpa._hierarchical_search(a, b)
+            first_use = time.time() - start
+            start = time.time()
+            found = [hpa._hierarchical_search(a, b) for a, b in pairs]
+            elapsed = time.time() - start
+            start = time.time()
+            expected = [plain._search(env.get_tile(a), env.get_tile(b)) for a, b in pairs]
+            elapsed_astar = time.time() - start
+            costs = [(p.get_total_move_cost() if p else None, q.get_total_move_cost() if q else None)
+                     for p, q in zip(found, expected)]
+            report('hpa', map_size_name,
+                   map = run,
+                   searches = len(pairs),
+                   found = sum(1 for p, q in costs if q is not None),
+                   cost_mismatches = sum(1 for p, q in costs if p != q),
+                   ms_first_use = '{:.2f}'.format(first_use * 1000 / len(pairs)),
+                   ms_hpa = '{:.2f}'.format(elapsed * 1000 / len(pairs)),
+                   ms_astar = '{:.2f}'.format(elapsed_astar * 1000 / len(pairs)))
+
+
+def bench_field(creatures = 200, turns = 20):
+    '''
+    Cost of the hero distance field for creatures chasing the heros, compared to one path search per creature.
+
+    Every turn the creatures take a step, every other turn the heros too. The field is
+    updated with the changed positions and compared to a field computed from scratch.
+    '''
+    from dgame.core import Creature
+    from dgame.ai import DistanceField
+    cfg = setup()
+    env_config, gen_config = xlarge_config()
+    for map_size_name in ['large', 'xlarge']:
+        env, generator, _ = generate(env_config, gen_config, map_size_name, 'field')
+        rnd = random.Random(map_size_name)
+        connect_rooms(env, generator.rooms, rnd)
+        chasers = []
+        free = sorted(set(p for room in generator.rooms for p in room['free']) & set(passable_positions(env)))
+        for position in rnd.sample(free, creatures):
+            chasers.append(Creature(cfg['creatures']['wolf'], _cache['creatures']['wolf'], env = env, pos = position))
+        field = env.hero_distances
+        field.update()
+        hero = env.player.active_hero.position
+        goal = env.get_tile(env.get_adjacent_positions(hero)[0])
+        start = time.time()
+        for chaser in chasers[:20]:
+            env.path_finder.find_path(env.get_tile(chaser.position), goal)
+        find_path = (time.time() - start) / 20
+        timings = collections.defaultdict(float)
+        repaired = positions = mismatches = 0
+        for turn in range(turns):
+            moved = 'heros' if turn % 2 else 'creatures'
+            if moved == 'heros':
+                for hero in env.player.heros:
+                    moves = env.get_adjacent_positions(hero.position)
+                    if moves:
+                        env.create_move_creature_command(hero, rnd.choice(moves))
+                    hero.end_turn()
+            start = time.time()
+            field.update()
+            timings[moved] += time.time() - start
+            repaired += field.repaired
+            positions += len(field.distances)
+            start = time.time()
+            expected = DistanceField(env, field.sources)
+            expected.update()
+            timings['full'] += time.time() - start
+            mismatches += len(set(field.distances.items()) ^ set(expected.distances.items()))
+            start = time.time()
+            for chaser in chasers:
+                position = field.next_step(chaser.position)
+                if position:
+                    env.create_move_creature_command(chaser, position)
+                chaser.end_turn()
+            timings['step'] += time.time() - start
+        report('field', map_size_name,
+               positions_per_update = positions // turns,
+               mismatches = mismatches,
+               ms_full = '{:.2f}'.format(timings['full'] * 1000 / turns),
+               ms_update_creatures_moved = '{:.2f}'.format(timings['creatures'] * 2000 / turns),
+               ms_update_heros_moved = '{:.2f}'.format(timings['heros'] * 2000 / turns),
+               repaired_per_update = repaired // turns,
+               us_per_step = '{:.1f}'.format(timings['step'] * 1000000 / turns / creatures),
+               ms_find_path = '{:.2f}'.format(find_path * 1000))
+
+
+def bench_turns(*counts):
+    '''
+    Time to resolve the turns of many wandering creatures, stepped one by one and by the TurnScheduler.
+
+    The creature counts can be given on the command line, e.g. turns:100,1000.
+    '''
+    from dgame.core import Creature
+    from dgame.turn import TurnScheduler
+    cfg = setup()
+    env_config, gen_config = xlarge_config()
+    turns = 10
+    for count in counts or (100, 1000, 5000):
+        timings = {}
+        for name in ['one_by_one', 'batched']:
+            env, generator, _ = generate(env_config, gen_config, 'xlarge', 'turns')
+            rnd = random.Random(count)
+            free = sorted(set(p for room in generator.rooms for p in room['free']) & set(passable_positions(env)))
+            creatures = []
+            for position in rnd.sample(free, count):
+                creatures.append(Creature(cfg['creatures']['wolf'], _cache['creatures']['wolf'], env = env, pos = position))
+
+            def wander(creature):
+                positions = env.get_adjacent_positions(creature.position)
+                return rnd.choice(positions) if positions else None
+
+            scheduler = TurnScheduler(env, wander)
+            start = time.time()
+            for _ in range(turns):
+                if name == 'batched':
+                    scheduler.run()
+                    continue
+                for _ in range(cfg['creatures']['wolf']['moves']):
+                    for creature in creatures:
+                        position = wander(creature)
+                        if position:
+                            env.create_move_creature_command(creature, position)
+                for creature in creatures:
+                    creature.end_turn()
+            timings[name] = (time.time() - start) * 1000 / turns
+        report('turns', 'xlarge',
+               creatures = count,
+               moved = scheduler.moved,
+               blocked = scheduler.blocked,
+               ms_one_by_one = '{:.1f}'.format(timings['one_by_one']),
+               ms_batched = '{:.1f}'.format(timings['batched']))
+
+
+def bench_planner(frames = 200, processes = 2):
+    '''
+    Overlay time per frame on the game loop with the searches on the loop and in a PlanningService.
+
+    The mouse hovers a new tile near the active hero every 10 frames. Walls and tiles that
+    can not be reached make the searches on the loop explore all tiles connected to the hero.
+    '''
+    from dgame.ui import Map
+    from dgame.planner import PlanningService
+    cfg = setup()
+    env_config, gen_config = xlarge_config()
+    env, generator, _ = generate(env_config, gen_config, 'xlarge', 'planner')
+    connect_rooms(env, generator.rooms, random.Random('planner'))
+    hero = env.player.active_hero
+    for name in ['game_loop', 'service']:
+        planner = PlanningService(env, processes) if name == 'service' else None
+        camera = Map(pygame.Rect((0, 0), (1024, 512)), env,
+                     zoom_levels = cfg['ui']['camera']['zoom_levels'],
+                     zoom_level = cfg['ui']['camera']['zoom_level'],
+                     planner = planner)
+        rnd = random.Random('planner')
+        durations = []
+        waited = []
+        for frame in range(frames):
+            if frame % 10 == 0:
+                hovered = env.get_tile((min(max(hero.x + rnd.randint(-16, 16), 0), env.width - 1),
+                                        min(max(hero.y + rnd.randint(-8, 8), 0), env.height - 1)))
+                requested = frame
+            start = time.time()
+            if planner:
+                planner.reachable(hero.position, hero.moves)
+            else:
+                hero.reachable_positions
+            camera.highlight_path(hero.position, hovered)
+            durations.append((time.time() - start) * 1000)
+            if planner and requested is not None and planner.results.get('path', ((),))[0][:2] == (hero.position, hovered.position):
+                waited.append(frame - requested)
+                requested = None
+            # a frame at 60 fps
+            time.sleep(1 / 60)
+        if planner:
+            planner.close()
+        durations.sort()
+        report('planner', 'xlarge',
+               planning = name,
+               ms_per_frame_p50 = '{:.2f}'.format(durations[len(durations) // 2]),
+               ms_per_frame_p95 = '{:.2f}'.format(durations[len(durations) * 95 // 100]),
+               ms_per_frame_max = '{:.2f}'.format(durations[-1]),
+               frames_to_path = '{:.1f}'.format(sum(waited) / len(waited)) if waited else '-')
+
+
+def bench_fov(*counts):
+    '''
+    Cost of the field of view of many heros while creatures wander, and how many creatures it culls.
+
+    Every turn the creatures wander and one hero steps, then the visible creatures are
+    collected from the positions the heros see. The hero counts can be given on the
+    command line, e.g. fov:4,64.
+    '''
+    from dgame.core import Creature
+    from dgame.turn import TurnScheduler
+    cfg = setup()
+    env_config, gen_config = xlarge_config()
+    turns = 20
+    for count in counts or (4, 64):
+        env, generator, _ = generate(env_config, gen_config, 'xlarge', 'fov')
+        rnd = random.Random(count)
+        connect_rooms(env, generator.rooms, rnd)
+        free = sorted(set(p for room in generator.rooms for p in room['free']) & set(passable_positions(env)))
+        positions = rnd.sample(free, count + 2000)
+        heros = []
+        for i, position in enumerate(positions):
+            sheet = 'sheep' if i < count else 'wolf'
+            creature = Creature(cfg['creatures'][sheet], _cache['creatures'][sheet], env = env, pos = position)
+            if i < count:
+                heros.append(creature)
+        env.player.heros = heros
+        env.touch()
+
+        def wander(creature):
+            positions = env.get_adjacent_positions(creature.position)
+            return rnd.choice(positions) if positions else None
+
+        scheduler = TurnScheduler(env, wander)
+        timings = collections.defaultdict(float)
+        computed = seen = 0
+        for turn in range(turns):
+            hero = heros[turn % count]
+            moves = env.get_adjacent_positions(hero.position)
+            if moves:
+                env.create_move_creature_command(hero, rnd.choice(moves))
+            hero.end_turn()
+            start = time.time()
+            scheduler.run()
+            timings['turn'] += time.time() - start
+            computed -= env.vision.computed
+            start = time.time()
+            visible = env.visible_positions
+            seen += sum(1 for c in env.creatures if c.position in visible)
+            timings['update'] += time.time() - start
+            computed += env.vision.computed
+            start = time.time()
+            for _ in range(10):
+                visible = env.visible_positions
+            timings['cached'] += (time.time() - start) / 10
+        start = time.time()
+        for hero in heros:
+            env.vision._compute(hero.position)
+        per_view = (time.time() - start) / count
+        report('fov', 'xlarge',
+               heros = count,
+               creatures = len(env.creatures),
+               visible_creatures = seen // turns,
+               views_per_turn = '{:.1f}'.format(computed / turns),
+               us_per_view = '{:.0f}'.format(per_view * 1000000),
+               ms_update = '{:.2f}'.format(timings['update'] * 1000 / turns),
+               us_cached = '{:.1f}'.format(timings['cached'] * 1000000 / turns),
+               ms_turn = '{:.1f}'.format(timings['turn'] * 1000 / turns))
+
+
+def bench_hover(updates = 300):
+    '''
+    Latency of the path to the hovered tile while the mouse wanders near the active hero, by A* and by the SearchTree.
+
+    The hovered tile moves to a neighbour tile within the view on every update, over the
+    floor only and over any tile, walls included.
+    '''
+    from dgame.ai import SearchTree
+    env_config, gen_config = xlarge_config()
+    for map_size_name in ['large', 'xlarge']:
+        env, generator, _ = generate(env_config, gen_config, map_size_name, 'hover')
+        rnd = random.Random(map_size_name)
+        connect_rooms(env, generator.rooms, rnd)
+        env.touch()
+        origin = env.player.active_hero.position
+        for tiles in ['floor', 'any']:
+            targets = []
+            x, y = origin
+            for _ in range(updates):
+                moves = [(x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                         if abs(x + dx - origin[0]) <= 16 and abs(y + dy - origin[1]) <= 8
+                         and env.grid.contains(x + dx, y + dy) and (tiles == 'any' or env.passable((x + dx, y + dy)))]
+                if moves:
+                    x, y = rnd.choice(moves)
+                targets.append((x, y))
+            timings = {}
+            found = {}
+            for name in ['astar', 'tree']:
+                env.touch()
+                tree = SearchTree(env, origin)
+                durations = []
+                results = []
+                for target in targets:
+                    start = time.time()
+                    if name == 'astar':
+                        p = env.path_finder.find_path(env.get_tile(origin), env.get_tile(target))
+                        results.append(len(p.nodes) if p else None)
+                    else:
+                        p = tree.path_to(target)
+                        results.append(len(p) if p is not None else None)
+                    durations.append((time.time() - start) * 1000)
+                timings[name] = sorted(durations)
+                found[name] = results
+            report('hover', map_size_name,
+                   tiles = tiles,
+                   updates = updates,
+                   found = sum(1 for a in found['astar'] if a is not None),
+                   length_mismatches = sum(1 for a, b in zip(found['astar'], found['tree']) if a != b),
+                   ms_astar_mean = '{:.3f}'.format(sum(timings['astar']) / updates),
+                   ms_astar_max = '{:.1f}'.format(timings['astar'][-1]),
+                   ms_tree_mean = '{:.3f}'.format(sum(timings['tree']) / updates),
+                   ms_tree_max = '{:.1f}'.format(timings['tree'][-1]))
+
+
+def bench_occupancy(*counts):
+    '''
+    Creatures in the view of the camera and at single positions, by scanning all creatures and by the Occupancy.
+
+    The creature counts can be given on the command line, e.g. occupancy:1000,10000.
+    '''
+    from dgame.core import Creature
+    cfg = setup()
+    env_config, gen_config = xlarge_config()
+    repeat = 100
+    for count in counts or (1000, 10000):
+        env, generator, _ = generate(env_config, gen_config, 'xlarge', 'occupancy')
+        rnd = random.Random(count)
+        free = sorted(set(p for room in generator.rooms for p in room['free']) & set(passable_positions(env)))
+        for position in rnd.sample(free, count):
+            Creature(cfg['creatures']['wolf'], _cache['creatures']['wolf'], env = env, pos = position)
+        views = []
+        for _ in range(repeat):
+            x, y = rnd.randrange(env.width - 32), rnd.randrange(env.height - 16)
+            views.append((x, y, x + 32, y + 16))
+        probes = [rnd.choice(free) for _ in range(repeat)]
+        start = time.time()
+        scanned = [[c for c in env.creatures if x_min <= c.x < x_max and y_min <= c.y < y_max]
+                   for x_min, y_min, x_max, y_max in views]
+        scan_view = time.time() - start
+        start = time.time()
+        indexed = [env.occupancy.within(*view) for view in views]
+        index_view = time.time() - start
+        start = time.time()
+        for position in probes:
+            next((c for c in env.creatures if c.position == position), None)
+        scan_at = time.time() - start
+        start = time.time()
+        for position in probes:
+            env.occupancy.at(position)
+        index_at = time.time() - start
+        report('occupancy', 'xlarge',
+               creatures = len(env.creatures),
+               mismatches = sum(1 for a, b in zip(scanned, indexed) if set(a) != set(b)),
+               us_view_scan = '{:.1f}'.format(scan_view * 1000000 / repeat),
+               us_view_index = '{:.1f}'.format(index_view * 1000000 / repeat),
+               us_at_scan = '{:.1f}'.format(scan_at * 1000000 / repeat),
+               us_at_index = '{:.2f}'.format(index_at * 1000000 / repeat))
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('astar', bench_astar),
+    ('grid', bench_grid),
+    ('expansion', bench_expansion),
+    ('images', bench_images),
+    ('startup', bench_startup),
+    ('generator', bench_generator),
+    ('world', bench_world),
+    ('snapshot', bench_snapshot),
+    ('hpa', bench_hpa),
+    ('field', bench_field),
+    ('turns', bench_turns),
+    ('planner', bench_planner),
+    ('fov', bench_fov),
+    ('occupancy', bench_occupancy),
+    ('hover', bench_hover),
+    ('frames', bench_frames),
+    ('zoom', bench_zoom),
+    ('events', bench_events),
+])
+
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:] or BENCHMARKS.keys():
+        name, _, values = arg.partition(':')
+        BENCHMARKS[name](*[int(v) for v in values.split(',') if v])
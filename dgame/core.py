@@ -6,15 +6,18 @@ dgame is just a playground for python and pygame.
 '''
 from __future__ import print_function
 import pygame
-import sys, os, logging
+import os, logging, time
 import collections, yaml
-import math
 from dgame.event import EventDispatcher, CommandQueue, UndoCommand, FlushCommand, OneWayCommand
-from dgame.ui import Map, Entity, Floor, FpsLayer
-from dgame.image import Biome, CreatureSheet
-from dgame.ai import AStar, Node
+from dgame.ui import Map, Entity, Floor, FpsLayer, StatsLayer
+from dgame.grid import Grid, ChunkedGrid, Occupancy
+from dgame.stats import stats
+from dgame.image import Biome, CreatureSheet, ImageCache
+from dgame.ai import AStar, HierarchicalAStar, FloodFill, DistanceField, SearchCache, SearchTree, Node
+from dgame.turn import TurnScheduler
+from dgame.planner import PlanningService
+from dgame.vision import FieldOfView
 
-PROFILE = False
 DEBUG = False
 
 
@@ -27,33 +30,46 @@ class Player(object):
         self.env = env
         self.command_queue = CommandQueue()
 
-    def move_active_hero_up(self):
+    def move_active_hero_up(self, times = 1):
         '''Triggered by the event dispatcher.'''
-        return self.env.create_move_creature_command(self.active_hero, self.env.position_up(self.active_hero.position), self.command_queue)
+        return self._move_active_hero(self.env.position_up, times)
 
-    def move_active_hero_down(self):
+    def move_active_hero_down(self, times = 1):
         '''Triggered by the event dispatcher.'''
-        return self.env.create_move_creature_command(self.active_hero, self.env.position_down(self.active_hero.position), self.command_queue)
+        return self._move_active_hero(self.env.position_down, times)
 
-    def move_active_hero_left(self):
+    def move_active_hero_left(self, times = 1):
         '''Triggered by the event dispatcher.'''
-        return self.env.create_move_creature_command(self.active_hero, self.env.position_left(self.active_hero.position), self.command_queue)
+        return self._move_active_hero(self.env.position_left, times)
 
-    def move_active_hero_right(self):
+    def move_active_hero_right(self, times = 1):
         '''Triggered by the event dispatcher.'''
-        return self.env.create_move_creature_command(self.active_hero, self.env.position_right(self.active_hero.position), self.command_queue)
+        return self._move_active_hero(self.env.position_right, times)
+
+    def _move_active_hero(self, step, times):
+        '''Move the active hero times in direction step, as long as the moves succeed.'''
+        moved = False
+        for _ in range(times):
+            if not self.env.create_move_creature_command(self.active_hero, step(self.active_hero.position), self.command_queue):
+                break
+            moved = True
+        return moved
 
     def test_flush_command(self):
         '''There are no commands that should be performed at the end of the turn. This is just proof of concept.'''
-        cmd = FlushCommand('test_flush', lambda: print('flushed'))
-        self.command_queue.add(cmd)
+        self.command_queue.add(self.create_test_flush_command())
         return True
 
+    def create_test_flush_command(self):
+        return FlushCommand('test_flush', lambda: print('flushed'), ())
+
     def end_turn(self):
         '''End the current turn'''
         self.command_queue.flush()
         for hero in self.heros:
             hero.end_turn()
+        if self.env.turn_scheduler:
+            self.env.turn_scheduler.run()
         return True
 
     def next_hero(self):
@@ -74,6 +90,8 @@ class Player(object):
 class Creature(object):
     '''A creature can move around in the environment'''
 
+    __slots__ = ('sheet', 'max_hp', 'hp', 'moves_max', 'moves', 'env', 'position', 'ui')
+
     def __init__(self, config, sheet = None, size = (1, 1), pos = None, env = None):
         self.sheet = sheet
         self.max_hp = config['hp']
@@ -83,7 +101,7 @@ class Creature(object):
         self.env = env
         self.position = pos
         if self.env and self.position:
-            self.env.creatures.append(self)
+            self.env.add_creature(self)
         self.ui = Entity(self.sheet)
 
     @property
@@ -94,6 +112,10 @@ class Creature(object):
     def y(self):
         return self.position[1]
 
+    @property
+    def movement_range(self):
+        return self.env.movement_range(self, self.moves)
+
     @property
     def reachable_positions(self):
         return self.env.reachable_positions(self, self.moves)
@@ -110,24 +132,44 @@ class Creature(object):
         self._move(position)
 
     def _move(self, position):
-        '''Set position, for usage in lambda statements. TODO: move over in env? not sure...'''
-        self.env.get_tile(self.position).state = Tile.STATE_PASSABLE
-        self.env.get_tile(position).state = Tile.STATE_UNPASSABLE
-        self.position = position
+        '''Set position, for usage in lambda statements.'''
+        self.env.move_creatures([(self, position)])
+        self.env.prefetch(position[0] - self.moves_max, position[1] - self.moves_max,
+                          position[0] + self.moves_max + 1, position[1] + self.moves_max + 1)
 
 
 class Tile(object):
-    '''A tile is field on the map.'''
+    '''
+    A tile is field on the map.
+
+    Tiles are views on the grid layers of the environment, they are created on demand by Environment.get_tile.
+
+    '''
 
     STATE_UNPASSABLE = -1
     STATE_PASSABLE = 1
 
+    __slots__ = ('position', 'size', 'env', '_index')
+
     def __init__(self, env, pos, size = (1, 1)):
         self.position = pos
         self.size = size
         self.env = env
-        self.state = self.STATE_UNPASSABLE
-        self.ui = Floor(self.env.biome, self.state)
+        self._index = env.grid.index(*pos)
+
+    @property
+    def state(self):
+        return self.env.grid.states[self._index]
+
+    @state.setter
+    def state(self, v):
+        if v != self.env.grid.states[self._index]:
+            self.env.grid.states[self._index] = v
+            self.env.touch(self.position)
+
+    @property
+    def ui(self):
+        return Floor(self.env, self._index)
 
     @property
     def x(self):
@@ -153,15 +195,99 @@ class Environment(object):
         self.size = self.width, self.height = config['map_size'][map_size_name]
         self.tile_size = self.tile_width, self.tile_height = config['tile_size']
         self.biome = biome
-        self.tiles = [[self._default_tile(x, y) for y in range(self.height)] for x in range(self.width)]
+        self.revision = 0
+        self.images = []
+        self._image_ids = {}
+        self._unpassable = [self.image_id(image) for image in biome.images('unpassable')]
+        self.chunk_generator = None
+        chunks = config.get('chunks', {})
+        self.chunked = map_size_name in chunks.get('maps', [])
+        if self.chunked:
+            self.grid = ChunkedGrid(self.size, Tile.STATE_UNPASSABLE, self._unpassable[0],
+                                    chunk_size = chunks['size'],
+                                    max_loaded = chunks['max_loaded'],
+                                    path = chunks['path'] or None,
+                                    create = self._create_chunk)
+        else:
+            self.grid = Grid(self.size, Tile.STATE_UNPASSABLE, self._unpassable[0])
         self.creatures = []
+        self.occupancy = Occupancy()
         self.player = player
         self.player.env = self
+        self.rooms = None
         self.path_finder = AStar(self)
+        self.range_finder = FloodFill(self)
+        self.range_cache = SearchCache()
+        self._hero_distances = None
+        self._search_tree = None
+        # the creatures that are not heros only move at the end of a turn if they chase the heros
+        self.turn_scheduler = TurnScheduler(self) if config.get('creatures_chase_heros') else None
+        self.vision = FieldOfView(self, config['vision_radius'])
+
+    def touch(self, *positions):
+        '''Mark the environment as changed at positions, cached search results are not valid anymore.'''
+        self.touch_occupancy(*positions)
+        if positions:
+            self.vision.invalidate(*positions)
+
+    def touch_occupancy(self, *positions):
+        '''Like touch, for positions that only creatures entered or left, which does not change what can be seen.'''
+        self.revision += 1
+        if positions:
+            self.path_finder.invalidate(*positions)
+            if self._hero_distances is not None:
+                self._hero_distances.invalidate(*positions)
+
+    def set_rooms(self, rooms):
+        '''Use the rooms, given as (x, y, width, height), as clusters for long distance path finding.'''
+        self.rooms = rooms
+        self.path_finder = HierarchicalAStar(self, rooms)
+
+    @property
+    def hero_distances(self):
+        '''Distances to the nearest hero of the player, for creatures that chase them.'''
+        if self._hero_distances is None:
+            self._hero_distances = DistanceField(self, lambda: [hero.position for hero in self.player.heros])
+        return self._hero_distances
+
+    def search_tree(self, origin):
+        '''The SearchTree of the shortest paths from origin, for the current revision.'''
+        tree = self._search_tree
+        if tree is None or tree.origin != origin or tree.revision != self.revision:
+            tree = self._search_tree = SearchTree(self, origin, self.revision)
+        return tree
 
-    def _default_tile(self, x, y):
-        '''Create this tile x times on initialize.'''
-        return Tile(self, (x, y))
+    @property
+    def visible_positions(self):
+        '''The positions the heros of the player can see.'''
+        return self.vision.visible_from([hero.position for hero in self.player.heros])
+
+    def cache_stats(self):
+        '''Hit and miss counters of the search caches, for profiling.'''
+        return {'path': self.path_finder.cache.stats(), 'range': self.range_cache.stats()}
+
+    def vary_unpassable(self, images, rnd):
+        '''Replace the image ids in images by unpassable images chosen by the random generator rnd.'''
+        if len(self._unpassable) > 1:
+            for i in range(len(images)):
+                images[i] = self._unpassable[rnd.randrange(0, len(self._unpassable))]
+
+    def _create_chunk(self, cx, cy, chunk):
+        '''Called by the chunked grid for every new chunk, chunk_generator fills it with rooms.'''
+        if self.chunk_generator:
+            self.chunk_generator(cx, cy, chunk)
+
+    def prefetch(self, x_min, y_min, x_max, y_max):
+        '''Make sure the parts of the map around the area x_min, y_min to x_max, y_max are generated and loaded.'''
+        self.grid.prefetch(x_min, y_min, x_max, y_max)
+
+    def image_id(self, image):
+        '''Get the index of image in the image palette used by the image layer of the grid.'''
+        key = id(image)
+        if key not in self._image_ids:
+            self._image_ids[key] = len(self.images)
+            self.images.append(image)
+        return self._image_ids[key]
 
     def get_node(self, tile, from_tile = False):
         '''Get a node of the map, for a* algorithm.'''
@@ -169,11 +295,12 @@ class Environment(object):
         y = tile.y
         if x < 0 or x >= self.width or y < 0 or y >= self.height:
             return None
-        d = tile.state
+        lid = (y * self.width) + x
+        d = self.grid.states[lid]
         if d == -1 and not from_tile:
             return None
 
-        return Node(tile, d, ((y * self.width) + x));
+        return Node(tile, d, lid);
 
     def get_adjacent_nodes(self, curnode, dest):
         '''Get adjacent nodes'''
@@ -192,47 +319,95 @@ class Environment(object):
         if n: result.append(n)
         return result
 
+    def get_adjacent_positions(self, position):
+        '''Get the passable positions next to position.'''
+        x, y = position
+        result = []
+        for ax, ay in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if 0 <= ax < self.width and 0 <= ay < self.height and self.grid.states[(ay * self.width) + ax] == Tile.STATE_PASSABLE:
+                result.append((ax, ay))
+        return result
+
+    def passable(self, position):
+        x, y = position
+        return 0 <= x < self.width and 0 <= y < self.height and self.grid.states[(y * self.width) + x] == Tile.STATE_PASSABLE
+
     def _handle_astar_node(self, x, y, from_node, dest_x, dest_y):
-        n = self.get_node(self.tiles[x][y])
-        if n is not None:
-            dx = max(x, dest_x) - min(x, dest_x)
-            dy = max(y, dest_y) - min(y, dest_y)
-            em_cost = dx + dy
-            n.m_cost += from_node.m_cost
-            n.score = n.m_cost + em_cost
-            n.parent = from_node
-            return n
-        return None
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return None
+        lid = (y * self.width) + x
+        d = self.grid.states[lid]
+        if d == -1:
+            return None
+        n = Node(Tile(self, (x, y)), d + from_node.m_cost, lid, from_node)
+        dx = max(x, dest_x) - min(x, dest_x)
+        dy = max(y, dest_y) - min(y, dest_y)
+        n.score = n.m_cost + dx + dy
+        return n
 
     def create_move_creature_command(self, creature, new_pos, queue = None):
         '''Generates and executes a command; adds it to the command queue if the move is possible and the queue is given.'''
         if creature.moves == 0: return False
-        if self.get_tile(new_pos).state == Tile.STATE_UNPASSABLE: return False
+        if not self.passable(new_pos): return False
         old_pos = creature.position
         if queue != None:
-            cmd = UndoCommand('move_creature', lambda: creature.move(new_pos), lambda: creature.undo_move(old_pos))
-            queue.add(cmd)
+            queue.add(self.create_undo_move_creature_command(creature, old_pos, new_pos))
         else: OneWayCommand('move_creature', lambda: creature.move(new_pos)).do()
         return True
 
+    def create_undo_move_creature_command(self, creature, old_pos, new_pos):
+        '''Create a command that moves creature to new_pos and back to old_pos when it is undone.'''
+        return UndoCommand('move_creature', lambda: creature.move(new_pos), lambda: creature.undo_move(old_pos),
+                           (self.creatures.index(creature), old_pos, new_pos))
+
+    def add_creature(self, creature):
+        '''Put creature on the map at its position.'''
+        creature.env = self
+        self.creatures.append(creature)
+        self.occupancy.add(creature, creature.position)
+        self.grid.states[self.grid.index(*creature.position)] = Tile.STATE_UNPASSABLE
+        self.touch_occupancy(creature.position)
+
+    def move_creatures(self, steps):
+        '''Move creatures by a list of (creature, position) steps at once, no two steps may end at the same position.'''
+        states = self.grid.states
+        changed = []
+        for creature, position in steps:
+            states[self.grid.index(*creature.position)] = Tile.STATE_PASSABLE
+            self.occupancy.remove(creature.position)
+            changed.append(creature.position)
+        for creature, position in steps:
+            states[self.grid.index(*position)] = Tile.STATE_UNPASSABLE
+            self.occupancy.add(creature, position)
+            creature.position = position
+            changed.append(position)
+        if changed:
+            self.touch_occupancy(*changed)
+
     def get_tile(self, position):
-        '''Get the tile at position.'''
+        '''Get the tile at position, an IndexError for positions outside of the map.'''
+        if not self.grid.contains(*position):
+            raise IndexError('position {} is outside of the map'.format(position))
+        return Tile(self, position)
+
+    def get_image(self, position):
+        '''Get the image of the tile at position.'''
         x, y = position
-        return self.tiles[x][y]
+        return self.images[self.grid.images[(y * self.width) + x]]
+
+    def movement_range(self, start, distance):
+        '''Return the range of positions reachable from start in distance, with their costs and predecessors.'''
+        return self.range_cache.get(('range', start, start.position, distance), self.revision,
+                                    lambda: self.range_finder.find_range(start, distance))
 
+    @stats.timed('Environment.reachable_positions')
     def reachable_positions(self, start, distance):
-        '''Return all reachable positions from start in distance. TODO: optimize astar, cause of many calcs here.'''
-        rp = set()
-        for x in range(start.x - distance, start.x + distance + 1):
-            for y in range(start.y - distance, start.y + distance + 1):
-                if x == start.x and y == start.y: continue
-                if math.fabs(x - start.x) + math.fabs(y - start.y) <= distance and self.tiles[x][y].state == Tile.STATE_PASSABLE:
-                    end = self.tiles[x][y]
-                    start_tile = self.tiles[x][y]
-                    p = self.path_finder.find_path(start_tile, end)
-                    if p and len(p.nodes) <= distance + 1:
-                        rp.add((x, y))
-        return rp
+        '''Return the frozenset of all reachable positions from start in distance, it is shared by the callers until the map changes.'''
+        def _reachable():
+            rp = set(self.movement_range(start, distance).get_positions())
+            rp.discard(start.position)
+            return frozenset(rp)
+        return self.range_cache.get(('reachable', start, start.position, distance), self.revision, _reachable)
 
     def position_up(self, pos):
         return (pos[0], pos[1] - 1)
@@ -283,16 +458,20 @@ class Configuration(dict):
 class Launcher():
     '''
     Launch the game.
+
+    A headless launcher uses the dummy video driver of SDL, so it runs without a display.
     '''
 
-    def __init__(self):
+    def __init__(self, headless = False, map_size_name = 'small'):
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
         pygame.init()
         self.modes = pygame.display.list_modes()
         self.cfg = Configuration()
         logging.debug('cfg: {}'.format(self.cfg))
 
         self.screen_size = self.width , self.height = self.cfg['gfx']['resolution']
-        if self.cfg['gfx']['fullscreen']:
+        if self.cfg['gfx']['fullscreen'] and not headless:
             self.screen = pygame.display.set_mode(self.screen_size, pygame.FULLSCREEN | pygame.DOUBLEBUF | pygame.HWSURFACE)
         else:
             self.screen = pygame.display.set_mode(self.screen_size, pygame.NOFRAME)
@@ -304,9 +483,13 @@ class Launcher():
         self.clock = pygame.time.Clock()
         self.fps = self.cfg['gfx']['max_fps']
         self.playtime = 0.0
+        self.exposed = False
 
+        start = time.time()
+        self.image_cache = ImageCache(self.cfg['image']['cache_mb'] * 1024 * 1024)
         self.biomes = self.init_biomes()
         self.creatures = self.init_creatures()
+        logging.debug('image sheets indexed in {:.1f} ms'.format((time.time() - start) * 1000))
         self.player = Player(heros = [Creature(self.cfg['creatures']['sheep'], self.creatures['sheep']),
                                       Creature(self.cfg['creatures']['sheep'], self.creatures['sheep']),
                                       Creature(self.cfg['creatures']['sheep'], self.creatures['sheep']),
@@ -315,71 +498,99 @@ class Launcher():
         self.env_generator = EnvironmentGenerator(self.cfg['generator'], self.cfg['creatures'], seed = 'testing')
         self.env = self.env_generator.create(Environment(biome = self.biomes['default'],
                                                          config = self.cfg['environment'],
-                                                         map_size_name = 'small',
+                                                         map_size_name = map_size_name,
                                                          player = self.player),
                                              self.creatures)
+        self.planner = None
+        if self.cfg['planning']['processes'] > 0:
+            if self.env.chunked:
+                logging.warning('the planning service does not support chunked maps, planning on the game loop')
+            else:
+                self.planner = PlanningService(self.env, self.cfg['planning']['processes'])
         self.camera = Map(pygame.Rect((0, 0), (self.width, self.height - 256)),
                           self.env,
                           zoom_levels = self.cfg['ui']['camera']['zoom_levels'],
                           zoom_level = self.cfg['ui']['camera']['zoom_level'],
-                          scroll_speed = self.cfg['ui']['camera']['scroll_speed'])
+                          scroll_speed = self.cfg['ui']['camera']['scroll_speed'],
+                          incremental = self.cfg['ui']['camera']['incremental'],
+                          floor_cache_size = self.cfg['ui']['camera']['floor_cache_mb'] * 1024 * 1024,
+                          planner = self.planner,
+                          fog = self.cfg['ui']['camera']['fog'])
         self.fps_ui = FpsLayer(self.font, self.clock, (self.width - 150, self.height - 30))
 
         self.dispatcher = EventDispatcher(self.cfg['controls'], {'camera': self.camera,
                                                                  'game': self,
-                                                                 'player': self.player})
+                                                                 'player': self.player},
+                                          self.cfg['events']['coalesce'],
+                                          self.repaint)
+        if self.cfg['events']['filter']:
+            self.dispatcher.allow_events()
 
-        self.ui_group = pygame.sprite.LayeredUpdates(self.camera, self.fps_ui)
+        self.ui_group = pygame.sprite.LayeredUpdates(self.fps_ui)
+
+        stats.enabled = self.cfg['stats']['enabled']
+        if self.cfg['stats']['layer']:
+            self.stats_ui = StatsLayer(pygame.font.SysFont('mono', 14), stats, (10, self.height - 240))
+            self.ui_group.add(self.stats_ui)
 
     def quit(self):
         pygame.event.post(pygame.event.Event(pygame.QUIT))
 
-    def run(self):
+    def repaint(self):
+        '''Draw the whole screen again in the next frame, after the window was exposed or restored.'''
+        self.camera.invalidate()
+        self.exposed = True
+
+    def run(self, frames = None, script = None):
+        '''
+        Run the game loop until the game quits or the given number of frames is rendered.
+
+        script is called with the number of the frame before its events are read,
+        it may post events or move the mouse to simulate a player.
+
+        '''
         running = True
+        frame = 0
         pygame.key.set_repeat(200, 10)
-        while running:
-            for event in pygame.event.get():
-                running = self.dispatcher.dispatch(event)
+        while running and (frames is None or frame < frames):
+            if script:
+                script(frame)
+            with stats.section('dispatch'):
+                running = self.dispatcher.dispatch_all(pygame.event.get())
             milliseconds = self.clock.tick(self.fps)
             self.playtime += milliseconds / 1000.0
-            self.ui_group.clear(self.screen, self.background)
-            self.ui_group.update()
-            pygame.display.update(self.ui_group.draw(self.screen))
+            with stats.section('update'):
+                self.ui_group.clear(self.screen, self.background)
+                self.camera.update()
+                self.ui_group.update()
+            with stats.section('draw'):
+                rects = self.camera.draw(self.screen) + self.ui_group.draw(self.screen)
+                if self.exposed:
+                    self.exposed = False
+                    pygame.display.update()
+                else:
+                    pygame.display.update(rects)
+            frame += 1
+        if not running and self.planner:
+            # the game quit, run may be called again for more frames otherwise
+            self.planner.close()
+        if self.cfg['stats']['export']:
+            stats.export(self.cfg['stats']['export'])
 
     def init_biomes(self):
         _b = {}
         for name, config in self.cfg['image']['biomes'].iteritems():
-            _b[name] = Biome(name, config, self.cfg['ui']['camera']['zoom_levels'])
+            _b[name] = Biome(name, config, self.cfg['ui']['camera']['zoom_levels'], self.image_cache, self.cfg['image']['cache_dir'])
         return _b
 
     def init_creatures(self):
         _b = {}
         for name, config in self.cfg['image']['creatures'].iteritems():
-            _b[name] = CreatureSheet(name, config, self.cfg['ui']['camera']['zoom_levels'])
+            _b[name] = CreatureSheet(name, config, self.cfg['ui']['camera']['zoom_levels'], self.image_cache, self.cfg['image']['cache_dir'])
         return _b
 
 
 if __name__ == '__main__':
-    def profile(function, *args, **kwargs):
-        """ Returns performance statistics (as a string) for the given function."""
-        def _run():
-            function(*args, **kwargs)
-        import cProfile as profile
-        import pstats
-        sys.modules['__main__'].__profile_run__ = _run
-        identifier = function.__name__ + '()'
-        profile.run('__profile_run__()', identifier)
-        p = pstats.Stats(identifier)
-        p.stream = open(identifier, 'w')
-        p.sort_stats('time').print_stats(50)
-        p.stream.close()
-        s = open(identifier).read()
-        os.remove(identifier)
-        return s
     if DEBUG:
         logging.basicConfig(level = logging.DEBUG)
-    if PROFILE:
-        profile_result = profile(Launcher().run)
-        print(profile_result)
-    else:
-        Launcher().run()
+    Launcher().run()
@@ -3,10 +3,22 @@
 import pygame
 from collections import namedtuple, deque
 
+# the state of an ACTIVEEVENT when the window was iconified or restored, SDL_APPACTIVE
+APPACTIVE = 0x04
+
 
 class EventDispatcher(object):
+    '''
+    Runs the commands bound to keys.
+
+    Events are handled by the handler registered for their type in handlers, events of
+    other types are ignored. The commands named in coalesce are called once with the
+    number of times their key was pressed in a row, instead of once per key press.
+    repaint is called when the window was exposed or restored and has to be drawn again.
 
-    def __init__(self, controls = {}, actors = {}):
+    '''
+
+    def __init__(self, controls = {}, actors = {}, coalesce = (), repaint = None):
         '''
         Initialize this dispatcher.
 
@@ -17,6 +29,12 @@ class EventDispatcher(object):
         self.actors = actors
         self.commands = {}
         self.keydown_events = {}
+        self.coalesce = set(coalesce)
+        self.repaint = repaint
+        self.handlers = {pygame.KEYDOWN: self._key_down,
+                         pygame.QUIT: self._quit}
+        if repaint:
+            self.handlers[pygame.VIDEOEXPOSE] = self.handlers[pygame.ACTIVEEVENT] = self._repaint
         for actor_name, actor_controls in controls.iteritems():
             for method_name, key_bindings in actor_controls.iteritems():
                 command_name = actor_name + '_' + method_name
@@ -28,26 +46,67 @@ class EventDispatcher(object):
 
     def dispatch(self, event):
         '''
-        Dispatch incoming events from pygame.
+        Dispatch an incoming event from pygame.
 
-        Currently only KEYDOWN and QUIT were handled at all.
+        Returns False if the game should quit.
 
         '''
-        if event.type == pygame.MOUSEMOTION:
-            return True
-        elif event.type == pygame.MOUSEBUTTONUP or event.type == pygame.MOUSEBUTTONDOWN:
+        handler = self.handlers.get(event.type)
+        if handler is None:
             return True
-        elif event.type == pygame.KEYDOWN:
-            if event.key in self.keydown_events:
-                for cmd in self.keydown_events[event.key]:
-                    if self.commands[cmd].do(): return True
-            return True
-        elif event.type == pygame.KEYUP:
+        return handler(event, 1)
+
+    def dispatch_all(self, events):
+        '''
+        Dispatch the events of a frame, pressing the same key several times in a row counts once for commands in coalesce.
+
+        Events without a handler do not break a row of key presses.
+
+        Returns False if the game should quit, the events after the one that quits are not dispatched.
+
+        '''
+        handlers = self.handlers
+        events = [event for event in events if event.type in handlers]
+        i = 0
+        while i < len(events):
+            event = events[i]
+            i += 1
+            times = 1
+            if event.type == pygame.KEYDOWN:
+                while i < len(events) and events[i].type == pygame.KEYDOWN and events[i].key == event.key:
+                    times += 1
+                    i += 1
+            if not handlers[event.type](event, times):
+                return False
+        return True
+
+    def allow_events(self):
+        '''Let pygame put only the events with a handler on the queue.'''
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(list(self.handlers))
+
+    def _key_down(self, event, times):
+        '''Run the commands bound to the key, the first one that succeeds ends the key press.'''
+        names = self.keydown_events.get(event.key, ())
+        if times > 1 and not self.coalesce.issuperset(names):
+            for _ in range(times):
+                self._key_down(event, 1)
             return True
-        elif event.type == pygame.QUIT:
-            return False
-        else:
+        for name in names:
+            if name in self.coalesce:
+                if self.commands[name].do(times): return True
+            elif self.commands[name].do(): return True
+        return True
+
+    def _quit(self, event, times):
+        return False
+
+    def _repaint(self, event, times):
+        if event.type == pygame.ACTIVEEVENT and not (event.gain and event.state & APPACTIVE):
+            # only restoring the window needs a repaint, not a change of the focus
             return True
+        self.repaint()
+        return True
 
 
 class CommandQueue(deque):
@@ -74,7 +133,10 @@ class CommandQueue(deque):
                 cmd.do()
 
 
-OneWayCommand = namedtuple('OneWayCommand', ['name', 'do'])
+OneWayCommand = namedtuple('OneWayCommand', ['name', 'do', 'args'])
+OneWayCommand.__new__.__defaults__ = (None,)
 FlushCommand = OneWayCommand
 '''FlushCommands are special OneWayCommands that will be executed when a CommandQueue gets flushed.'''
-UndoCommand = namedtuple('UndoCommand', ['name', 'do', 'undo'])
+UndoCommand = namedtuple('UndoCommand', ['name', 'do', 'undo', 'args'])
+UndoCommand.__new__.__defaults__ = (None,)
+'''args are the plain values a command was created from, commands with args can be saved in a snapshot.'''
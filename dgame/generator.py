@@ -3,45 +3,78 @@
 Generating the environment. Needs refactoring.
 '''
 import random, logging
-from dgame.core import Creature
+from dgame.core import Creature, Tile
+
+CLOSED = b'\x01'
 
 
 class EnvironmentGenerator(object):
+    '''
+    Generates rooms and places creatures in an environment.
+
+    Used positions are tracked in an occupancy grid with one byte per tile. Testing if
+    a room fits compares one slice per row of the room, free positions are found by
+    sampling random tiles. All random decisions are made by a random generator seeded
+    with seed, the same seed creates the same map.
+
+    Chunked environments are generated chunk by chunk when the grid creates them, the
+    map config then gives the rooms per chunk. Each chunk has its own random generator
+    seeded with seed and the chunk position, so the order chunks are visited in does
+    not change the map. Only the first room is kept in rooms then, to place the heros,
+    the rooms of the other chunks are in the tiles only.
+
+    '''
+
+    MAX_SAMPLES = 64
 
     def __init__(self, config, creature_config, seed = None):
         self.config = config
         self.creature_config = creature_config
-        if seed:
-            random.seed(seed)
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.random = random.Random(self.seed)
 
     def create(self, env, creatures):
         '''Create a environment based on the configuration on a incoming environment that includes only unpassable tiles.'''
         self.env = env
-        self.open_pos = self._get_pos_set((1, 1), (self.env.size[0] - 2, self.env.size[1] - 2))
-        self.close_pos = set()
         self.rooms = []
-        self.gen_rooms_from_config(self.config['map_config'][self.env.map_size_name])
+        if self.env.chunked:
+            self.env.chunk_generator = self.gen_chunk
+            # the heros start in the first chunk
+            self.env.grid.chunk(0, 0)
+        else:
+            self.env.vary_unpassable(self.env.grid.images, self.random)
+            self._open_region(0, 0, self.env.width, self.env.height)
+            self.gen_rooms_from_config(self.config['map_config'][self.env.map_size_name])
+            self.env.set_rooms([room['rect'] for room in self.rooms])
         self.place_player_heros()
         self.place_creatures(creatures)
+        self.env.touch()
         return self.env
 
+    def gen_chunk(self, cx, cy, chunk):
+        '''Generate the walls and rooms of the chunk at chunk position cx, cy.'''
+        size = self.env.grid.chunk_size
+        x, y = cx * size, cy * size
+        self.random = random.Random('{}:{}:{}'.format(self.seed, cx, cy))
+        self.env.vary_unpassable(chunk.images, self.random)
+        self._open_region(x, y, min(size, self.env.width - x), min(size, self.env.height - y))
+        self.gen_rooms_from_config(self.config['map_config'][self.env.map_size_name])
+        del self.rooms[1:]
+
     def place_creatures(self, creatures):
         '''Place some creatures in the environment.'''
         for _ in range(2):
-            pos = random.sample(self.rooms[0]['free'], 1)[0]
+            pos = self._get_free_room_pos(self.rooms[0])
             Creature(config = self.creature_config['sheep'],
                      sheet = creatures['sheep'],
                      env = self.env,
                      pos = pos)
-            self.env.get_tile(pos).state = -1
 
     def place_player_heros(self):
         '''Place all heros of the player together in the first generated room.'''
         for hero in self.env.player.heros:
-            hero.position = random.sample(self.rooms[0]['free'], 1)[0]
-            hero.env = self.env
-            self.env.creatures.append(hero)
-            self.env.get_tile(hero.position).state = -1
+            hero.position = self._get_free_room_pos(self.rooms[0])
+            self.env.add_creature(hero)
 
     def gen_rooms_from_config(self, config):
         '''Try to generate all rooms configured.'''
@@ -54,50 +87,78 @@ class EnvironmentGenerator(object):
 
     def gen_room(self, size_template):
         '''Generate a room with a random size described by size_template.'''
-        size = (random.randrange(size_template[0][0], size_template[1][0]),
-                random.randrange(size_template[0][1], size_template[1][1]))
-        start_pos, room_pos = self.find_free_space(size)
-        room_pos_used, room_pos_free = self.decorate_room(start_pos, room_pos, size)
-        return {'used': room_pos_used, 'free': room_pos_free}
+        size = (self.random.randrange(size_template[0][0], size_template[1][0]),
+                self.random.randrange(size_template[0][1], size_template[1][1]))
+        start_pos = self.find_free_space(size)
+        room_pos_used, room_pos_free = self.decorate_room(start_pos, size)
+        return {'used': room_pos_used, 'free': room_pos_free, 'rect': start_pos + size}
 
     def find_free_space(self, size):
         '''Find s suitable place for a room in the map.'''
         for i in range(1000):
             start_pos = self._get_free_pos()
-            room_pos = self._get_pos_set(start_pos, size)
-            if room_pos <= self.open_pos:
-                self._close_position(room_pos)
-                return start_pos, room_pos
-            if i == 999:
-                raise Exception('Can not find suitable place.')
-
-    def decorate_room(self, start_pos, room_pos, size):
+            if start_pos and self._fits(start_pos, size):
+                self._close_position(start_pos, size)
+                return start_pos
+        raise Exception('Can not find suitable place.')
+
+    def decorate_room(self, start_pos, size):
         '''Fill a room with different tiles.'''
         room_pos_used = set()
         room_pos_free = set()
-        for x, y in room_pos:
-            if x == start_pos[0] or y == start_pos[1] or x == start_pos[0] + size[0] - 1 or y == start_pos[1] + size[1] - 1:
-                self.env.tiles[x][y].ui.image = self.env.biome.wall
-                room_pos_used.add((x, y))
-            else:
-                self.env.tiles[x][y].ui.image = self.env.biome.passable
-                self.env.tiles[x][y].state = self.env.tiles[x][y].STATE_PASSABLE
-                room_pos_free.add((x, y))
-        return room_pos_used, room_pos_free
-
-    def _get_pos_set(self, start_pos, size):
-        '''Get a set including all positions from start_pos with size.'''
-        s = set()
+        walls = self.env.biome.images('wall')
+        floors = self.env.biome.images('passable')
         for x in range(start_pos[0], start_pos[0] + size[0]):
             for y in range(start_pos[1], start_pos[1] + size[1]):
-                s.add((x, y))
-        return s
+                tile = self.env.get_tile((x, y))
+                if x == start_pos[0] or y == start_pos[1] or x == start_pos[0] + size[0] - 1 or y == start_pos[1] + size[1] - 1:
+                    tile.ui.image = self.random.choice(walls)
+                    room_pos_used.add((x, y))
+                else:
+                    tile.ui.image = self.random.choice(floors)
+                    tile.state = tile.STATE_PASSABLE
+                    room_pos_free.add((x, y))
+        return room_pos_used, room_pos_free
 
-    def _close_position(self, pos_set):
-        '''Mark a set of positions as used.'''
-        self.open_pos -= pos_set
-        self.close_pos = self.close_pos | pos_set
+    def _open_region(self, x, y, width, height):
+        '''Start placing rooms in the area of the map at x, y with width and height.'''
+        self.region = (x, y, width, height)
+        self.occupied = bytearray(width * height)
+        # the border of the region is never used
+        self.occupied[:width] = self.occupied[-width:] = CLOSED * width
+        for row in range(height):
+            self.occupied[row * width] = self.occupied[row * width + width - 1] = CLOSED
+
+    def _fits(self, start_pos, size):
+        '''Check if all positions from start_pos with size are unused.'''
+        rx, ry, width, height = self.region
+        x, y = start_pos[0] - rx, start_pos[1] - ry
+        if x + size[0] > width or y + size[1] > height:
+            return False
+        for row in range(y, y + size[1]):
+            i = row * width + x
+            if self.occupied.find(CLOSED, i, i + size[0]) != -1:
+                return False
+        return True
+
+    def _close_position(self, start_pos, size):
+        '''Mark all positions from start_pos with size as used.'''
+        rx, ry, width, height = self.region
+        x, y = start_pos[0] - rx, start_pos[1] - ry
+        for row in range(y, y + size[1]):
+            i = row * width + x
+            self.occupied[i:i + size[0]] = CLOSED * size[0]
 
     def _get_free_pos(self):
-        '''Get a random posotion of the map that is unused.'''
-        return random.sample(self.open_pos, 1)[0]
+        '''Get a random position of the region that is unused, None if MAX_SAMPLES tiles were used.'''
+        rx, ry, width, height = self.region
+        for _ in range(self.MAX_SAMPLES):
+            x = self.random.randrange(1, width - 1)
+            y = self.random.randrange(1, height - 1)
+            if not self.occupied[y * width + x]:
+                return rx + x, ry + y
+        return None
+
+    def _get_free_room_pos(self, room):
+        '''Get a random position in room that is not taken by a creature.'''
+        return self.random.choice(sorted(pos for pos in room['free'] if self.env.get_tile(pos).state == Tile.STATE_PASSABLE))
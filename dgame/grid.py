@@ -0,0 +1,244 @@
+# coding=utf-8
+'''
+Compact storage for the layers of a map.
+
+Every layer is a flat array with one entry per tile, the tile at x, y is stored
+at index y * width + x. Huge maps use a ChunkedGrid, which offers the same
+interface but keeps only the recently used parts of the layers in memory.
+
+The creatures on a map are indexed by their position in an Occupancy.
+'''
+import os, atexit, shutil, tempfile, zlib
+import operator
+import collections
+from array import array
+
+
+class Grid(object):
+    '''The passability and image layers of an environment.'''
+
+    def __init__(self, size, state, image = 0):
+        self.size = self.width, self.height = size
+        cells = self.width * self.height
+        self.states = array('b', [state]) * cells
+        self.images = array('H', [image]) * cells
+
+    def index(self, x, y):
+        return y * self.width + x
+
+    def contains(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    @property
+    def nbytes(self):
+        '''Memory used by the layers.'''
+        return len(self.states) * self.states.itemsize + len(self.images) * self.images.itemsize
+
+    def prefetch(self, x_min, y_min, x_max, y_max):
+        '''All layers are in memory, nothing to load.'''
+        pass
+
+
+class Chunk(object):
+    '''The layers of chunk_size x chunk_size tiles of a ChunkedGrid.'''
+
+    __slots__ = ('states', 'images', 'dirty')
+
+    def __init__(self, states, images, dirty = True):
+        self.states = states
+        self.images = images
+        self.dirty = dirty
+
+
+class ChunkedLayer(object):
+    '''A layer of a ChunkedGrid, indexed like the flat arrays of Grid.'''
+
+    __slots__ = ('grid', 'get')
+
+    def __init__(self, grid, name):
+        self.grid = grid
+        self.get = operator.attrgetter(name)
+
+    def __getitem__(self, index):
+        y, x = divmod(index, self.grid.width)
+        if not 0 <= y < self.grid.height:
+            raise IndexError('layer index out of range')
+        chunk, i = self.grid.locate(x, y)
+        return self.get(chunk)[i]
+
+    def __setitem__(self, index, value):
+        y, x = divmod(index, self.grid.width)
+        if not 0 <= y < self.grid.height:
+            raise IndexError('layer index out of range')
+        chunk, i = self.grid.locate(x, y)
+        self.get(chunk)[i] = value
+        chunk.dirty = True
+
+    def __len__(self):
+        return self.grid.width * self.grid.height
+
+
+class ChunkedGrid(object):
+    '''
+    The passability and image layers of a huge environment, split into chunks.
+
+    A chunk is created when it is accessed first and passed to create(cx, cy, chunk),
+    which generates its content. At most max_loaded chunks are kept in memory, the
+    least recently used ones are written to a file below path and read back when they
+    are accessed again. The files are removed when the interpreter exits.
+
+    '''
+
+    def __init__(self, size, state, image = 0, chunk_size = 64, max_loaded = 256, path = None, create = None):
+        self.size = self.width, self.height = size
+        self.chunk_size = chunk_size
+        self.max_loaded = max_loaded
+        self.create = create
+        self.margin = chunk_size // 2
+        self._empty = (array('b', [state]) * (chunk_size * chunk_size),
+                       array('H', [image]) * (chunk_size * chunk_size))
+        self.path = tempfile.mkdtemp(prefix = 'dgame-chunks-', dir = path)
+        atexit.register(shutil.rmtree, self.path, True)
+        self.chunks = collections.OrderedDict()
+        self.stored = set()
+        self.created = self.loaded = self.evicted = 0
+        self._last = (None, None)
+        self.states = ChunkedLayer(self, 'states')
+        self.images = ChunkedLayer(self, 'images')
+
+    def index(self, x, y):
+        return y * self.width + x
+
+    def contains(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    @property
+    def nbytes(self):
+        '''Memory used by the loaded chunks.'''
+        states, images = self._empty
+        return len(self.chunks) * (len(states) * states.itemsize + len(images) * images.itemsize)
+
+    def locate(self, x, y):
+        '''Get the chunk of the tile at x, y and the index of the tile in the chunk.'''
+        cx, ix = divmod(x, self.chunk_size)
+        cy, iy = divmod(y, self.chunk_size)
+        return self.chunk(cx, cy), iy * self.chunk_size + ix
+
+    def chunk(self, cx, cy):
+        '''Get the chunk at chunk position cx, cy, loading or creating it if needed.'''
+        key = (cx, cy)
+        if self._last[0] == key:
+            return self._last[1]
+        chunk = self.chunks.pop(key, None)
+        if chunk is None:
+            chunk = self._load(key) if key in self.stored else self._create(key)
+        else:
+            self.chunks[key] = chunk
+        self._last = (key, chunk)
+        return chunk
+
+    def prefetch(self, x_min, y_min, x_max, y_max):
+        '''Load the chunks around the area x_min, y_min to x_max, y_max before they are accessed.'''
+        size = self.chunk_size
+        for cx in range(max(x_min - self.margin, 0) // size, (min(x_max + self.margin, self.width) - 1) // size + 1):
+            for cy in range(max(y_min - self.margin, 0) // size, (min(y_max + self.margin, self.height) - 1) // size + 1):
+                self.chunk(cx, cy)
+
+    def _create(self, key):
+        chunk = Chunk(array('b', self._empty[0]), array('H', self._empty[1]))
+        self._add(key, chunk)
+        self.created += 1
+        if self.create:
+            self.create(key[0], key[1], chunk)
+        return chunk
+
+    def _load(self, key):
+        with open(self._chunk_path(key), 'rb') as chunk_file:
+            data = zlib.decompress(chunk_file.read())
+        split = len(self._empty[0]) * self._empty[0].itemsize
+        states = array('b')
+        states.fromstring(data[:split])
+        images = array('H')
+        images.fromstring(data[split:])
+        chunk = Chunk(states, images, False)
+        self._add(key, chunk)
+        self.loaded += 1
+        return chunk
+
+    def _add(self, key, chunk):
+        '''Add a chunk as the most recently used one, evict the least recently used ones if needed.'''
+        self.chunks[key] = chunk
+        while len(self.chunks) > self.max_loaded:
+            old_key, old = self.chunks.popitem(last = False)
+            if old.dirty:
+                with open(self._chunk_path(old_key), 'wb') as chunk_file:
+                    chunk_file.write(zlib.compress(old.states.tostring() + old.images.tostring(), 1))
+                self.stored.add(old_key)
+            self.evicted += 1
+        self._last = (None, None)
+
+    def _chunk_path(self, key):
+        return os.path.join(self.path, '{}_{}.chunk'.format(*key))
+
+
+class Occupancy(object):
+    '''
+    Which creature is at which position of a map.
+
+    Creatures are found by their position in a dict and are also kept in buckets of
+    bucket_size x bucket_size tiles, so the creatures in an area are found without
+    looking at all creatures of the map.
+
+    '''
+
+    def __init__(self, bucket_size = 16):
+        self.bucket_size = bucket_size
+        self.positions = {}  # position -> creature
+        self.buckets = {}  # (bx, by) -> {position: creature}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def at(self, position):
+        '''The creature at position, None if there is none.'''
+        return self.positions.get(position)
+
+    def add(self, creature, position):
+        self.positions[position] = creature
+        x, y = position
+        key = (x // self.bucket_size, y // self.bucket_size)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = {}
+        bucket[position] = creature
+
+    def remove(self, position):
+        '''Remove the creature at position and return it.'''
+        creature = self.positions.pop(position)
+        x, y = position
+        key = (x // self.bucket_size, y // self.bucket_size)
+        bucket = self.buckets[key]
+        del bucket[position]
+        if not bucket:
+            del self.buckets[key]
+        return creature
+
+    def move(self, old, new):
+        '''Move the creature at old to new.'''
+        self.add(self.remove(old), new)
+
+    def within(self, x_min, y_min, x_max, y_max):
+        '''The creatures at x_min <= x < x_max, y_min <= y < y_max.'''
+        size = self.bucket_size
+        result = []
+        for bx in range(x_min // size, (x_max - 1) // size + 1):
+            for by in range(y_min // size, (y_max - 1) // size + 1):
+                bucket = self.buckets.get((bx, by))
+                if bucket is None:
+                    continue
+                if x_min <= bx * size and (bx + 1) * size <= x_max and y_min <= by * size and (by + 1) * size <= y_max:
+                    result.extend(bucket.itervalues())
+                else:
+                    result.extend(creature for (x, y), creature in bucket.iteritems()
+                                  if x_min <= x < x_max and y_min <= y < y_max)
+        return result
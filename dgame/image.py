@@ -3,40 +3,270 @@
 Read images from data, for blitting. Handles scaling the images for zoom in and out.
 '''
 import pygame
-import os, random
+import os, random, math
+import collections, hashlib, json, mmap, struct
+import yaml
+
+
+class ImageCache(object):
+    '''
+    Keep loaded images and atlases until they are not needed anymore.
+
+    Once the cached entries need more than size bytes, the least recently used
+    ones are dropped. They are loaded again when they are needed later.
+
+    '''
+
+    def __init__(self, size = 128 * 1024 * 1024):
+        self.size = size
+        self.used = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        '''Get the surface or atlas cached for key, load() creates it when it is missing.'''
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            value = load()
+            entry = (value, self._bytes(value))
+            self.used += entry[1]
+            while self.entries and self.used > self.size:
+                self.used -= self.entries.popitem(last = False)[1][1]
+        else:
+            self.hits += 1
+        self.entries[key] = entry
+        return entry[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.used}
+
+    def _bytes(self, value):
+        surface = getattr(value, 'surface', value)
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+default_cache = ImageCache()
+
+
+class Atlas(object):
+    '''
+    Images packed into a single surface.
+
+    The index holds the area of every image by name, use it for area blits from
+    the atlas surface, e.g. with Surface.blits. If the packed images use a colorkey,
+    the atlas uses the first one for its transparent parts.
+
+    '''
+
+    def __init__(self, surface, index):
+        self.surface = surface
+        self.index = index
+        self._subsurfaces = {}
+
+    def __getitem__(self, name):
+        '''A subsurface of the atlas showing the image name.'''
+        if name not in self._subsurfaces:
+            self._subsurfaces[name] = self.surface.subsurface(self.index[name])
+        return self._subsurfaces[name]
+
+    @classmethod
+    def pack(cls, images):
+        '''Pack a dict of surfaces by name into shelves, sorted by height.'''
+        names = sorted(images, key = lambda n: (-images[n].get_height(), n))
+        area = sum(images[n].get_width() * images[n].get_height() for n in names)
+        width = max([int(math.ceil(math.sqrt(area)))] + [images[n].get_width() for n in names])
+        index = {}
+        x = y = shelf = 0
+        for n in names:
+            w, h = images[n].get_size()
+            if x + w > width:
+                x, y, shelf = 0, y + shelf, 0
+            index[n] = (x, y, w, h)
+            x += w
+            shelf = max(shelf, h)
+        surface = pygame.Surface((width, y + shelf)).convert()
+        colorkeys = [images[n].get_colorkey() for n in names if images[n].get_colorkey()]
+        if colorkeys:
+            surface.fill(colorkeys[0])
+            surface.set_colorkey(colorkeys[0])
+        surface.blits([(images[n], index[n][:2]) for n in names], 0)
+        return cls(surface, index)
+
+    def save(self, path):
+        '''Write the atlas surface to path.png and its index and colorkey to path.yaml.'''
+        pygame.image.save(self.surface, path + '.png')
+        colorkey = self.surface.get_colorkey()
+        with open(path + '.yaml', 'w') as index_file:
+            yaml.dump({'colorkey': list(colorkey) if colorkey else None,
+                       'index': dict((n, list(a)) for n, a in self.index.iteritems())}, index_file)
+
+    @classmethod
+    def load(cls, path):
+        '''Read an atlas written by save.'''
+        with open(path + '.yaml') as index_file:
+            data = yaml.safe_load(index_file)
+        surface = pygame.image.load(path + '.png').convert()
+        if data['colorkey']:
+            surface.set_colorkey(data['colorkey'])
+        return cls(surface, dict((n, tuple(a)) for n, a in data['index'].iteritems()))
+
+
+class AtlasFile(object):
+    '''
+    The atlases of an ImageDict for all zoom levels in one binary file.
+
+    The file starts with a JSON header that describes every atlas and the key of the
+    sources it was built from, followed by the raw RGB pixels of the atlases. Offsets
+    in the header are relative to the end of the header. Reading
+    maps the file into memory and converts the pixels of the requested atlas, which
+    is much faster than decoding and scaling the images again.
+
+    '''
+
+    MAGIC = 'DGATLAS1'
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def load(self, zoom_level):
+        '''Read the atlas for zoom_level, None if the file is missing or built from other sources.'''
+        try:
+            with open(self.path, 'rb') as atlas_file:
+                data = mmap.mmap(atlas_file.fileno(), 0, access = mmap.ACCESS_READ)
+        except (IOError, ValueError):
+            return None
+        try:
+            if data[:len(self.MAGIC)] != self.MAGIC:
+                return None
+            header_start = len(self.MAGIC) + 4
+            header_size = struct.unpack('<I', data[len(self.MAGIC):header_start])[0]
+            header = json.loads(data[header_start:header_start + header_size])
+            if header['key'] != self.key or repr(zoom_level) not in header['atlases']:
+                return None
+            atlas = header['atlases'][repr(zoom_level)]
+            size = tuple(atlas['size'])
+            pixels = buffer(data, header_start + header_size + atlas['offset'], size[0] * size[1] * 3)
+            surface = pygame.image.frombuffer(pixels, size, 'RGB').convert()
+        finally:
+            data.close()
+        if atlas['colorkey']:
+            surface.set_colorkey(atlas['colorkey'])
+        return Atlas(surface, dict((n, tuple(a)) for n, a in atlas['index'].iteritems()))
+
+    def save(self, atlases):
+        '''Write a dict of atlases by zoom level, replacing the file at once.'''
+        header = {'key': self.key, 'atlases': {}}
+        blocks = []
+        offset = 0
+        for zoom_level, atlas in sorted(atlases.items()):
+            colorkey = atlas.surface.get_colorkey()
+            pixels = pygame.image.tostring(atlas.surface, 'RGB')
+            header['atlases'][repr(zoom_level)] = {'size': atlas.surface.get_size(),
+                                                   'offset': offset,
+                                                   'colorkey': list(colorkey) if colorkey else None,
+                                                   'index': atlas.index}
+            blocks.append(pixels)
+            offset += len(pixels)
+        encoded = json.dumps(header)
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        with open(self.path + '.tmp', 'wb') as atlas_file:
+            atlas_file.write(self.MAGIC + struct.pack('<I', len(encoded)) + encoded)
+            for pixels in blocks:
+                atlas_file.write(pixels)
+        os.rename(self.path + '.tmp', self.path)
+
+
+class Image(object):
+    '''An image of an ImageDict, index it with a zoom level to get the scaled surface.'''
+
+    __slots__ = ('sheet', 'name', 'path')
+
+    def __init__(self, sheet, name, path):
+        self.sheet = sheet
+        self.name = name
+        self.path = path
+
+    def __getitem__(self, zoom_level):
+        return self.sheet.atlas(zoom_level)[self.name]
+
+    def area(self, zoom_level):
+        '''The atlas surface with this image scaled by zoom_level, and the area of the image in it.'''
+        atlas = self.sheet.atlas(zoom_level)
+        return atlas.surface, atlas.index[self.name]
+
 
 class ImageDict(dict):
     '''
-    Load a folder with images into itself.
+    Index a folder with images into itself.
 
     You can access them like this:
         sd = SpriteDict(*path)
-        sd['filenamewithoutextension']
+        sd['filenamewithoutextension'][zoom_level]
+
+    Nothing is loaded until an image is requested for a zoom level. Then all images
+    of the folder are scaled and packed into one atlas for that zoom level.
+
+    With a cache_dir the atlases of all zoom_levels are written to an AtlasFile on
+    first use and read from it on later launches, as long as the images did not change.
 
     '''
 
-    def __init__(self, path, image_format = 'png', zoom_levels = []):
+    def __init__(self, path, image_format = 'png', zoom_levels = [], cache = None, cache_dir = None):
         self.folder = os.path.join(*path)
-        for f in os.listdir(self.folder):
+        self.zoom_levels = zoom_levels
+        self.cache = default_cache if cache is None else cache
+        key = hashlib.sha1(repr(zoom_levels))
+        for f in sorted(os.listdir(self.folder)):
             if f.endswith('.' + image_format):
-                img = pygame.image.load(os.path.join(*[self.folder, f])).convert()
                 name = f.split('.')[0]
-                self[name] = {}
-                for zl in zoom_levels:
-                    z_size = (int(img.get_rect().width * zl), int(img.get_rect().height * zl))
-                    self[name][zl] = pygame.transform.scale(img, z_size)
+                self[name] = Image(self, name, os.path.join(*[self.folder, f]))
+                stat = os.stat(self[name].path)
+                key.update('{}:{}:{};'.format(f, stat.st_mtime, stat.st_size))
+        self.atlas_file = None
+        if cache_dir:
+            self.atlas_file = AtlasFile(os.path.join(cache_dir, self.folder.replace(os.sep, '_') + '.atlas'), key.hexdigest())
+
+    def original(self, name):
+        '''The unscaled surface of the image name.'''
+        path = self[name].path
+        return self.cache.get(path, lambda: pygame.image.load(path).convert())
+
+    def atlas(self, zoom_level):
+        '''The atlas of all images scaled by zoom_level.'''
+        return self.cache.get((self.folder, zoom_level), lambda: self._load_atlas(zoom_level))
+
+    def _load_atlas(self, zoom_level):
+        if self.atlas_file is None or zoom_level not in self.zoom_levels:
+            return Atlas.pack(self._scale(zoom_level))
+        atlas = self.atlas_file.load(zoom_level)
+        if atlas is None:
+            atlases = dict((zl, Atlas.pack(self._scale(zl))) for zl in self.zoom_levels)
+            self.atlas_file.save(atlases)
+            atlas = atlases[zoom_level]
+        return atlas
+
+    def _scale(self, zoom_level):
+        images = {}
+        for name in self:
+            img = self.original(name)
+            z_size = (int(img.get_rect().width * zoom_level), int(img.get_rect().height * zoom_level))
+            images[name] = pygame.transform.scale(img, z_size)
+        return images
 
 
 class Biome(object):
     '''A Biome is colletion of images, that are abstracted to their use'''
 
-    def __init__(self, name, config, zoom_levels):
+    def __init__(self, name, config, zoom_levels, cache = None, cache_dir = None):
         self._name = name
         self._config = config
         self._config['_all'] = []
         for imgs in self._config.itervalues():
             self._config['_all'].extend(imgs)
-        self._sheet = ImageDict(['data', 'sprites', 'biomes', name], zoom_levels = zoom_levels)
+        self._sheet = ImageDict(['data', 'sprites', 'biomes', name], zoom_levels = zoom_levels, cache = cache, cache_dir = cache_dir)
 
     @property
     def unpassable(self):
@@ -50,6 +280,13 @@ class Biome(object):
     def wall(self):
         return self._sheet[self._config['wall'][random.randrange(0, len(self._config['wall']))]]
 
+    def images(self, kind):
+        '''All images configured for kind, e.g. 'wall'.'''
+        return [self._sheet[name] for name in self._config[kind]]
+
+    def image(self, name):
+        return self._sheet[name]
+
     @property
     def rand(self):
         return self._sheet[self._config['_all'][random.randrange(0, len(self._config['_all']))]]
@@ -57,12 +294,16 @@ class Biome(object):
 
 class CreatureSheet(object):
 
-    def __init__(self, name, config, zoom_levels):
+    def __init__(self, name, config, zoom_levels, cache = None, cache_dir = None):
         self._name = name
         self._config = config
-        self._sheet = ImageDict(['data', 'sprites', 'creatures', name], zoom_levels = zoom_levels)
+        self._sheet = ImageDict(['data', 'sprites', 'creatures', name], zoom_levels = zoom_levels, cache = cache, cache_dir = cache_dir)
         super(CreatureSheet, self).__init__()
 
+    @property
+    def name(self):
+        return self._name
+
     @property
     def static(self):
         return self._sheet[self._config['static'][0]]
@@ -0,0 +1,98 @@
+# coding=utf-8
+'''
+Path and range searches in worker processes, so they do not stall the game loop.
+
+The workers share one copy of the state layer of the grid with the game. It is
+written when the environment changed and a new search is requested, searches only
+send their start and end positions to the workers. The workers run the searches of
+dgame.ai on the shared grid, the same the game loop runs on the environment.
+'''
+import ctypes
+import multiprocessing
+from dgame.ai import GridMap, SearchTree, FloodFill
+
+_map = None
+_tree = None
+
+
+def _init_worker(grid, width, height):
+    global _map
+    _map = GridMap(grid, width, height)
+
+
+def find_path(start, end, revision):
+    '''The positions from start to end without start in a worker, None if there is no path.'''
+    global _tree
+    # the tree of the last search answers further targets of the same start and revision
+    if _tree is None or _tree.origin != start or _tree.revision != revision:
+        _tree = SearchTree(_map, start, revision)
+    return _tree.path_to(end)
+
+
+def find_reachable(start, distance):
+    '''The positions reachable from start in distance, without start, in a worker.'''
+    positions = set(FloodFill(_map).find_range_from(start, distance).get_positions())
+    positions.discard(start)
+    return positions
+
+
+class PlanningService(object):
+    '''
+    Runs searches on an environment in a pool of worker processes.
+
+    path and reachable return the result of the last completed search of their kind
+    right away, it may belong to an older request or revision of the environment.
+    A new search is started when the wanted one is not running yet, at most one
+    search per kind runs at a time and only the latest wanted search waits for it.
+
+    '''
+
+    def __init__(self, env, processes = 2):
+        self.env = env
+        self.grid = multiprocessing.RawArray(ctypes.c_byte, env.width * env.height)
+        self.revision = None
+        self.pool = multiprocessing.Pool(processes, _init_worker, (self.grid, env.width, env.height))
+        self.running = {}  # kind -> (key, async result)
+        self.wanted = {}  # kind -> (key, function, args)
+        self.results = {}  # kind -> (key, result)
+
+    def path(self, start, end):
+        '''Positions from start to end without start, None if there is no path.'''
+        return self._get('path', find_path, start, end, self.env.revision)
+
+    def reachable(self, start, distance):
+        '''The set of positions reachable from start in distance, without start.'''
+        result = self._get('reachable', find_reachable, start, distance)
+        return set() if result is None else result
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def _get(self, kind, function, *args):
+        key = args + (self.env.revision,)
+        self.wanted[kind] = (key, function, args)
+        self._poll(kind)
+        result = self.results.get(kind)
+        return None if result is None else result[1]
+
+    def _poll(self, kind):
+        running = self.running.get(kind)
+        if running is not None:
+            if not running[1].ready():
+                return
+            self.results[kind] = (running[0], running[1].get())
+            del self.running[kind]
+        key, function, args = self.wanted[kind]
+        if kind in self.results and self.results[kind][0] == key:
+            return
+        if self.revision != self.env.revision and not self.running:
+            self._sync()
+        if self.revision == self.env.revision:
+            self.running[kind] = (key, self.pool.apply_async(function, args))
+
+    def _sync(self):
+        '''Copy the state layer of the environment to the workers.'''
+        states = self.env.grid.states
+        ctypes.memmove(self.grid, states.buffer_info()[0], len(states) * states.itemsize)
+        self.revision = self.env.revision
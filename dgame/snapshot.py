@@ -0,0 +1,108 @@
+# coding=utf-8
+'''
+Save an environment to a binary file and load it again.
+'''
+import os, sys, json, struct
+import logging
+from array import array
+from dgame.core import Environment, Player, Creature
+
+
+def _restore_move_creature(env, creature, old_pos, new_pos):
+    return env.create_undo_move_creature_command(env.creatures[creature], tuple(old_pos), tuple(new_pos))
+
+
+def _restore_test_flush(env):
+    return env.player.create_test_flush_command()
+
+COMMANDS = {'move_creature': _restore_move_creature,
+            'test_flush': _restore_test_flush}
+'''Create a command of the command queue again from its name and args.'''
+
+
+class Snapshot(object):
+    '''
+    An environment with its creatures and the command queue of the player in one binary file.
+
+    The file starts with a JSON header that describes the image palette, the creatures,
+    the player and the queued commands, followed by the state and image layers of the
+    grid as raw arrays. The layers are read straight into the arrays of the grid, so
+    loading a map takes a fraction of the time generating it again needs.
+
+    Chunked environments can not be saved, their chunks are generated on demand.
+
+    '''
+
+    MAGIC = 'DGSNAP01'
+
+    def __init__(self, path):
+        self.path = path
+
+    def save(self, env):
+        '''Write env, replacing the file at once.'''
+        if env.chunked:
+            raise ValueError('chunked environments can not be saved')
+        creatures = env.creatures
+        commands = []
+        for cmd in env.player.command_queue:
+            if cmd.args is None or cmd.name not in COMMANDS:
+                logging.warning('command {} can not be saved, it is dropped'.format(cmd.name))
+                continue
+            commands.append([cmd.name, cmd.args])
+        header = {'map_size_name': env.map_size_name,
+                  'size': env.size,
+                  'byteorder': sys.byteorder,
+                  'images': [image.name for image in env.images],
+                  'creatures': [[c.sheet.name, c.position, c.hp, c.max_hp, c.moves, c.moves_max] for c in creatures],
+                  'heros': [creatures.index(hero) for hero in env.player.heros],
+                  'active_hero': creatures.index(env.player.active_hero),
+                  'rooms': env.rooms,
+                  'commands': commands}
+        encoded = json.dumps(header)
+        with open(self.path + '.tmp', 'wb') as snapshot_file:
+            snapshot_file.write(self.MAGIC + struct.pack('<I', len(encoded)) + encoded)
+            env.grid.states.tofile(snapshot_file)
+            env.grid.images.tofile(snapshot_file)
+        os.rename(self.path + '.tmp', self.path)
+
+    def load(self, biome, config, creature_sheets):
+        '''Read the environment, creature_sheets are the CreatureSheets by name.'''
+        with open(self.path, 'rb') as snapshot_file:
+            if snapshot_file.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError('{} is not a snapshot'.format(self.path))
+            header_size = struct.unpack('<I', snapshot_file.read(4))[0]
+            header = json.loads(snapshot_file.read(header_size))
+            width, height = header['size']
+            states = array('b')
+            states.fromfile(snapshot_file, width * height)
+            images = array('H')
+            images.fromfile(snapshot_file, width * height)
+        if header['byteorder'] != sys.byteorder:
+            images.byteswap()
+
+        creatures = []
+        for sheet, position, hp, max_hp, moves, moves_max in header['creatures']:
+            creature = Creature({'hp': max_hp, 'moves': moves_max}, creature_sheets[sheet], pos = tuple(position))
+            creature.hp = hp
+            creature.moves = moves
+            creatures.append(creature)
+        player = Player(heros = [creatures[i] for i in header['heros']])
+        player.active_hero = creatures[header['active_hero']]
+
+        env = Environment(biome, config, header['map_size_name'], player)
+        if list(env.size) != [width, height]:
+            raise ValueError('the size of map {} changed'.format(header['map_size_name']))
+        env.images = []
+        env._image_ids = {}
+        for name in header['images']:
+            env.image_id(biome.image(name))
+        env.grid.states = states
+        env.grid.images = images
+        if header['rooms'] is not None:
+            env.set_rooms([tuple(room) for room in header['rooms']])
+        for creature in creatures:
+            env.add_creature(creature)
+        for name, args in header['commands']:
+            player.command_queue.append(COMMANDS[name](env, *args))
+        env.touch()
+        return env
@@ -0,0 +1,107 @@
+# coding=utf-8
+'''
+Timing of named sections of the game, for profiling.
+
+Sections are timed with the section context manager or the timed decorator of the
+module wide stats object. Only the last WINDOW durations of every section are kept,
+percentiles and histograms are computed over this rolling window.
+'''
+from __future__ import division
+import math
+import time
+import collections
+import functools
+from contextlib import contextmanager
+import yaml
+
+
+class Stats(object):
+    '''
+    Collects the durations of named sections in milliseconds.
+
+    Nothing is recorded until enabled is set.
+
+    '''
+
+    WINDOW = 1000
+    BUCKETS = [0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, 30.0, 100.0, 300.0, float('inf')]
+
+    def __init__(self, window = WINDOW):
+        self.enabled = False
+        self.window = window
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen = self.window))
+        self.counts = collections.Counter()
+
+    def record(self, name, duration):
+        '''Add a duration in milliseconds to section name.'''
+        self.samples[name].append(duration)
+        self.counts[name] += 1
+
+    @contextmanager
+    def section(self, name):
+        '''Time the body of a with statement as section name.'''
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, (time.time() - start) * 1000)
+
+    def timed(self, name):
+        '''Decorator that times every call of a function as section name.'''
+        def decorate(function):
+            @functools.wraps(function)
+            def timed_function(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.time()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, (time.time() - start) * 1000)
+            return timed_function
+        return decorate
+
+    def reset(self):
+        self.samples.clear()
+        self.counts.clear()
+
+    def percentile(self, name, p):
+        '''The p-th percentile of the durations of section name, nearest rank.'''
+        samples = sorted(self.samples[name])
+        if not samples:
+            return 0.0
+        rank = int(math.ceil(p / 100 * len(samples))) - 1
+        return samples[min(max(rank, 0), len(samples) - 1)]
+
+    def histogram(self, name):
+        '''Number of durations of section name up to each bucket limit in BUCKETS.'''
+        counts = [0] * len(self.BUCKETS)
+        for duration in self.samples[name]:
+            for i, limit in enumerate(self.BUCKETS):
+                if duration <= limit:
+                    counts[i] += 1
+                    break
+        return counts
+
+    def summary(self):
+        '''Count, mean, percentiles and histogram of every section.'''
+        result = {}
+        for name, samples in self.samples.iteritems():
+            result[name] = {'calls': self.counts[name],
+                            'window': len(samples),
+                            'mean': sum(samples) / len(samples) if samples else 0.0,
+                            'p50': self.percentile(name, 50),
+                            'p95': self.percentile(name, 95),
+                            'p99': self.percentile(name, 99),
+                            'histogram': [[limit, count] for limit, count in zip(self.BUCKETS, self.histogram(name))]}
+        return result
+
+    def export(self, path):
+        '''Write the summary to a YAML file, for comparing runs offline.'''
+        with open(path, 'w') as export_file:
+            yaml.safe_dump(self.summary(), export_file, default_flow_style = False)
+
+stats = Stats()
@@ -0,0 +1,265 @@
+# coding=utf-8
+'''
+Tests of the path finders, they need the data folder like the benchmarks.
+'''
+import random
+import unittest
+from collections import deque
+from dgame import benchmark
+from dgame.core import Tile, Creature
+from dgame.ai import AStar, DistanceField, FloodFill, SearchCache, SearchTree, GridMap
+
+
+def breadth_first(env, origin):
+    '''The steps from origin to every position reachable from it.'''
+    distances = {origin: 0}
+    frontier = deque([origin])
+    while frontier:
+        position = frontier.popleft()
+        for n in env.get_adjacent_positions(position):
+            if n not in distances:
+                distances[n] = distances[position] + 1
+                frontier.append(n)
+    return distances
+
+
+class AStarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+        self.rnd = random.Random('astar')
+        self.origin = self.env.player.active_hero.position
+        self.distances = breadth_first(self.env, self.origin)
+
+    def test_shortest_paths(self):
+        astar = AStar(self.env)
+        for target in self.rnd.sample(sorted(self.distances), 20):
+            if target == self.origin:
+                continue
+            path = astar.find_path(self.env.get_tile(self.origin), self.env.get_tile(target))
+            positions = [node.location.position for node in path.nodes]
+            self.assertEqual(len(positions), self.distances[target])
+            self.assertEqual(positions[-1], target)
+            for a, b in zip([self.origin] + positions, positions):
+                self.assertTrue(b in self.env.get_adjacent_positions(a))
+            # a hero stands on the start tile, its state is part of the cost
+            self.assertEqual(path.get_total_move_cost(), len(positions) - 1)
+            self.assertTrue(astar.expanded > 0)
+
+    def test_no_path(self):
+        astar = AStar(self.env)
+        unreachable = [(x, y) for x in range(self.env.width) for y in range(self.env.height)
+                       if self.env.passable((x, y)) and (x, y) not in self.distances]
+        self.assertTrue(unreachable)
+        self.assertEqual(astar.find_path(self.env.get_tile(self.origin), self.env.get_tile(unreachable[0])), None)
+
+
+class FloodFillTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+        self.hero = self.env.player.active_hero
+        self.distances = breadth_first(self.env, self.hero.position)
+
+    def test_range(self):
+        for distance in [0, 1, 3, self.hero.moves]:
+            found = FloodFill(self.env).find_range(self.hero, distance)
+            expected = dict((p, d) for p, d in self.distances.iteritems() if d <= distance)
+            self.assertEqual(dict((p, found.get_cost(p)) for p in found.get_positions()), expected)
+
+    def test_paths(self):
+        found = FloodFill(self.env).find_range(self.hero, self.hero.moves)
+        for position in found.get_positions():
+            path = found.get_path(position)
+            self.assertEqual(len(path), found.get_cost(position))
+            for a, b in zip([self.hero.position] + path, path):
+                self.assertTrue(b in self.env.get_adjacent_positions(a))
+
+
+class SearchCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = SearchCache(max_size = 3)
+        self.computed = []
+
+    def get(self, key, revision):
+        return self.cache.get(key, revision, lambda: self.computed.append(key) or [key, revision])
+
+    def test_hits_within_a_revision(self):
+        result = self.get('a', 1)
+        self.assertTrue(self.get('a', 1) is result)
+        self.get('b', 1)
+        self.assertEqual(self.computed, ['a', 'b'])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'size': 2})
+
+    def test_new_revision_drops_the_results(self):
+        self.get('a', 1)
+        self.assertEqual(self.get('a', 2), ['a', 2])
+        self.assertEqual(self.computed, ['a', 'a'])
+        self.assertEqual(self.cache.stats()['size'], 1)
+
+    def test_max_size(self):
+        for key in 'abcd':
+            self.get(key, 1)
+        self.assertTrue(self.cache.stats()['size'] <= 3)
+        self.get('d', 1)
+        self.assertEqual(self.computed, list('abcd'))
+
+    def test_paths_of_the_environment(self):
+        env = benchmark.create_environment('small')
+        hero = env.player.active_hero
+        target = max(breadth_first(env, hero.position))
+        path = env.path_finder.find_path(env.get_tile(hero.position), env.get_tile(target))
+        self.assertTrue(env.path_finder.find_path(env.get_tile(hero.position), env.get_tile(target)) is path)
+        # blocking the path changes the revision
+        env.get_tile(path.nodes[0].location.position).state = Tile.STATE_UNPASSABLE
+        changed = env.path_finder.find_path(env.get_tile(hero.position), env.get_tile(target))
+        self.assertTrue(changed is None or path.nodes[0].location.position not in [n.location.position for n in changed.nodes])
+
+
+class SearchTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+        self.origin = self.env.player.active_hero.position
+        self.distances = breadth_first(self.env, self.origin)
+
+    def test_shortest_paths(self):
+        tree = SearchTree(self.env, self.origin)
+        for target in sorted(self.distances, key = self.distances.get, reverse = True)[:10] + sorted(self.distances)[:10]:
+            path = tree.path_to(target)
+            if target == self.origin or not self.env.passable(target):
+                continue
+            self.assertEqual(len(path), self.distances[target])
+            self.assertEqual(path[-1], target)
+            for a, b in zip([self.origin] + path, path):
+                self.assertTrue(b in self.env.get_adjacent_positions(a))
+
+    def test_resumes_the_search(self):
+        tree = SearchTree(self.env, self.origin)
+        near = min((p for p in self.distances if p != self.origin), key = self.distances.get)
+        tree.path_to(near)
+        found = len(tree.parents)
+        self.assertTrue(found < len(self.distances))
+        self.assertEqual(tree.path_to(near), [near])
+        self.assertEqual(len(tree.parents), found)
+
+    def test_no_path(self):
+        tree = SearchTree(self.env, self.origin)
+        self.assertEqual(tree.path_to((-1, 0)), None)
+        unreachable = [(x, y) for x in range(self.env.width) for y in range(self.env.height)
+                       if self.env.passable((x, y)) and (x, y) not in self.distances]
+        self.assertEqual(tree.path_to(unreachable[0]), None)
+        self.assertEqual(len(tree.parents), len(self.distances))
+
+    def test_grid_map(self):
+        grid = GridMap(self.env.grid.states, self.env.width, self.env.height)
+        for position in [(0, 0), (-1, 3), (self.env.width, 3), self.origin] + sorted(self.distances)[:10]:
+            self.assertEqual(grid.passable(position), self.env.passable(position))
+            if self.env.grid.contains(*position):
+                self.assertEqual(grid.get_adjacent_positions(position), self.env.get_adjacent_positions(position))
+
+    def test_search_tree_of_the_environment(self):
+        tree = self.env.search_tree(self.origin)
+        self.assertTrue(self.env.search_tree(self.origin) is tree)
+        self.env.touch(self.origin)
+        self.assertFalse(self.env.search_tree(self.origin) is tree)
+
+
+class HierarchicalAStarTest(unittest.TestCase):
+
+    SEARCHES = 30
+    CHANGES = 20
+
+    def setUp(self):
+        env_config, gen_config = benchmark.xlarge_config()
+        self.env, generator, _ = benchmark.generate(env_config, gen_config, 'large', 'hpa')
+        self.rnd = random.Random('hpa')
+        benchmark.connect_rooms(self.env, generator.rooms, self.rnd)
+        self.positions = benchmark.passable_positions(self.env)
+        hpa = self.env.path_finder
+        self.pairs = []
+        while len(self.pairs) < self.SEARCHES:
+            a, b = self.rnd.choice(self.positions), self.rnd.choice(self.positions)
+            if abs(a[0] - b[0]) + abs(a[1] - b[1]) >= hpa.min_distance:
+                self.pairs.append((a, b))
+
+    def assertSameCosts(self):
+        plain = AStar(self.env)
+        for a, b in self.pairs:
+            found = self.env.path_finder._hierarchical_search(a, b)
+            expected = plain._search(self.env.get_tile(a), self.env.get_tile(b))
+            message = 'path from {} to {}'.format(a, b)
+            self.assertEqual(found is None, expected is None, message)
+            if found:
+                self.assertEqual(len(found.nodes), len(expected.nodes), message)
+                self.assertEqual(found.get_total_move_cost(), expected.get_total_move_cost(), message)
+
+    def test_same_costs_as_astar(self):
+        self.assertSameCosts()
+
+    def test_same_costs_as_astar_from_a_creature(self):
+        # the tile of a creature is not passable, its state is part of the cost
+        hero = self.env.player.active_hero
+        self.pairs = [(hero.position, b) for a, b in self.pairs]
+        self.assertSameCosts()
+
+    def test_same_costs_as_astar_after_changes(self):
+        self.assertSameCosts()
+        for position in self.rnd.sample(self.positions, self.CHANGES):
+            self.env.get_tile(position).state = Tile.STATE_UNPASSABLE
+        self.pairs = [(a, b) for a, b in self.pairs if self.env.passable(b)]
+        self.assertSameCosts()
+
+
+class DistanceFieldTest(unittest.TestCase):
+
+    def setUp(self):
+        cfg = benchmark.setup()
+        env_config, gen_config = benchmark.xlarge_config()
+        self.env, generator, _ = benchmark.generate(env_config, gen_config, 'large', 'field')
+        self.rnd = random.Random('field')
+        benchmark.connect_rooms(self.env, generator.rooms, self.rnd)
+        free = sorted(set(p for room in generator.rooms for p in room['free']) & set(benchmark.passable_positions(self.env)))
+        self.blockers = [Creature(cfg['creatures']['wolf'], benchmark._cache['creatures']['wolf'], env = self.env, pos = position)
+                         for position in self.rnd.sample(free, 40)]
+        self.field = self.env.hero_distances
+        self.field.update()
+
+    def wander(self, creatures):
+        for creature in creatures:
+            moves = self.env.get_adjacent_positions(creature.position)
+            if moves:
+                self.env.create_move_creature_command(creature, self.rnd.choice(moves))
+            creature.end_turn()
+
+    def assertComputed(self):
+        expected = DistanceField(self.env, self.field.sources)
+        expected.update()
+        self.assertEqual(self.field.distances, expected.distances)
+        self.assertEqual(sum(self.field._regions.values()), len(self.field.distances))
+        self.assertTrue(set(self.field._regions) <= self.field._sources)
+
+    def test_hero_moves(self):
+        for _ in range(10):
+            self.wander(self.env.player.heros[:1])
+            self.field.update()
+            self.assertComputed()
+            self.assertTrue(self.field.repaired <= len(self.field.distances))
+
+    def test_all_heros_move(self):
+        for _ in range(5):
+            self.wander(self.env.player.heros)
+            self.field.update()
+            self.assertComputed()
+
+    def test_blocker_moves(self):
+        for _ in range(10):
+            self.wander(self.blockers)
+            self.field.update()
+            self.assertComputed()
+            self.assertTrue(self.field.repaired <= len(self.field.distances))
+
+
+if __name__ == '__main__':
+    unittest.main()
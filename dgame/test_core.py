@@ -0,0 +1,85 @@
+# coding=utf-8
+'''
+Tests of the environment and the launcher, they need the data folder like the benchmarks.
+'''
+import unittest
+from dgame import benchmark
+from dgame.core import Launcher, Tile
+from dgame.turn import TurnScheduler
+
+
+class EnvironmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+
+    def test_get_tile(self):
+        tile = self.env.get_tile((3, 2))
+        self.assertEqual((tile.x, tile.y), (3, 2))
+        tile.state = Tile.STATE_PASSABLE
+        self.assertTrue(self.env.passable((3, 2)))
+
+    def test_get_tile_outside_of_the_map(self):
+        for position in [(-1, 0), (0, -1), (self.env.width, 0), (0, self.env.height)]:
+            self.assertRaises(IndexError, self.env.get_tile, position)
+
+    def test_reachable_positions(self):
+        hero = self.env.player.active_hero
+        reachable = self.env.reachable_positions(hero, hero.moves)
+        self.assertFalse(hero.position in reachable)
+        self.assertTrue(reachable)
+        self.assertTrue(all(0 < len(self.env.search_tree(hero.position).path_to(p)) <= hero.moves for p in reachable))
+        self.assertTrue(reachable is self.env.reachable_positions(hero, hero.moves))
+        self.assertRaises(AttributeError, getattr, reachable, 'add')
+
+    def others(self):
+        return [(c, c.position) for c in self.env.creatures if c not in self.env.player.heros]
+
+    def test_end_turn_keeps_the_other_creatures(self):
+        self.assertEqual(self.env.turn_scheduler, None)
+        others = self.others()
+        self.env.player.end_turn()
+        self.assertEqual(self.others(), others)
+
+    def test_end_turn_with_creatures_chasing_heros(self):
+        self.env.turn_scheduler = TurnScheduler(self.env)
+        others = self.others()
+        self.env.player.end_turn()
+        self.assertNotEqual(self.others(), others)
+
+
+class LauncherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.launcher = Launcher(headless = True)
+        self.frames = []
+
+    def tearDown(self):
+        if self.launcher.planner:
+            self.launcher.planner.close()
+
+    def test_run_frames(self):
+        self.launcher.run(3, self.frames.append)
+        self.assertEqual(self.frames, [0, 1, 2])
+        self.launcher.run(2, self.frames.append)
+        self.assertEqual(self.frames, [0, 1, 2, 0, 1])
+
+    def test_quit_ends_the_loop(self):
+        def script(frame):
+            self.frames.append(frame)
+            if frame == 1:
+                self.launcher.quit()
+        self.launcher.run(10, script)
+        self.assertEqual(self.frames, [0, 1])
+
+    def test_repaint(self):
+        self.launcher.run(1)
+        self.launcher.repaint()
+        self.assertTrue(self.launcher.exposed)
+        self.launcher.run(1)
+        self.assertFalse(self.launcher.exposed)
+        self.assertEqual(self.launcher.camera.dirty_rects, [self.launcher.camera.image.get_rect()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# coding=utf-8
+'''
+Tests of the event dispatcher.
+'''
+import os
+import unittest
+import pygame
+from dgame.event import EventDispatcher, APPACTIVE
+
+
+class Actor(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def scroll(self, times = 1):
+        self.calls.append(('scroll', times))
+        return True
+
+    def undo(self):
+        self.calls.append(('undo', 1))
+        return True
+
+
+class EventDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        pygame.init()
+        pygame.display.set_mode((1, 1))
+        self.actor = Actor()
+        self.repaints = []
+        self.dispatcher = EventDispatcher({'actor': {'scroll': ['K_RIGHT'], 'undo': ['K_BACKSPACE']}},
+                                          {'actor': self.actor}, ['actor_scroll'], lambda: self.repaints.append(1))
+
+    def tearDown(self):
+        pygame.event.set_allowed(None)
+
+    def key_down(self, key):
+        return pygame.event.Event(pygame.KEYDOWN, key = key, mod = 0, unicode = u'')
+
+    def test_allow_events_blocks_types_without_handler(self):
+        self.dispatcher.allow_events()
+        self.assertTrue(pygame.event.get_blocked(pygame.MOUSEMOTION))
+        self.assertTrue(pygame.event.get_blocked(pygame.KEYUP))
+        self.assertFalse(pygame.event.get_blocked(pygame.KEYDOWN))
+        self.assertFalse(pygame.event.get_blocked(pygame.QUIT))
+        self.assertFalse(pygame.event.get_blocked(pygame.VIDEOEXPOSE))
+        self.assertFalse(pygame.event.get_blocked(pygame.ACTIVEEVENT))
+
+    def test_coalesce_repeated_keys(self):
+        motion = pygame.event.Event(pygame.MOUSEMOTION, pos = (0, 0), rel = (0, 0), buttons = (0, 0, 0))
+        events = [self.key_down(pygame.K_RIGHT), motion, self.key_down(pygame.K_RIGHT),
+                  self.key_down(pygame.K_BACKSPACE), self.key_down(pygame.K_BACKSPACE)]
+        self.assertTrue(self.dispatcher.dispatch_all(events))
+        self.assertEqual(self.actor.calls, [('scroll', 2), ('undo', 1), ('undo', 1)])
+
+    def test_quit(self):
+        self.assertFalse(self.dispatcher.dispatch_all([pygame.event.Event(pygame.QUIT), self.key_down(pygame.K_RIGHT)]))
+        self.assertEqual(self.actor.calls, [])
+
+    def test_quit_between_key_presses(self):
+        events = [self.key_down(pygame.K_RIGHT), pygame.event.Event(pygame.QUIT),
+                  self.key_down(pygame.K_RIGHT), self.key_down(pygame.K_BACKSPACE)]
+        self.assertFalse(self.dispatcher.dispatch_all(events))
+        self.assertEqual(self.actor.calls, [('scroll', 1)])
+
+    def test_repaint(self):
+        events = [pygame.event.Event(pygame.VIDEOEXPOSE),
+                  pygame.event.Event(pygame.ACTIVEEVENT, gain = 1, state = 0x02),
+                  pygame.event.Event(pygame.ACTIVEEVENT, gain = 1, state = APPACTIVE)]
+        self.assertTrue(self.dispatcher.dispatch_all(events))
+        self.assertEqual(len(self.repaints), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
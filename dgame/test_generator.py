@@ -0,0 +1,81 @@
+# coding=utf-8
+'''
+Tests of the environment generator, they need the data folder like the benchmarks.
+'''
+import copy
+import logging
+import unittest
+import pygame
+from dgame import benchmark
+from dgame.core import Environment, Player, Creature
+from dgame.generator import EnvironmentGenerator
+
+
+class EnvironmentGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = benchmark.setup()
+        self.env_config = copy.deepcopy(self.cfg['environment'])
+        self.env_config['chunks'] = {'maps': ['medium'], 'size': 64, 'max_loaded': 4, 'path': ''}
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def generate(self, map_size_name, seed):
+        creatures = benchmark._cache['creatures']
+        player = Player(heros = [Creature(self.cfg['creatures']['sheep'], creatures['sheep']) for _ in range(4)])
+        env = Environment(benchmark._cache['biome'], self.env_config, map_size_name, player)
+        # more than one unpassable image, so the walls vary
+        env._unpassable = env._unpassable + [env.image_id(image) for image in env.biome.images('wall')]
+        return EnvironmentGenerator(self.cfg['generator'], self.cfg['creatures'], seed = seed).create(env, creatures)
+
+    def layers(self, env):
+        states, images = env.grid.states, env.grid.images
+        return [states[i] for i in range(len(states))], [images[i] for i in range(len(images))]
+
+    def test_same_seed_same_map(self):
+        a, b = self.generate('small', 7), self.generate('small', 7)
+        self.assertEqual(self.layers(a), self.layers(b))
+        self.assertEqual([c.position for c in a.creatures], [c.position for c in b.creatures])
+        self.assertNotEqual(self.layers(a), self.layers(self.generate('small', 8)))
+
+    def test_chunks_do_not_depend_on_the_order(self):
+        a, b = self.generate('medium', 7), self.generate('medium', 7)
+        self.assertTrue(a.chunked)
+        for cx, cy in [(1, 1), (0, 1), (1, 0)]:
+            a.grid.chunk(cx, cy)
+        for cx, cy in [(1, 0), (0, 1), (1, 1)]:
+            b.grid.chunk(cx, cy)
+        self.assertEqual(self.layers(a), self.layers(b))
+
+
+    def test_rooms_do_not_overlap(self):
+        env = self.generate('small', 7)
+        rects = [pygame.Rect(room) for room in env.rooms]
+        inner = pygame.Rect(1, 1, env.width - 2, env.height - 2)
+        for i, rect in enumerate(rects):
+            self.assertTrue(inner.contains(rect))
+            self.assertEqual(rect.collidelist(rects[i + 1:]), -1)
+
+    def test_occupancy_grid(self):
+        generator = EnvironmentGenerator(self.cfg['generator'], self.cfg['creatures'], seed = 7)
+        generator._open_region(10, 20, 8, 6)
+        # the border of the region is closed
+        self.assertFalse(generator._fits((10, 21), (2, 2)))
+        self.assertFalse(generator._fits((16, 21), (2, 2)))
+        self.assertFalse(generator._fits((15, 24), (2, 2)))
+        self.assertTrue(generator._fits((11, 21), (6, 4)))
+        generator._close_position((13, 22), (2, 1))
+        self.assertFalse(generator._fits((11, 21), (6, 4)))
+        self.assertFalse(generator._fits((14, 21), (1, 2)))
+        self.assertTrue(generator._fits((11, 23), (6, 2)))
+        self.assertTrue(generator._fits((15, 21), (2, 4)))
+        for _ in range(20):
+            x, y = generator._get_free_pos()
+            self.assertTrue(generator._fits((x, y), (1, 1)))
+        generator._close_position((11, 21), (6, 4))
+        self.assertEqual(generator._get_free_pos(), None)
+
+if __name__ == '__main__':
+    unittest.main()
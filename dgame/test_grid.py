@@ -0,0 +1,114 @@
+# coding=utf-8
+'''
+Tests of the map layers.
+'''
+import unittest
+from dgame.grid import Grid, ChunkedGrid, Occupancy
+
+
+class GridTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = Grid((5, 3), -1, 7)
+
+    def test_layers(self):
+        self.assertEqual(len(self.grid.states), 15)
+        self.assertEqual(set(self.grid.states), set([-1]))
+        self.assertEqual(set(self.grid.images), set([7]))
+        self.assertEqual(self.grid.nbytes, 15 * 1 + 15 * 2)
+
+    def test_index(self):
+        self.assertEqual(self.grid.index(0, 0), 0)
+        self.assertEqual(self.grid.index(4, 0), 4)
+        self.assertEqual(self.grid.index(0, 1), 5)
+        self.assertEqual(self.grid.index(4, 2), 14)
+        self.grid.states[self.grid.index(2, 1)] = 1
+        self.assertEqual([i for i, state in enumerate(self.grid.states) if state == 1], [7])
+
+    def test_contains(self):
+        self.assertTrue(self.grid.contains(0, 0))
+        self.assertTrue(self.grid.contains(4, 2))
+        for x, y in [(-1, 0), (0, -1), (5, 0), (0, 3)]:
+            self.assertFalse(self.grid.contains(x, y))
+
+
+class ChunkedGridTest(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+        self.grid = ChunkedGrid((10, 7), -1, 7, chunk_size = 4, max_loaded = 2, create = self.create)
+
+    def create(self, cx, cy, chunk):
+        self.created.append((cx, cy))
+        # mark every chunk by its position
+        chunk.images[0] = cx * 10 + cy
+
+    def test_same_interface_as_grid(self):
+        grid = Grid((10, 7), -1, 7)
+        self.assertEqual(self.grid.index(9, 6), grid.index(9, 6))
+        self.assertEqual(len(self.grid.states), len(grid.states))
+        self.assertTrue(self.grid.contains(9, 6))
+        self.assertFalse(self.grid.contains(10, 6))
+        self.assertEqual(self.grid.states[self.grid.index(5, 5)], -1)
+
+    def test_chunks_are_created_once_on_access(self):
+        self.assertEqual(self.created, [])
+        self.assertEqual(self.grid.images[self.grid.index(8, 4)], 21)
+        self.grid.states[self.grid.index(9, 5)] = 1
+        self.assertEqual(self.created, [(2, 1)])
+        self.grid.prefetch(0, 0, 4, 4)
+        self.assertEqual(sorted(self.created), [(0, 0), (0, 1), (1, 0), (1, 1), (2, 1)])
+
+    def test_evicted_chunks_are_loaded_with_their_changes(self):
+        positions = [(x, y) for y in range(7) for x in range(10)]
+        for x, y in positions:
+            self.grid.states[self.grid.index(x, y)] = (x + y) % 2
+        self.assertTrue(len(self.grid.chunks) <= 2)
+        self.assertEqual(self.grid.created, 6)
+        self.assertTrue(self.grid.evicted >= 4)
+        for x, y in positions:
+            self.assertEqual(self.grid.states[self.grid.index(x, y)], (x + y) % 2)
+        self.assertEqual(self.grid.images[self.grid.index(8, 4)], 21)
+        self.assertEqual(self.grid.created, 6)
+        self.assertTrue(self.grid.loaded > 0)
+
+    def test_index_outside_of_the_grid(self):
+        self.assertRaises(IndexError, self.grid.states.__getitem__, 70)
+        self.assertRaises(IndexError, self.grid.states.__getitem__, -1)
+        self.assertRaises(IndexError, self.grid.images.__setitem__, 70, 0)
+        self.assertEqual(len(list(self.grid.states)), 70)
+
+
+class OccupancyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.occupancy = Occupancy(bucket_size = 4)
+        self.creatures = {(1, 1): 'a', (3, 3): 'b', (4, 3): 'c', (9, 9): 'd'}
+        for position, creature in self.creatures.iteritems():
+            self.occupancy.add(creature, position)
+
+    def brute_force(self, x_min, y_min, x_max, y_max):
+        return sorted(c for (x, y), c in self.creatures.iteritems() if x_min <= x < x_max and y_min <= y < y_max)
+
+    def test_at(self):
+        self.assertEqual(len(self.occupancy), 4)
+        self.assertEqual(self.occupancy.at((3, 3)), 'b')
+        self.assertEqual(self.occupancy.at((3, 4)), None)
+
+    def test_move_and_remove(self):
+        self.occupancy.move((3, 3), (8, 1))
+        self.assertEqual(self.occupancy.at((3, 3)), None)
+        self.assertEqual(self.occupancy.at((8, 1)), 'b')
+        self.assertEqual(self.occupancy.remove((1, 1)), 'a')
+        self.assertEqual(len(self.occupancy), 3)
+        # empty buckets are dropped
+        self.assertFalse((0, 0) in self.occupancy.buckets)
+        self.assertEqual(sorted(self.occupancy.within(0, 0, 12, 12)), ['b', 'c', 'd'])
+
+    def test_within(self):
+        for area in [(0, 0, 12, 12), (0, 0, 4, 4), (3, 3, 5, 4), (1, 1, 2, 2), (2, 2, 9, 9), (4, 0, 8, 4), (10, 10, 20, 20)]:
+            self.assertEqual(sorted(self.occupancy.within(*area)), self.brute_force(*area), area)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# coding=utf-8
+'''
+Tests of the image cache and atlases, they need the data folder like the benchmarks.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import pygame
+from dgame import benchmark
+from dgame.image import Atlas, AtlasFile, ImageCache, ImageDict
+
+
+class ImageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        benchmark.setup()
+        self.cache = ImageCache(3 * 10 * 10 * 4)
+        self.loaded = []
+
+    def load(self, key):
+        def load():
+            self.loaded.append(key)
+            return pygame.Surface((10, 10), 0, 32)
+        return self.cache.get(key, load)
+
+    def test_loads_once(self):
+        surface = self.load('a')
+        self.assertTrue(self.load('a') is surface)
+        self.assertEqual(self.loaded, ['a'])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'entries': 1, 'bytes': 400})
+
+    def test_drops_the_least_recently_used_entries(self):
+        for key in ['a', 'b', 'c', 'a', 'd']:
+            self.load(key)
+        self.assertEqual(list(self.cache.entries), ['c', 'a', 'd'])
+        self.assertEqual(self.cache.used, self.cache.size)
+        self.load('b')
+        self.assertEqual(self.loaded, ['a', 'b', 'c', 'd', 'b'])
+
+    def test_keeps_an_entry_bigger_than_the_cache(self):
+        self.load('a')
+        big = self.cache.get('big', lambda: pygame.Surface((100, 100), 0, 32))
+        self.assertEqual(list(self.cache.entries), ['big'])
+        self.assertTrue(self.cache.get('big', None) is big)
+
+
+class ImageDictTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = benchmark.setup()
+        self.cache = ImageCache()
+        self.zoom_levels = self.cfg['ui']['camera']['zoom_levels']
+        self.sheet = ImageDict(['data', 'sprites', 'biomes', 'default'], zoom_levels = self.zoom_levels, cache = self.cache)
+
+    def test_loads_nothing_until_used(self):
+        self.assertTrue(self.sheet)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_scales_by_zoom_level(self):
+        name = sorted(self.sheet)[0]
+        original = self.sheet.original(name)
+        for zoom_level in self.zoom_levels:
+            self.assertEqual(self.sheet[name][zoom_level].get_size(),
+                             (int(original.get_width() * zoom_level), int(original.get_height() * zoom_level)))
+        self.assertTrue(self.sheet[name][self.zoom_levels[0]] is self.sheet[name][self.zoom_levels[0]])
+
+
+class AtlasTest(unittest.TestCase):
+
+    def setUp(self):
+        benchmark.setup()
+        self.images = {}
+        for i, size in enumerate([(10, 10), (30, 5), (7, 20), (10, 10), (1, 1)]):
+            image = pygame.Surface(size).convert()
+            image.fill((i * 40 + 10, 0, 255 - i * 40))
+            image.set_colorkey((255, 0, 255))
+            self.images['image{}'.format(i)] = image
+
+    def assertPacked(self, atlas):
+        self.assertEqual(sorted(atlas.index), sorted(self.images))
+        bounds = atlas.surface.get_rect()
+        rects = [pygame.Rect(area) for area in atlas.index.values()]
+        for i, rect in enumerate(rects):
+            self.assertTrue(bounds.contains(rect))
+            self.assertEqual(rect.collidelist(rects[i + 1:]), -1)
+        for name, image in self.images.iteritems():
+            self.assertEqual(pygame.image.tostring(atlas[name], 'RGB'), pygame.image.tostring(image, 'RGB'))
+        self.assertEqual(atlas.surface.get_colorkey(), (255, 0, 255, 255))
+
+    def test_pack(self):
+        self.assertPacked(Atlas.pack(self.images))
+
+    def test_save_and_load(self):
+        path = tempfile.mkdtemp(prefix = 'dgame-test-')
+        try:
+            Atlas.pack(self.images).save(os.path.join(path, 'atlas'))
+            self.assertPacked(Atlas.load(os.path.join(path, 'atlas')))
+        finally:
+            shutil.rmtree(path)
+
+    def test_image_area(self):
+        sheet = ImageDict(['data', 'sprites', 'biomes', 'default'], zoom_levels = [1.0], cache = ImageCache())
+        image = sheet[sorted(sheet)[0]]
+        surface, area = image.area(1.0)
+        self.assertTrue(surface is sheet.atlas(1.0).surface)
+        self.assertEqual(pygame.image.tostring(surface.subsurface(area), 'RGB'), pygame.image.tostring(image[1.0], 'RGB'))
+
+
+class AtlasFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = benchmark.setup()
+        self.path = tempfile.mkdtemp(prefix = 'dgame-test-')
+        self.zoom_levels = self.cfg['ui']['camera']['zoom_levels']
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def sheet(self):
+        return ImageDict(['data', 'sprites', 'biomes', 'default'], zoom_levels = self.zoom_levels,
+                         cache = ImageCache(), cache_dir = self.path)
+
+    def assertSameAtlas(self, a, b):
+        self.assertEqual(a.index, b.index)
+        self.assertEqual(a.surface.get_colorkey(), b.surface.get_colorkey())
+        self.assertEqual(pygame.image.tostring(a.surface, 'RGB'), pygame.image.tostring(b.surface, 'RGB'))
+
+    def test_missing_file(self):
+        self.assertEqual(AtlasFile(os.path.join(self.path, 'missing.atlas'), 'key').load(1.0), None)
+
+    def test_save_and_load(self):
+        atlases = dict((zoom_level, self.sheet()._load_atlas(zoom_level)) for zoom_level in self.zoom_levels)
+        atlas_file = AtlasFile(os.path.join(self.path, 'test.atlas'), 'key')
+        atlas_file.save(atlases)
+        for zoom_level, atlas in atlases.iteritems():
+            self.assertSameAtlas(atlas_file.load(zoom_level), atlas)
+        self.assertEqual(atlas_file.load(0.25), None)
+        self.assertEqual(AtlasFile(atlas_file.path, 'other key').load(self.zoom_levels[0]), None)
+
+    def test_sheet_writes_and_reads_the_file(self):
+        zoom_level = self.zoom_levels[0]
+        atlas = self.sheet().atlas(zoom_level)
+        self.assertTrue(os.path.exists(self.sheet().atlas_file.path))
+        sheet = self.sheet()
+        # read from the file, nothing is scaled again
+        sheet._scale = None
+        self.assertSameAtlas(sheet.atlas(zoom_level), atlas)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# coding=utf-8
+'''
+Tests of the planning service, they need the data folder like the benchmarks.
+'''
+import time
+import unittest
+from dgame import benchmark
+from dgame.planner import PlanningService
+
+
+class PlanningServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+        self.hero = self.env.player.active_hero
+        self.service = PlanningService(self.env, 1)
+
+    def tearDown(self):
+        self.service.close()
+
+    def wait(self, kind, *args):
+        search = getattr(self.service, kind)
+        for _ in range(500):
+            result = search(*args)
+            if self.service.results.get(kind, ((),))[0][:len(args)] == args:
+                return result
+            time.sleep(0.01)
+        self.fail('no result for {}{}'.format(kind, args))
+
+    def test_same_results_as_the_game_loop(self):
+        reachable = self.wait('reachable', self.hero.position, self.hero.moves)
+        self.assertEqual(reachable, set(self.env.reachable_positions(self.hero, self.hero.moves)))
+        for end in sorted(reachable)[:5]:
+            self.assertEqual(self.wait('path', self.hero.position, end),
+                             self.env.search_tree(self.hero.position).path_to(end))
+
+    def test_positions_outside_of_the_map(self):
+        reachable = self.wait('reachable', self.hero.position, self.hero.moves)
+        x, y = max(reachable, key = lambda position: position[1])
+        # the index of this position is the one of the reachable position x, y
+        self.assertEqual(self.wait('path', self.hero.position, (self.env.width + x, y - 1)), None)
+        self.assertEqual(self.wait('path', self.hero.position, (-1, y)), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# coding=utf-8
+'''
+Tests of the snapshot format, they need the data folder like the benchmarks.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from dgame import benchmark
+from dgame.snapshot import Snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = benchmark.setup()
+        self.path = tempfile.mkdtemp(prefix = 'dgame-test-')
+        self.snapshot = Snapshot(os.path.join(self.path, 'test.snap'))
+        self.env = benchmark.create_environment('medium')
+        player = self.env.player
+        player.move_active_hero_right()
+        player.move_active_hero_down()
+        player.test_flush_command()
+        player.next_hero()
+        player.move_active_hero_up()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def load(self):
+        self.snapshot.save(self.env)
+        return self.snapshot.load(benchmark._cache['biome'], self.cfg['environment'], benchmark._cache['creatures'])
+
+    def creatures(self, env):
+        return [(c.sheet.name, c.position, c.hp, c.moves) for c in env.creatures]
+
+    def test_round_trip(self):
+        env = self.load()
+        self.assertEqual(env.grid.states, self.env.grid.states)
+        self.assertTrue(all(env.get_image((x, y)) is self.env.get_image((x, y))
+                            for x in range(env.width) for y in range(env.height)))
+        self.assertEqual(self.creatures(env), self.creatures(self.env))
+        self.assertEqual(env.creatures.index(env.player.active_hero), self.env.creatures.index(self.env.player.active_hero))
+        self.assertEqual([env.creatures.index(hero) for hero in env.player.heros],
+                         [self.env.creatures.index(hero) for hero in self.env.player.heros])
+        self.assertEqual(env.rooms, self.env.rooms)
+        self.assertEqual(sorted(env.occupancy.positions), sorted(self.env.occupancy.positions))
+        self.assertEqual(os.listdir(self.path), ['test.snap'])
+
+    def test_undo_after_loading(self):
+        env = self.load()
+        self.assertEqual([c.name for c in env.player.command_queue], ['move_creature', 'move_creature', 'test_flush', 'move_creature'])
+        for e in env, self.env:
+            while len(e.player.command_queue):
+                e.player.undo()
+        self.assertEqual(self.creatures(env), self.creatures(self.env))
+        self.assertEqual(env.grid.states, self.env.grid.states)
+
+    def test_not_a_snapshot(self):
+        with open(self.snapshot.path, 'wb') as snapshot_file:
+            snapshot_file.write('something else')
+        self.assertRaises(ValueError, self.snapshot.load, benchmark._cache['biome'], self.cfg['environment'],
+                          benchmark._cache['creatures'])
+
+
+if __name__ == '__main__':
+    unittest.main()
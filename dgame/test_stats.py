@@ -0,0 +1,75 @@
+# coding=utf-8
+'''
+Tests of the section timing.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+from dgame.stats import Stats
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = Stats(window = 100)
+
+    def test_disabled_records_nothing(self):
+        with self.stats.section('section'):
+            pass
+        self.assertEqual(self.stats.timed('timed')(lambda x: x + 1)(1), 2)
+        self.assertEqual(dict(self.stats.samples), {})
+
+    def test_section_and_timed(self):
+        self.stats.enabled = True
+        with self.stats.section('section'):
+            pass
+        square = self.stats.timed('timed')(lambda x: x * x)
+        self.assertEqual(square(3), 9)
+        self.assertRaises(ZeroDivisionError, self.stats.timed('timed')(lambda: 1 / 0))
+        self.assertEqual(self.stats.counts, {'section': 1, 'timed': 2})
+
+    def test_window(self):
+        for i in range(250):
+            self.stats.record('section', float(i))
+        self.assertEqual(len(self.stats.samples['section']), 100)
+        self.assertEqual(self.stats.counts['section'], 250)
+        self.assertEqual(min(self.stats.samples['section']), 150.0)
+
+    def test_percentile(self):
+        self.assertEqual(self.stats.percentile('section', 50), 0.0)
+        for i in range(1, 101):
+            self.stats.record('section', float(i))
+        self.assertEqual(self.stats.percentile('section', 50), 50.0)
+        self.assertEqual(self.stats.percentile('section', 95), 95.0)
+        self.assertEqual(self.stats.percentile('section', 99), 99.0)
+        self.assertEqual(self.stats.percentile('section', 100), 100.0)
+
+    def test_histogram(self):
+        for duration in [0.005, 0.01, 0.5, 2.0, 2.0, 1000.0]:
+            self.stats.record('section', duration)
+        histogram = self.stats.histogram('section')
+        self.assertEqual(sum(histogram), 6)
+        self.assertEqual(histogram[0], 2)
+        self.assertEqual(histogram[Stats.BUCKETS.index(1.0)], 1)
+        self.assertEqual(histogram[Stats.BUCKETS.index(3.0)], 2)
+        self.assertEqual(histogram[-1], 1)
+
+    def test_export(self):
+        for i in range(10):
+            self.stats.record('section', float(i))
+        path = tempfile.mkdtemp(prefix = 'dgame-test-')
+        try:
+            self.stats.export(os.path.join(path, 'stats.yaml'))
+            with open(os.path.join(path, 'stats.yaml')) as export_file:
+                summary = yaml.safe_load(export_file)
+        finally:
+            shutil.rmtree(path)
+        self.assertEqual(summary['section']['calls'], 10)
+        self.assertEqual(summary['section']['mean'], 4.5)
+        self.assertEqual(summary['section']['histogram'][-1], [float('inf'), 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
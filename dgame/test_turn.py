@@ -0,0 +1,96 @@
+# coding=utf-8
+'''
+Tests of the turns of the creatures that are not heros.
+'''
+import unittest
+from dgame import benchmark, core
+from dgame.turn import TurnScheduler
+
+
+class Creature(object):
+
+    def __init__(self, name, position):
+        self.name = name
+        self.position = position
+
+    def __repr__(self):
+        return self.name
+
+
+class Map(object):
+    '''Free positions are passable, the positions of the creatures are not.'''
+
+    def __init__(self, free):
+        self.free = set(free)
+
+    def passable(self, position):
+        return position in self.free
+
+
+class ResolveTest(unittest.TestCase):
+
+    def resolve(self, free, steps):
+        return sorted(c.name for c, _ in TurnScheduler(Map(free), lambda c: None).resolve(steps))
+
+    def test_free_target(self):
+        a = Creature('a', (0, 0))
+        self.assertEqual(self.resolve([(1, 0)], {a: (1, 0)}), ['a'])
+
+    def test_chain(self):
+        a, b, c = Creature('a', (0, 0)), Creature('b', (1, 0)), Creature('c', (2, 0))
+        self.assertEqual(self.resolve([(3, 0)], {a: (1, 0), b: (2, 0), c: (3, 0)}), ['a', 'b', 'c'])
+        # the order of the steps does not matter
+        self.assertEqual(self.resolve([(3, 0)], {c: (3, 0), a: (1, 0), b: (2, 0)}), ['a', 'b', 'c'])
+
+    def test_blocked_chain(self):
+        a, b, c = Creature('a', (0, 0)), Creature('b', (1, 0)), Creature('c', (2, 0))
+        self.assertEqual(self.resolve([], {a: (1, 0), b: (2, 0), c: (3, 0)}), [])
+        # c stays, so b and a can not follow
+        self.assertEqual(self.resolve([(5, 5)], {a: (1, 0), b: (2, 0), c: (3, 0), Creature('d', (4, 0)): (5, 5)}), ['d'])
+
+    def test_circle(self):
+        a, b, c = Creature('a', (0, 0)), Creature('b', (1, 0)), Creature('c', (1, 1))
+        self.assertEqual(self.resolve([], {a: (1, 0), b: (0, 0)}), [])
+        self.assertEqual(self.resolve([], {a: (1, 0), b: (1, 1), c: (0, 0)}), [])
+
+    def test_chain_into_a_circle(self):
+        a, b, c = Creature('a', (0, 0)), Creature('b', (1, 0)), Creature('c', (2, 0))
+        self.assertEqual(self.resolve([], {c: (1, 0), a: (1, 0), b: (2, 0)}), [])
+
+
+class TurnSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = benchmark.setup()
+        self.env = benchmark.create_environment('small')
+        self.others = [c for c in self.env.creatures if c not in self.env.player.heros]
+
+    def test_same_target(self):
+        env = self.env
+        target = next(p for p in sorted(benchmark.passable_positions(env)) if len(env.get_adjacent_positions(p)) >= 2)
+        wolf = self.cfg['creatures']['wolf'], benchmark._cache['creatures']['wolf']
+        a, b = [core.Creature(*wolf, env = env, pos = p) for p in env.get_adjacent_positions(target)[:2]]
+        start = a.position, b.position
+        scheduler = TurnScheduler(env, lambda c: target if c in (a, b) and c.position != target else None)
+        scheduler.run()
+        # a comes first in the creatures of the environment
+        self.assertEqual((a.position, b.position), (target, start[1]))
+        self.assertEqual(env.occupancy.at(target), a)
+        self.assertFalse(env.passable(target))
+        self.assertTrue(env.passable(start[0]))
+        self.assertEqual(scheduler.moved, 1)
+        # b tries again in every round
+        self.assertEqual(scheduler.blocked, b.moves_max)
+
+    def test_moves_and_new_turn(self):
+        scheduler = TurnScheduler(self.env, lambda c: (self.env.get_adjacent_positions(c.position) or [None])[0])
+        scheduler.run()
+        self.assertTrue(scheduler.moved > 0)
+        self.assertTrue(scheduler.moved <= sum(c.moves_max for c in self.others))
+        for c in self.others:
+            self.assertEqual(c.moves, c.moves_max)
+            self.assertEqual(self.env.occupancy.at(c.position), c)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+# coding=utf-8
+'''
+Tests of the map camera, they need the data folder like the benchmarks.
+'''
+import unittest
+import pygame
+from dgame import benchmark
+from dgame.ui import Frame, Map, FloorCache, Viewport
+
+
+class MapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+        # twice the size of the map, the map does not fill the camera
+        width, height = self.env.tile_size
+        self.camera = Map(pygame.Rect((0, 0), (self.env.width * width * 2, self.env.height * height * 2)), self.env)
+        self.get_pos = pygame.mouse.get_pos
+
+    def tearDown(self):
+        pygame.mouse.get_pos = self.get_pos
+
+    def hover(self, x, y):
+        viewport = self.camera.viewport
+        pygame.mouse.get_pos = lambda: (int((x - viewport.x) * viewport.tile_width), int((y - viewport.y) * viewport.tile_height))
+        return self.camera.hover_tile
+
+    def test_hover_tile(self):
+        self.assertEqual(self.hover(2, 3).position, (2, 3))
+
+    def test_hover_tile_outside_of_the_map(self):
+        self.assertEqual(self.hover(self.env.width, 3), False)
+        self.assertEqual(self.hover(3, self.env.height), False)
+        self.camera.update()
+        self.assertEqual(self.camera._layers['path'].items, [])
+
+    def test_invalidate(self):
+        self.camera.update()
+        self.camera.update()
+        self.assertEqual(self.camera.dirty_rects, [])
+        self.camera.invalidate()
+        self.camera.update()
+        self.assertEqual(self.camera.dirty_rects, [self.camera.image.get_rect()])
+
+
+class IncrementalMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+        rect = pygame.Rect((0, 0), (320, 240))
+        self.camera = Map(rect, self.env, zoom_levels = [1.0, 1.5], zoom_level = 1.0)
+        self.full = Map(rect, self.env, zoom_levels = [1.0, 1.5], zoom_level = 1.0, incremental = False)
+        # both cameras show the same part of the map
+        self.full.viewport = self.camera.viewport
+        x, y = self.env.player.active_hero.position
+        self.camera.viewport._x, self.camera.viewport._y = x - 5, y - 4
+        self.get_pos = pygame.mouse.get_pos
+        pygame.mouse.get_pos = lambda: (0, 0)
+
+    def tearDown(self):
+        pygame.mouse.get_pos = self.get_pos
+
+    def assertSameImage(self):
+        self.camera.update()
+        self.full.update()
+        self.assertEqual(pygame.image.tostring(self.camera.image, 'RGB'), pygame.image.tostring(self.full.image, 'RGB'))
+
+    def test_unchanged_map_has_no_dirty_rects(self):
+        self.camera.update()
+        self.assertEqual(self.camera.dirty_rects, [self.camera.image.get_rect()])
+        self.camera.update()
+        self.assertEqual(self.camera.dirty_rects, [])
+
+    def test_repaints_like_a_full_render(self):
+        self.assertSameImage()
+        player = self.env.player
+        for action in ['move_active_hero_up', 'move_active_hero_left', 'next_hero', 'move_active_hero_down', 'undo', 'end_turn']:
+            getattr(player, action)()
+            self.assertSameImage()
+            self.assertTrue(len(self.camera.dirty_rects) <= Map.MAX_DIRTY_RECTS)
+        pygame.mouse.get_pos = lambda: (170, 130)
+        self.assertSameImage()
+        pygame.mouse.get_pos = lambda: (202, 130)
+        self.assertSameImage()
+
+    def test_scroll_and_zoom_repaint_everything(self):
+        self.camera.update()
+        self.camera.scroll_left()
+        self.assertSameImage()
+        self.assertEqual(self.camera.dirty_rects, [self.camera.image.get_rect()])
+        self.camera.zoom_in()
+        self.assertSameImage()
+        self.assertEqual(self.camera.dirty_rects, [self.camera.image.get_rect()])
+
+    def test_draw_blits_the_dirty_rects(self):
+        surface = pygame.Surface((400, 300)).convert()
+        self.camera.rect = pygame.Rect((10, 20), self.camera.rect.size)
+        self.camera.update()
+        self.assertEqual(self.camera.draw(surface), [pygame.Rect((10, 20), (320, 240))])
+        self.camera.update()
+        self.assertEqual(self.camera.draw(surface), [])
+
+
+class FloorCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+        self.cache = FloorCache(self.env)
+
+    def test_chunk_shows_the_tiles(self):
+        size = FloorCache.CHUNK_SIZE
+        chunk = self.cache.get(1, 0, 1.5)
+        for x, y in [(size, 0), (size + 3, 5), (2 * size - 1, size - 1)]:
+            image = self.env.get_image((x, y))[1.5]
+            width, height = image.get_size()
+            tile = chunk.subsurface(((x - size) * width, y * height, width, height))
+            self.assertEqual(pygame.image.tostring(tile, 'RGB'), pygame.image.tostring(image, 'RGB'))
+
+    def test_chunks_end_with_the_map(self):
+        size = FloorCache.CHUNK_SIZE
+        cx, cy = (self.env.width - 1) // size, (self.env.height - 1) // size
+        width, height = self.env.tile_size
+        self.assertEqual(self.cache.get(cx, cy, 1.0).get_size(),
+                         ((self.env.width - cx * size) * width, (self.env.height - cy * size) * height))
+
+    def test_chunks_are_cached_per_zoom_level(self):
+        chunk = self.cache.get(0, 0, 1.0)
+        self.assertTrue(self.cache.get(0, 0, 1.0) is chunk)
+        self.assertFalse(self.cache.get(0, 0, 1.5) is chunk)
+        self.assertEqual(len(self.cache.chunks), 2)
+        self.cache.clear()
+        self.assertEqual((len(self.cache.chunks), self.cache.used), (0, 0))
+
+    def test_drops_the_least_recently_used_chunks(self):
+        chunk = self.cache.get(0, 0, 1.0)
+        self.cache.size = 2 * self.cache.used
+        self.cache.get(1, 0, 1.0)
+        self.cache.get(0, 0, 1.0)
+        self.cache.get(0, 1, 1.0)
+        self.assertEqual(list(self.cache.chunks), [(0, 0, 1.0), (0, 1, 1.0)])
+        self.assertTrue(self.cache.used <= self.cache.size)
+        self.assertTrue(self.cache.get(0, 0, 1.0) is chunk)
+
+
+class ViewportTest(unittest.TestCase):
+
+    def setUp(self):
+        # 10 x 7.5 tiles of a 100 x 50 map
+        self.viewport = Viewport([2.0, 3.0], (320, 240), (32, 32), (100, 50), 1.0, [0.5, 1.0, 2.0])
+
+    def center(self):
+        f = self.viewport.frame
+        return f.x + f.width / 2, f.y + f.height / 2
+
+    def test_frame(self):
+        self.assertEqual(self.viewport.frame, Frame(2.0, 3.0, 10.0, 7.5, 32.0, 32.0, 2, 3, 12, 11))
+        self.assertEqual((self.viewport.x, self.viewport.y, self.viewport.width, self.viewport.height), (2.0, 3.0, 10.0, 7.5))
+        self.assertEqual((self.viewport.x_min, self.viewport.y_min, self.viewport.x_max, self.viewport.y_max), (2, 3, 12, 11))
+
+    def test_frame_is_computed_once_per_change(self):
+        frame = self.viewport.frame
+        self.assertTrue(self.viewport.frame is frame)
+        self.viewport.scroll(Viewport.SCROLL_RIGHT)
+        self.assertFalse(self.viewport.frame is frame)
+        self.assertEqual(self.viewport.x, 2.5)
+        frame = self.viewport.frame
+        self.viewport.zoom(Viewport.ZOOM_IN)
+        self.assertFalse(self.viewport.frame is frame)
+        self.assertEqual(self.viewport.tile_width, 64.0)
+
+    def test_zoom_keeps_the_center(self):
+        self.viewport._x, self.viewport._y = 20.0, 20.0
+        center = self.center()
+        self.viewport.zoom(Viewport.ZOOM_IN)
+        self.assertEqual(self.viewport.width, 5.0)
+        self.assertEqual(self.center(), center)
+        self.viewport.zoom(Viewport.ZOOM_IN)
+        self.assertEqual(self.viewport.zoom_level, 2.0)
+        self.viewport.zoom(Viewport.ZOOM_OUT)
+        self.viewport.zoom(Viewport.ZOOM_OUT)
+        self.assertEqual(self.center(), center)
+
+    def test_frame_stays_on_the_map(self):
+        self.viewport._x, self.viewport._y = 95.0, 45.0
+        self.assertEqual((self.viewport.x, self.viewport.y), (90.0, 42.5))
+        self.viewport.zoom(Viewport.ZOOM_OUT)
+        self.assertEqual((self.viewport.x, self.viewport.y, self.viewport.x_max, self.viewport.y_max), (80.0, 35.0, 100, 50))
+        self.viewport._x, self.viewport._y = 0.0, 0.0
+        self.assertEqual((self.viewport.x, self.viewport.y), (0.0, 0.0))
+
+    def test_scroll_stops_at_the_edges(self):
+        self.viewport.scroll(Viewport.SCROLL_LEFT, 10)
+        self.viewport.scroll(Viewport.SCROLL_UP, 10)
+        self.assertEqual((self.viewport.x, self.viewport.y), (0.0, 0.0))
+        self.viewport.scroll(Viewport.SCROLL_RIGHT, 1000)
+        self.viewport.scroll(Viewport.SCROLL_DOWN, 1000)
+        self.assertEqual((self.viewport.x, self.viewport.y), (90.0, 42.5))
+
+    def test_rects(self):
+        self.viewport.scroll(Viewport.SCROLL_RIGHT)
+        positions = [(2, 3), (5, 7), (12, 11)]
+        self.assertEqual(self.viewport.rect(5, 7), (80, 128, 32, 32))
+        self.assertEqual(self.viewport.rects(positions), [self.viewport.rect(x, y) for x, y in positions])
+        self.assertEqual(self.viewport.get_rect(5, 7), pygame.Rect(80, 128, 32, 32))
+
+class OverlayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = benchmark.create_environment('small')
+        self.camera = Map(pygame.Rect((0, 0), (320, 240)), self.env)
+        hero = self.env.player.active_hero
+        x, y = hero.position
+        self.camera.viewport._x, self.camera.viewport._y = x - 5, y - 4
+        self.get_pos = pygame.mouse.get_pos
+        self.reachable = sorted(hero.reachable_positions)
+        self.hover(*self.reachable[0])
+
+    def tearDown(self):
+        pygame.mouse.get_pos = self.get_pos
+
+    def hover(self, x, y):
+        viewport = self.camera.viewport
+        pygame.mouse.get_pos = lambda: (int((x - viewport.x + 0.5) * viewport.tile_width), int((y - viewport.y + 0.5) * viewport.tile_height))
+
+    def layers(self):
+        return dict(self.camera._layers)
+
+    def test_unchanged_layers_are_kept(self):
+        self.camera.update()
+        overlay = self.camera._overlay
+        layers = self.layers()
+        self.assertTrue(self.camera.update_overlay() is overlay)
+        self.assertEqual(self.layers(), layers)
+        self.assertTrue(all(self.camera._layers[name] is layers[name] for name in Map.OVERLAY_LAYERS))
+
+    def test_hover_renders_the_path_only(self):
+        self.camera.update_overlay()
+        layers = self.layers()
+        self.hover(*self.reachable[-1])
+        self.camera.update_overlay()
+        self.assertTrue(self.camera._layers['selection'] is layers['selection'])
+        self.assertTrue(self.camera._layers['range'] is layers['range'])
+        self.assertFalse(self.camera._layers['path'] is layers['path'])
+
+    def test_moving_the_hero_renders_all_layers(self):
+        self.camera.update_overlay()
+        layers = self.layers()
+        self.env.player.move_active_hero_up()
+        self.camera.update_overlay()
+        self.assertFalse(any(self.camera._layers[name] is layers[name] for name in Map.OVERLAY_LAYERS))
+
+    def test_layer_bounds(self):
+        overlay = self.camera.update_overlay()
+        self.assertTrue(overlay)
+        for name in Map.OVERLAY_LAYERS:
+            layer = self.camera._layers[name]
+            self.assertTrue(layer.items)
+            self.assertEqual(layer.surface.get_size(), layer.bounds.size)
+            for item in layer.items:
+                self.assertTrue(layer.bounds.contains(pygame.Rect(self.camera._overlay_rect(item))))
+        self.assertEqual(overlay, [item for name in Map.OVERLAY_LAYERS for item in self.camera._layers[name].items])
+
+    def test_empty_layer(self):
+        pygame.mouse.get_pos = lambda: (1000, 1000)
+        self.camera.update_overlay()
+        self.assertEqual((self.camera._layers['path'].items, self.camera._layers['path'].bounds), ([], None))
+        self.camera.update()
+
+if __name__ == '__main__':
+    unittest.main()
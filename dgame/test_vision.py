@@ -0,0 +1,76 @@
+# coding=utf-8
+'''
+Tests of the field of view.
+'''
+import unittest
+from dgame.grid import Grid, Occupancy
+from dgame.vision import FieldOfView
+
+
+class Map(object):
+    '''An open map of width x height tiles with walls at the given positions.'''
+
+    def __init__(self, width, height, walls = ()):
+        self.width, self.height = width, height
+        self.grid = Grid((width, height), 1)
+        self.occupancy = Occupancy()
+        for x, y in walls:
+            self.grid.states[self.grid.index(x, y)] = -1
+
+
+class FieldOfViewTest(unittest.TestCase):
+
+    def test_open_map(self):
+        fov = FieldOfView(Map(21, 21), 4)
+        expected = set((x, y) for x in range(21) for y in range(21) if (x - 10) ** 2 + (y - 10) ** 2 <= 16)
+        self.assertEqual(fov.visible((10, 10)), expected)
+
+    def test_border_of_the_map(self):
+        fov = FieldOfView(Map(5, 5), 3)
+        visible = fov.visible((0, 0))
+        self.assertTrue(all(0 <= x < 5 and 0 <= y < 5 for x, y in visible))
+        self.assertTrue((0, 0) in visible and (3, 0) in visible and (2, 2) in visible)
+
+    def test_walls_block_the_sight(self):
+        # a wall across the map at x = 7, with a gap at y = 10
+        walls = [(7, y) for y in range(21) if y != 10]
+        fov = FieldOfView(Map(21, 21, walls), 6)
+        visible = fov.visible((5, 10))
+        self.assertTrue((7, 8) in visible)
+        self.assertTrue((8, 10) in visible and (10, 10) in visible)
+        self.assertFalse((9, 5) in visible)
+        self.assertFalse((8, 14) in visible)
+
+    def test_creatures_do_not_block_the_sight(self):
+        env = Map(21, 21, [(11, 10)])
+        env.occupancy.add('creature', (11, 10))
+        self.assertTrue((13, 10) in FieldOfView(env, 5).visible((10, 10)))
+
+    def test_cache(self):
+        fov = FieldOfView(Map(41, 41), 4)
+        view = fov.visible((10, 10))
+        self.assertTrue(fov.visible((10, 10)) is view)
+        self.assertEqual(fov.computed, 1)
+        fov.invalidate((30, 30))
+        self.assertTrue(fov.visible((10, 10)) is view)
+        fov.invalidate((12, 11))
+        self.assertFalse(fov.visible((10, 10)) is view)
+        self.assertEqual(fov.computed, 2)
+
+    def test_visible_from(self):
+        fov = FieldOfView(Map(41, 41), 4)
+        union = fov.visible_from([(10, 10), (20, 20)])
+        self.assertEqual(union, fov.visible((10, 10)) | fov.visible((20, 20)))
+        self.assertTrue(fov.visible_from([(10, 10), (20, 20)]) is union)
+
+    def test_max_views(self):
+        fov = FieldOfView(Map(41, 41), 2)
+        fov.MAX_VIEWS = 10
+        for x in range(30):
+            fov.visible((x, 5))
+        self.assertTrue(len(fov.views) <= 10)
+        self.assertTrue(all(origin in fov.views for origins in fov.buckets.values() for origin in origins))
+
+
+if __name__ == '__main__':
+    unittest.main()
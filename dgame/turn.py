@@ -0,0 +1,85 @@
+# coding=utf-8
+'''
+Resolving the turns of the creatures that are not controlled by the player.
+'''
+from dgame.stats import stats
+
+
+class TurnScheduler(object):
+    '''
+    Moves all creatures of the environment that are not heros at the end of a turn.
+
+    A turn is resolved in rounds. In every round each creature with moves left plans
+    one step by calling plan(creature), which returns the position to step to or None.
+    When several creatures step to the same position, the one that comes first in the
+    creatures of the environment gets it. A step to a position that another creature
+    leaves in the same round succeeds if the step of that creature succeeds, creatures
+    stepping in a circle stay where they are. The accepted steps of a round are applied
+    to the grid at once.
+
+    '''
+
+    def __init__(self, env, plan = None):
+        self.env = env
+        self.plan = plan or self.chase_heros
+        self.moved = 0  # number of steps made in the last turn
+        self.blocked = 0  # number of planned steps that were rejected in the last turn
+
+    def chase_heros(self, creature):
+        '''Step towards the nearest hero.'''
+        return self.env.hero_distances.next_step(creature.position)
+
+    @stats.timed('TurnScheduler.run')
+    def run(self):
+        '''Move the creatures until they used their moves, then give them new ones.'''
+        self.moved = self.blocked = 0
+        heros = set(self.env.player.heros)
+        creatures = [c for c in self.env.creatures if c not in heros]
+        if self.plan == self.chase_heros:
+            self.env.hero_distances.update()
+        active = [c for c in creatures if c.moves > 0]
+        while active:
+            steps = {}
+            claimed = set()
+            planned = 0
+            for creature in active:
+                creature.moves -= 1
+                target = self.plan(creature)
+                if target is None:
+                    continue
+                planned += 1
+                if target not in claimed:
+                    claimed.add(target)
+                    steps[creature] = target
+            accepted = self.resolve(steps)
+            self.env.move_creatures(accepted)
+            self.moved += len(accepted)
+            self.blocked += planned - len(accepted)
+            active = [c for c in active if c.moves > 0]
+        for creature in creatures:
+            creature.end_turn()
+
+    def resolve(self, steps):
+        '''Get the steps of a dict of creature: position, whose position is free or left by an accepted step.'''
+        leaving = dict((creature.position, creature) for creature in steps)
+        accepted = {}
+        for creature in steps:
+            chain = []
+            in_chain = set()
+            while creature not in accepted and creature not in in_chain:
+                chain.append(creature)
+                in_chain.add(creature)
+                target = steps[creature]
+                if self.env.passable(target):
+                    result = True
+                    break
+                creature = leaving.get(target)
+                if creature is None:
+                    result = False
+                    break
+            else:
+                # a creature that was resolved before, or a circle
+                result = accepted.get(creature, False)
+            for c in chain:
+                accepted[c] = result
+        return [(c, steps[c]) for c in steps if accepted[c]]
@@ -5,10 +5,21 @@ The ui module includes components that are visible in the game.
 from __future__ import division
 import pygame
 import math
+import collections
+from dgame.stats import stats
+
+
+Frame = collections.namedtuple('Frame', 'x y width height tile_width tile_height x_min y_min x_max y_max')
 
 
 class Viewport(object):
-    '''The viewport of the main camera object that shows the map.'''
+    '''
+    The viewport of the main camera object that shows the map.
+
+    The position and size of the visible part of the map are computed once per scroll
+    or zoom change into a Frame, the properties read them from there.
+
+    '''
 
     ZOOM_IN = 1
     ZOOM_OUT = 2
@@ -19,6 +30,7 @@ class Viewport(object):
     SCROLL_RIGHT = 4
 
     def __init__(self, offset, size, tile_size, env_size, zoom_level = 1.0, zoom_levels = [], scroll_speed = 0.5):
+        self._frame = None
         self._x, self._y = offset
         self._width, self._height = size
         self._tile_width, self._tile_height = tile_size
@@ -29,14 +41,40 @@ class Viewport(object):
         self._orig_width = size[0] / tile_size[0]
         self._orig_height = size[1] / tile_size[1]
 
+    def __setattr__(self, name, value):
+        # every attribute but the frame itself is part of the frame
+        if name != '_frame':
+            object.__setattr__(self, '_frame', None)
+        object.__setattr__(self, name, value)
+
     @property
-    def x(self):
-        x = self._x - ((self.width - self._orig_width) / 2)
+    def frame(self):
+        '''The Frame of the current scroll position and zoom level.'''
+        if self._frame is None:
+            self._frame = self._compute_frame()
+        return self._frame
+
+    def _compute_frame(self):
+        tile_width = self._tile_width * self.zoom_level
+        tile_height = self._tile_height * self.zoom_level
+        width = self._width / tile_width
+        height = self._height / tile_height
+        x = self._x - ((width - self._orig_width) / 2)
         if x <= 0.0:
-            return 0.0
-        if x >= self.env_width - self.width:
-            return self.env_width - self.width
-        return x
+            x = 0.0
+        elif x >= self.env_width - width:
+            x = self.env_width - width
+        y = self._y - ((height - self._orig_height) / 2)
+        if y <= 0.0:
+            y = 0.0
+        elif y >= self.env_height - height:
+            y = self.env_height - height
+        return Frame(x, y, width, height, tile_width, tile_height,
+                     int(math.floor(x)), int(math.floor(y)), int(math.ceil(x + width)), int(math.ceil(y + height)))
+
+    @property
+    def x(self):
+        return self.frame.x
 
     @x.setter
     def x(self, v):
@@ -44,12 +82,7 @@ class Viewport(object):
 
     @property
     def y(self):
-        y = self._y - ((self.height - self._orig_height) / 2)
-        if y <= 0.0:
-            return 0.0
-        if y >= self.env_height - self.height:
-            return self.env_height - self.height
-        return y
+        return self.frame.y
 
     @y.setter
     def y(self, v):
@@ -57,7 +90,7 @@ class Viewport(object):
 
     @property
     def width(self):
-        return self._width / self.tile_width
+        return self.frame.width
 
     @width.setter
     def width(self, v):
@@ -65,7 +98,7 @@ class Viewport(object):
 
     @property
     def height(self):
-        return self._height / self.tile_height
+        return self.frame.height
 
     @height.setter
     def height(self, v):
@@ -73,7 +106,7 @@ class Viewport(object):
 
     @property
     def tile_width(self):
-        return self._tile_width * self.zoom_level
+        return self.frame.tile_width
 
     @tile_width.setter
     def tile_width(self, v):
@@ -81,7 +114,7 @@ class Viewport(object):
 
     @property
     def tile_height(self):
-        return self._tile_height * self.zoom_level
+        return self.frame.tile_height
 
     @tile_height.setter
     def tile_height(self, v):
@@ -89,34 +122,34 @@ class Viewport(object):
 
     @property
     def x_min(self):
-        return int(math.floor(self.x))
+        return self.frame.x_min
 
     @property
     def x_max(self):
-        return int(math.ceil(self.x + (self.width)))
+        return self.frame.x_max
 
     @property
     def y_min(self):
-        return int(math.floor(self.y))
+        return self.frame.y_min
 
     @property
     def y_max(self):
-        return int(math.ceil(self.y + (self.height)))
-
-    def scroll(self, direction):
-        '''Move the viewport self.scroll_speed pixels in the given direction'''
-        if direction == self.SCROLL_UP \
-        and self.y - self.scroll_speed >= 0:
-                self._y -= self.scroll_speed
-        elif direction == self.SCROLL_DOWN \
-        and self.y + self.scroll_speed <= self.env_height - self.height:
-                self._y += self.scroll_speed
-        elif direction == self.SCROLL_LEFT \
-        and self.x - self.scroll_speed >= 0:
-                self._x -= self.scroll_speed
-        elif direction == self.SCROLL_RIGHT \
-        and self.x + self.scroll_speed <= self.env_width - self.width:
-                self._x += self.scroll_speed
+        return self.frame.y_max
+
+    def scroll(self, direction, times = 1):
+        '''Move the viewport self.scroll_speed tiles in the given direction times, as far as the map reaches'''
+        if direction == self.SCROLL_UP:
+            self._y -= self.scroll_speed * self._steps(self.y, times)
+        elif direction == self.SCROLL_DOWN:
+            self._y += self.scroll_speed * self._steps(self.env_height - self.height - self.y, times)
+        elif direction == self.SCROLL_LEFT:
+            self._x -= self.scroll_speed * self._steps(self.x, times)
+        elif direction == self.SCROLL_RIGHT:
+            self._x += self.scroll_speed * self._steps(self.env_width - self.width - self.x, times)
+
+    def _steps(self, space, times):
+        '''How many of times steps of scroll_speed fit into space.'''
+        return max(0, min(times, int(math.floor(space / self.scroll_speed))))
 
     def zoom(self, direction):
         '''Zoom the viewport related to the defined zoom_levels in the given direction'''
@@ -128,27 +161,77 @@ class Viewport(object):
 
     def blit(self, surface, el):
         '''Blit an image on the viewport.'''
-        surface.blit(el.ui.image[self.zoom_level],
-                     self.get_rect(el.x, el.y))
+        self.blit_image(surface, el.ui.image, el.x, el.y)
+
+    def blit_image(self, surface, image, x, y):
+        '''Blit the zoomed version of image at the map position x, y.'''
+        surface.blit(image[self.zoom_level],
+                     self.get_rect(x, y))
 
     def get_rect(self, x, y):
-        return pygame.Rect(((x - self.x) * self.tile_width,
-                            (y - self.y) * self.tile_height),
-                           (int(self.tile_width),
-                            int(self.tile_height)))
+        return pygame.Rect(self.rect(x, y))
+
+    def rect(self, x, y):
+        '''The rect of the tile at the map position x, y on the viewport, as (left, top, width, height).'''
+        f = self.frame
+        return (int(round((x - f.x) * f.tile_width)), int(round((y - f.y) * f.tile_height)),
+                int(f.tile_width), int(f.tile_height))
+
+    def rects(self, positions):
+        '''The rects of the tiles at map positions, like rect.'''
+        f = self.frame
+        x0, y0, tile_width, tile_height = f.x, f.y, f.tile_width, f.tile_height
+        width, height = int(tile_width), int(tile_height)
+        return [(int(round((x - x0) * tile_width)), int(round((y - y0) * tile_height)), width, height)
+                for x, y in positions]
+
+
+OverlayLayer = collections.namedtuple('OverlayLayer', 'key items bounds surface')
 
 
 class Map(pygame.sprite.Sprite):
-    '''The camera shows a part of the current game environment aka map.'''
+    '''
+    The camera shows a part of the current game environment aka map.
+
+    In incremental mode the floor is rendered once per scroll or zoom change and only
+    the rectangles of creatures and overlay elements that changed since the last
+    frame are repainted. dirty_rects holds those rectangles after each update.
+
+    The overlay consists of the layers in OVERLAY_LAYERS. A layer is rendered again
+    only when its input changed, e.g. the active hero, its moves or the hovered tile,
+    and is composited onto the map only within its bounding rect.
 
-    def __init__(self, rect, env, offset = [0.0, 0.0], zoom_levels = [1.0], zoom_level = 1.0, scroll_speed = 0.5):
+    With a planner the moves of the active hero and the path to the hovered tile are
+    searched in its worker processes, the overlay shows the last completed searches.
+
+    With fog only the heros and the creatures they can see are shown.
+
+    '''
+
+    MAX_DIRTY_RECTS = 64
+    OVERLAY_LAYERS = ('selection', 'range', 'path')
+
+    def __init__(self, rect, env, offset = [0.0, 0.0], zoom_levels = [1.0], zoom_level = 1.0, scroll_speed = 0.5, incremental = True,
+                 floor_cache_size = 64 * 1024 * 1024, planner = None, fog = False):
         super(Map, self).__init__()
         self.env = env
+        self.planner = planner
+        self.fog = fog
         self.rect = rect
+        self.incremental = incremental
         self.image = pygame.Surface(rect.size).convert()
+        self.floor = pygame.Surface(rect.size).convert()
         self.overlay = pygame.Surface(rect.size).convert()
         self.overlay.set_alpha(64)
+        self.overlay.set_colorkey(0)
         self.viewport = Viewport(offset, rect.size, env.tile_size, env.size, zoom_level, zoom_levels, scroll_speed)
+        self.floor_cache = FloorCache(env, floor_cache_size)
+        self.dirty_rects = []
+        self._view = None
+        self._sprites = []
+        self._overlay = []
+        self._layers = {}
+        self._stamps = {}
 
     @property
     def hover_tile(self):
@@ -158,54 +241,174 @@ class Map(pygame.sprite.Sprite):
             return False
         x = int(((mouse_x / self.viewport.tile_width)) + self.viewport.x)
         y = int(((mouse_y / self.viewport.tile_height)) + self.viewport.y)
-        return self.env.tiles[x][y]
+        if not self.env.grid.contains(x, y):
+            return False
+        return self.env.get_tile((x, y))
+
+    def invalidate(self):
+        '''Render the floor and repaint the whole camera on the next update, e.g. after the window was exposed.'''
+        self._view = None
 
+    @stats.timed('Map.update')
     def update(self):
         '''Update the camera.'''
-        self.image.fill((200, 200, 200))
-        v_tiles, v_positions = self._get_visible()
-        # draw floor
-        for tile in v_tiles:
-            self.viewport.blit(self.image, tile)
-        # draw creatures
-        for c in self.env.creatures:
-            if c.position in v_positions:
-                self.viewport.blit(self.image, c)
-        self.update_overlay()
-
+        view = (self.viewport.x, self.viewport.y, self.viewport.zoom_level)
+        sprites = self.update_sprites()
+        overlay = self.update_overlay()
+        if not self.incremental or view != self._view:
+            self._view = view
+            self.env.prefetch(self.viewport.x_min, self.viewport.y_min, self.viewport.x_max, self.viewport.y_max)
+            self.update_floor()
+            self.dirty_rects = [self.image.get_rect()]
+        else:
+            dirty = [pygame.Rect(item[0]) for item in set(sprites).symmetric_difference(self._sprites)]
+            if overlay is not self._overlay:
+                dirty.extend(pygame.Rect(self._overlay_rect(item)) for item in set(overlay).symmetric_difference(self._overlay))
+            self.dirty_rects = [rect.clip(self.image.get_rect()) for rect in dirty]
+            if len(self.dirty_rects) > self.MAX_DIRTY_RECTS:
+                self.dirty_rects = [self.dirty_rects[0].unionall(self.dirty_rects[1:])]
+        self._sprites = sprites
+        self._overlay = overlay
+        for rect in self.dirty_rects:
+            self._repaint(rect)
+
+    def draw(self, surface):
+        '''Blit the parts of the camera that changed on surface, return them in surface coordinates.'''
+        rects = []
+        for rect in self.dirty_rects:
+            dest = rect.move(self.rect.topleft)
+            surface.blit(self.image, dest, rect)
+            rects.append(dest)
+        return rects
+
+    def update_floor(self):
+        '''Render the visible tiles from the chunks of the floor cache.'''
+        self.floor.fill((200, 200, 200))
+        size = FloorCache.CHUNK_SIZE
+        f = self.viewport.frame
+        x_max = f.x_max if f.x_max <= self.env.width else self.env.width
+        y_max = f.y_max if f.y_max <= self.env.height else self.env.height
+        blits = []
+        for cx in range(f.x_min // size, (x_max - 1) // size + 1):
+            for cy in range(f.y_min // size, (y_max - 1) // size + 1):
+                chunk = self.floor_cache.get(cx, cy, self.viewport.zoom_level)
+                blits.append((chunk, (int(round((cx * size - f.x) * f.tile_width)),
+                                      int(round((cy * size - f.y) * f.tile_height)))))
+        self.floor.blits(blits, 0)
+
+    def update_sprites(self):
+        '''Collect the visible creatures as (rect, atlas surface, area) items.'''
+        f = self.viewport.frame
+        creatures = self.env.occupancy.within(f.x_min, f.y_min, f.x_max, f.y_max)
+        if self.fog:
+            visible = self.env.visible_positions
+            heros = self.env.player.heros
+            creatures = [c for c in creatures if c.position in visible or c in heros]
+        sprites = []
+        zoom_level = self.viewport.zoom_level
+        for c, rect in zip(creatures, self.viewport.rects([c.position for c in creatures])):
+            surface, area = c.ui.image.area(zoom_level)
+            sprites.append((rect, surface, area))
+        return sprites
+
+    @stats.timed('Map.update_overlay')
     def update_overlay(self):
-        '''Update ui response elements.'''
-        self.overlay.fill(0)
-        # mark active hero
-        x, y = self.env.player.active_hero.position
-        pygame.draw.rect(self.overlay, (200, 200, 100), self.viewport.get_rect(x, y), 2)
-        # draw possible moves
-        for x, y in self.env.player.active_hero.reachable_positions:
-            pygame.draw.rect(self.overlay, (155, 155, 155), self.viewport.get_rect(x, y))
-        # calc and show path from active hero to hovered tile
-        self.highlight_path(self.env.player.active_hero.position, self.hover_tile)
-        self.image.blit(self.overlay, (0, 0))
-
+        '''Collect ui response elements as (rect, color, width) items, the same list while no layer changed.'''
+        hero = self.env.player.active_hero
+        hover = self.hover_tile
+        end = hover.position if hover else None
+        frame = self.viewport.frame
+        planned_range = planned_path = None
+        if self.planner:
+            # the results of the planner are part of the input, they arrive later
+            planned_range = self.planner.reachable(hero.position, hero.moves)
+            planned_path = self.planner.path(hero.position, end) if end else None
+        keys = {'selection': (frame, hero.position),
+                'range': (frame, hero, hero.position, hero.moves, self.env.revision, planned_range),
+                'path': (frame, hero.position, end, self.env.revision, planned_path)}
+        changed = False
+        for name in self.OVERLAY_LAYERS:
+            layer = self._layers.get(name)
+            if layer is None or layer.key != keys[name]:
+                items = getattr(self, '_{}_items'.format(name))(hero, hover)
+                self._layers[name] = self._render_layer(keys[name], items)
+                changed = True
+        if not changed:
+            return self._overlay
+        return [item for name in self.OVERLAY_LAYERS for item in self._layers[name].items]
+
+    def _selection_items(self, hero, hover):
+        '''Mark the active hero.'''
+        return [(self.viewport.rect(*hero.position), (200, 200, 100), 2)]
+
+    def _range_items(self, hero, hover):
+        '''Show the possible moves of the active hero.'''
+        if self.planner:
+            reachable = self.planner.reachable(hero.position, hero.moves)
+        else:
+            reachable = hero.reachable_positions
+        return [(rect, (155, 155, 155), 0) for rect in self.viewport.rects(reachable)]
+
+    def _path_items(self, hero, hover):
+        '''Show the path from the active hero to the hovered tile.'''
+        return self.highlight_path(hero.position, hover)
+
+    def _render_layer(self, key, items):
+        '''Draw items on a surface of their bounding rect.'''
+        if not items:
+            return OverlayLayer(key, items, None, None)
+        rects = [self._overlay_rect(item) for item in items]
+        bounds = pygame.Rect(rects[0]).unionall(rects[1:])
+        surface = pygame.Surface(bounds.size).convert()
+        surface.fill(0)
+        surface.set_colorkey(0)
+        surface.blits([(self._stamp(item[1], item[2], item[0][2:]), (r[0] - bounds.x, r[1] - bounds.y))
+                       for item, r in zip(items, rects)], 0)
+        return OverlayLayer(key, items, bounds, surface)
+
+    @stats.timed('Map.highlight_path')
     def highlight_path(self, start, end, color = (255, 255, 255)):
         '''Highlight a path. with color'''
-        if end:
-            start = self.env.get_tile(start)
-            p = self.env.path_finder.find_path(start, end)
-            if p:
-                for n in p.nodes:
-                    pygame.draw.rect(self.overlay, color, self.viewport.get_rect(n.location.x, n.location.y))
-
-    def _get_visible(self):
-        '''Get the current visible tiles.'''
-        v_tiles = []
-        v_positions = set()
-        x_max = self.viewport.x_max if self.viewport.x_max <= self.env.width else self.env.width
-        y_max = self.viewport.y_max if self.viewport.y_max <= self.env.height else self.env.height
-        for x in range(self.viewport.x_min, x_max):
-            for y in range(self.viewport.y_min, y_max):
-                v_tiles.append(self.env.tiles[x][y])
-                v_positions.add((x, y))
-        return v_tiles, v_positions
+        positions = []
+        if end and self.planner:
+            positions = self.planner.path(start, end.position) or []
+        elif end:
+            positions = self.env.search_tree(start).path_to(end.position) or []
+        return [(rect, color, 0) for rect in self.viewport.rects(positions)]
+
+    def _overlay_rect(self, item):
+        '''Bounding rect of an overlay item, outlines are drawn across the border of their rect.'''
+        (x, y, width, height), _, border = item
+        return (x - border, y - border, width + 2 * border, height + 2 * border)
+
+    def _stamp(self, color, border, size):
+        '''A surface with an overlay item of color, border and size drawn at (border, border).'''
+        key = (color, border, size)
+        stamp = self._stamps.get(key)
+        if stamp is None:
+            width, height = size
+            stamp = pygame.Surface((width + 2 * border, height + 2 * border)).convert()
+            stamp.fill(0)
+            stamp.set_colorkey(0)
+            pygame.draw.rect(stamp, color, (border, border, width, height), border)
+            stamp = self._stamps[key] = stamp
+        return stamp
+
+    def _repaint(self, rect):
+        '''Repaint floor, creatures and overlay inside rect.'''
+        self.image.set_clip(rect)
+        self.image.blit(self.floor, rect, rect)
+        self.image.blits([(surface, r, area) for r, surface, area in self._sprites if rect.colliderect(r)], 0)
+        layers = [layer for layer in (self._layers.get(name) for name in self.OVERLAY_LAYERS)
+                  if layer and layer.bounds and rect.colliderect(layer.bounds)]
+        if layers:
+            area = rect.clip(layers[0].bounds.unionall([layer.bounds for layer in layers[1:]]))
+            self.overlay.set_clip(area)
+            self.overlay.fill(0, area)
+            self.overlay.blits([(layer.surface, layer.bounds) for layer in layers], 0)
+            self.image.blit(self.overlay, area, area)
+            self.overlay.set_clip(None)
+        self.image.set_clip(None)
 
     def zoom_in(self):
         self.viewport.zoom(self.viewport.ZOOM_IN)
@@ -213,17 +416,69 @@ class Map(pygame.sprite.Sprite):
     def zoom_out(self):
         self.viewport.zoom(self.viewport.ZOOM_OUT)
 
-    def scroll_up(self):
-        self.viewport.scroll(self.viewport.SCROLL_UP)
+    def scroll_up(self, times = 1):
+        self.viewport.scroll(self.viewport.SCROLL_UP, times)
+
+    def scroll_down(self, times = 1):
+        self.viewport.scroll(self.viewport.SCROLL_DOWN, times)
+
+    def scroll_left(self, times = 1):
+        self.viewport.scroll(self.viewport.SCROLL_LEFT, times)
+
+    def scroll_right(self, times = 1):
+        self.viewport.scroll(self.viewport.SCROLL_RIGHT, times)
 
-    def scroll_down(self):
-        self.viewport.scroll(self.viewport.SCROLL_DOWN)
 
-    def scroll_left(self):
-        self.viewport.scroll(self.viewport.SCROLL_LEFT)
+class FloorCache(object):
+    '''
+    The floor of the environment baked into chunks of CHUNK_SIZE x CHUNK_SIZE tiles.
 
-    def scroll_right(self):
-        self.viewport.scroll(self.viewport.SCROLL_RIGHT)
+    Chunks are rendered per zoom level when they are needed first. Once the chunks
+    use more than size bytes, the least recently used ones are dropped.
+
+    '''
+
+    CHUNK_SIZE = 16
+
+    def __init__(self, env, size = 64 * 1024 * 1024):
+        self.env = env
+        self.size = size
+        self.used = 0
+        self.chunks = collections.OrderedDict()
+
+    def get(self, cx, cy, zoom_level):
+        '''Get the chunk surface at chunk position cx, cy for zoom_level.'''
+        key = (cx, cy, zoom_level)
+        chunk = self.chunks.pop(key, None)
+        if chunk is None:
+            chunk = self._render(cx, cy, zoom_level)
+            self.used += self._bytes(chunk)
+            while self.chunks and self.used > self.size:
+                self.used -= self._bytes(self.chunks.popitem(last = False)[1])
+        self.chunks[key] = chunk
+        return chunk
+
+    def clear(self):
+        self.chunks.clear()
+        self.used = 0
+
+    def _bytes(self, surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def _render(self, cx, cy, zoom_level):
+        tile_width = int(self.env.tile_width * zoom_level)
+        tile_height = int(self.env.tile_height * zoom_level)
+        x_min, y_min = cx * self.CHUNK_SIZE, cy * self.CHUNK_SIZE
+        x_max = min(x_min + self.CHUNK_SIZE, self.env.width)
+        y_max = min(y_min + self.CHUNK_SIZE, self.env.height)
+        chunk = pygame.Surface(((x_max - x_min) * tile_width, (y_max - y_min) * tile_height)).convert()
+        blits = []
+        for x in range(x_min, x_max):
+            for y in range(y_min, y_max):
+                surface, area = self.env.get_image((x, y)).area(zoom_level)
+                blits.append((surface, ((x - x_min) * tile_width, (y - y_min) * tile_height), area))
+        chunk.blits(blits, 0)
+        return chunk
 
 
 class FpsLayer(pygame.sprite.Sprite):
@@ -241,6 +496,38 @@ class FpsLayer(pygame.sprite.Sprite):
         self.rect = pygame.Rect(self.position, self.image.get_rect().size)
 
 
+class StatsLayer(pygame.sprite.Sprite):
+    '''Sprite to show the timing of the instrumented sections, refreshed every few frames.'''
+
+    def __init__(self, font, stats, position, every = 30):
+        super(StatsLayer, self).__init__()
+        self.font = font
+        self.stats = stats
+        self.position = position
+        self.every = every
+        self.frame = 0
+        self.render()
+
+    def update(self, *args):
+        self.frame += 1
+        if self.frame % self.every == 0:
+            self.render()
+
+    def render(self):
+        lines = ['{:<32} {:>8} {:>8} {:>8}'.format('section', 'p50 ms', 'p95 ms', 'p99 ms')]
+        for name in sorted(self.stats.samples):
+            lines.append('{:<32} {:8.3f} {:8.3f} {:8.3f}'.format(name,
+                                                                 self.stats.percentile(name, 50),
+                                                                 self.stats.percentile(name, 95),
+                                                                 self.stats.percentile(name, 99)))
+        line_height = self.font.get_linesize()
+        self.image = pygame.Surface((max(self.font.size(l)[0] for l in lines), line_height * len(lines))).convert()
+        self.image.fill((200, 200, 200))
+        for i, line in enumerate(lines):
+            self.image.blit(self.font.render(line, True, (10, 10, 10)), (0, i * line_height))
+        self.rect = pygame.Rect(self.position, self.image.get_rect().size)
+
+
 class Entity(object):
     '''An entity represents moving creatures on the map.'''
 
@@ -250,8 +537,16 @@ class Entity(object):
 
 
 class Floor(object):
-    '''A tile is field on the map.'''
+    '''The look of a tile, stored in the image layer of the environment.'''
+
+    def __init__(self, env, index):
+        self.env = env
+        self.index = index
+
+    @property
+    def image(self):
+        return self.env.images[self.env.grid.images[self.index]]
 
-    def __init__(self, biome, image):
-        self.biome = biome
-        self.image = biome.unpassable
+    @image.setter
+    def image(self, v):
+        self.env.grid.images[self.index] = self.env.image_id(v)
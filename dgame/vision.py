@@ -0,0 +1,130 @@
+# coding=utf-8
+'''
+What the creatures can see, computed by recursive shadowcasting over the grid.
+'''
+from dgame.stats import stats
+
+PASSABLE = 1
+
+# transformations of the first octant to the others: x, y = dx * xx + dy * xy, dx * yx + dy * yy
+OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+           (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+
+class FieldOfView(object):
+    '''
+    The positions visible from an origin within radius, cached per origin.
+
+    Tiles that are not passable and have no creature on them block the sight, they are
+    visible themselves. The views are kept until invalidate is called with a position
+    in the square of the radius around their origin, or MAX_VIEWS views are cached.
+
+    '''
+
+    MAX_VIEWS = 1024
+
+    def __init__(self, env, radius):
+        self.env = env
+        self.radius = radius
+        self.bucket_size = radius + 1
+        self.views = {}  # origin -> frozenset of visible positions
+        self.buckets = {}  # bucket -> set of origins whose square overlaps it
+        self.computed = 0
+        self._union = (None, None)
+
+    def visible(self, origin):
+        '''The frozenset of positions visible from origin, including origin.'''
+        view = self.views.get(origin)
+        if view is None:
+            if len(self.views) >= self.MAX_VIEWS:
+                self.views.clear()
+                self.buckets.clear()
+            view = self.views[origin] = self._compute(origin)
+            for bucket in self._covered(origin):
+                self.buckets.setdefault(bucket, set()).add(origin)
+        return view
+
+    def visible_from(self, origins):
+        '''The frozenset of positions visible from any of origins.'''
+        views = [self.visible(origin) for origin in origins]
+        last_views, union = self._union
+        if last_views is None or len(last_views) != len(views) or any(a is not b for a, b in zip(last_views, views)):
+            union = frozenset().union(*views)
+            self._union = (views, union)
+        return union
+
+    def invalidate(self, *positions):
+        '''Forget the views that may have changed at positions.'''
+        if not self.views:
+            return
+        size = self.bucket_size
+        changed = set((x // size, y // size) for x, y in positions)
+        for bucket in changed.intersection(self.buckets):
+            for origin in self.buckets.pop(bucket):
+                if self.views.pop(origin, None) is not None:
+                    for other in self._covered(origin):
+                        origins = self.buckets.get(other)
+                        if origins is not None:
+                            origins.discard(origin)
+                            if not origins:
+                                del self.buckets[other]
+
+    def _covered(self, origin):
+        size = self.bucket_size
+        x, y = origin
+        return [(bx, by)
+                for bx in range((x - self.radius) // size, (x + self.radius) // size + 1)
+                for by in range((y - self.radius) // size, (y + self.radius) // size + 1)]
+
+    @stats.timed('FieldOfView.compute')
+    def _compute(self, origin):
+        self.computed += 1
+        env = self.env
+        states = env.grid.states
+        width = env.width
+        occupants = env.occupancy.positions
+
+        def blocks(x, y):
+            return states[y * width + x] != PASSABLE and (x, y) not in occupants
+
+        visible = set([origin])
+        for xx, xy, yx, yy in OCTANTS:
+            self._cast(visible, blocks, origin, 1, 1.0, 0.0, xx, xy, yx, yy)
+        return frozenset(visible)
+
+    def _cast(self, visible, blocks, origin, row, start, end, xx, xy, yx, yy):
+        '''Scan the rows of an octant from row on between the slopes start and end.'''
+        if start < end:
+            return
+        ox, oy = origin
+        width, height = self.env.width, self.env.height
+        radius = self.radius
+        radius_squared = radius * radius
+        new_start = start
+        for j in range(row, radius + 1):
+            dx, dy = -j - 1, -j
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                x, y = ox + dx * xx + dy * xy, oy + dx * yx + dy * yy
+                left_slope, right_slope = (dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5)
+                if start < right_slope:
+                    continue
+                if end > left_slope:
+                    break
+                inside = 0 <= x < width and 0 <= y < height
+                if inside and dx * dx + dy * dy <= radius_squared:
+                    visible.add((x, y))
+                opaque = not inside or blocks(x, y)
+                if blocked:
+                    if opaque:
+                        new_start = right_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque and j < radius:
+                    blocked = True
+                    self._cast(visible, blocks, origin, j + 1, start, left_slope, xx, xy, yx, yy)
+                    new_start = right_slope
+            if blocked:
+                break